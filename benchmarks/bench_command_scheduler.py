@@ -0,0 +1,237 @@
+# bench_command_scheduler.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_command_scheduler.py)
+#
+# Comandos a dispositivos publicados directamente frente a core_logic/command_scheduler.py, con la
+# flota Tasmota simulada de benchmarks/mqtt_fleet.py sobre el broker en proceso. Escenarios:
+#
+#   toggle_storm   -> varios clientes (paneles, automatizaciones) alternan ON/OFF sobre las mismas entidades
+#   retries        -> cada comando se repite 3 veces seguidas (reintentos de un cliente impaciente)
+#   scene_flood    -> escenas que encienden y apagan todas las entidades varias veces en pocos milisegundos
+#   isolated       -> comandos sueltos a entidades en reposo: latencia hasta que el dispositivo lo recibe
+#
+# Por escenario: comandos pedidos, mensajes cmnd recibidos por los dispositivos, máximo por
+# dispositivo en cualquier segundo y entidades cuyo estado final no es el último pedido.
+# Termina con código 1 si con el planificador algún estado final no coincide, si no reduce los
+# mensajes de toggle_storm o si algún dispositivo supera su límite (fichas iniciales + frecuencia).
+#
+# Uso: python benchmarks/bench_command_scheduler.py --devices 50 --relays 2 --clients 4 --commands 400
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeMQTTBroker
+from benchmarks.mqtt_fleet import AppSide, TasmotaFleet
+from core_logic.command_scheduler import CommandScheduler
+
+class RecordingFleet(TasmotaFleet):
+    """
+    Flota que anota cuándo recibe cada dispositivo un comando.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.received = {} # {topic del dispositivo: [instantes]}
+        self._received_lock = threading.Lock()
+
+    def _on_command(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        device = self.by_topic.get(parts[1]) if len(parts) == 3 else None
+        if device is not None and self._client_for(device) is client:
+            with self._received_lock:
+                self.received.setdefault(device.topic, []).append(time.perf_counter())
+        super()._on_command(client, userdata, msg)
+
+    def reset(self):
+        with self._received_lock:
+            self.received = {}
+
+def max_per_second(received):
+    """
+    Máximo de comandos recibidos por un dispositivo en cualquier ventana de 1 s.
+    """
+    peak = 0
+    for times in received.values():
+        start = 0
+        for end in range(len(times)):
+            while times[end] - times[start] > 1.0:
+                start += 1
+            peak = max(peak, end - start + 1)
+    return peak
+
+class Requester:
+    """
+    Envía comandos por HomeAssistantAPI y recuerda el último estado pedido por entidad.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.requested = 0
+        self.last = {} # {entity_id: estado}
+        self._lock = threading.Lock()
+
+    def send(self, entity_id, state):
+        # Con el cerrojo, "el último pedido" es también el último en llegar al planificador o a paho
+        with self._lock:
+            self.app.api.send_tasmota_command(entity_id, state)
+            self.requested += 1
+            self.last[entity_id] = state
+
+def toggle_storm(requester, entities, clients, commands, seed):
+    def worker(index):
+        rng = random.Random(seed + index)
+        for _ in range(commands // clients):
+            requester.send(rng.choice(entities), rng.choice(("ON", "OFF")))
+            time.sleep(rng.uniform(0, 0.002))
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def retries(requester, entities, seed):
+    rng = random.Random(seed)
+    for entity_id in entities:
+        state = rng.choice(("ON", "OFF"))
+        for _ in range(3):
+            requester.send(entity_id, state)
+
+def scene_flood(requester, entities, scenes=4):
+    for scene in range(scenes):
+        for entity_id in entities:
+            requester.send(entity_id, "ON" if scene % 2 == 0 else "OFF")
+        time.sleep(0.01)
+
+def isolated(requester, entities, fleet, pause_s):
+    """
+    Un comando cada 'pause_s' (más que la ventana de fusión), cada vez a otra entidad y cambiando su
+    estado: con el planificador deben salir en el acto. Devuelve las latencias hasta el dispositivo.
+    """
+    latencies = []
+    for entity_id in entities:
+        device, relay = device_relay(requester.app, fleet, entity_id)
+        before = len(fleet.received.get(device.topic, []))
+        started = time.perf_counter()
+        requester.send(entity_id, "OFF" if device.power[relay] == "ON" else "ON")
+        while len(fleet.received.get(device.topic, [])) == before and time.perf_counter() - started < 2.0:
+            time.sleep(0.0002)
+        if len(fleet.received.get(device.topic, [])) > before:
+            latencies.append(fleet.received[device.topic][before] - started)
+        time.sleep(pause_s)
+    return latencies
+
+def device_relay(app, fleet, entity_id):
+    _, topic, key = app.api.ha_entity_info[entity_id]["command_topic"].split("/")
+    return fleet.by_topic[topic], int(key[5:] or 1) - 1
+
+def settle(app, fleet, timeout_s=15.0):
+    """
+    Espera a que el planificador se vacíe y los ecos dejen de llegar.
+    """
+    deadline = time.perf_counter() + timeout_s
+    scheduler = app.api.command_scheduler
+    while scheduler and scheduler.pending_count() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    handled = -1
+    while handled != fleet.commands_handled and time.perf_counter() < deadline:
+        handled = fleet.commands_handled
+        time.sleep(0.2)
+
+def mismatches(requester, fleet, app):
+    wrong = 0
+    for entity_id, state in requester.last.items():
+        device, relay = device_relay(app, fleet, entity_id)
+        wrong += device.power[relay] != state
+    return wrong
+
+def run_mode(mode, host, port, fleet, expected, args):
+    app = AppSide(host, port, name=f"cmd-{mode}").start()
+    if mode == "scheduled":
+        app.api.command_scheduler = CommandScheduler(app.mqtt_client.publish, coalesce_window_s=args.window_ms / 1000,
+                                                     device_rate_per_s=args.device_rate, device_burst=args.device_burst,
+                                                     broker_rate_per_s=args.broker_rate)
+    if app.wait_for_entities(expected, 30) < expected:
+        raise RuntimeError(f"Sólo se descubrieron {len(app.api.ha_entity_info)} de {expected} entidades")
+    entities = sorted(app.api.ha_entity_info)
+    hot = entities[:args.hot_entities]
+    quiet = entities[len(hot):][:args.isolated]
+    results, latencies = {}, []
+    scenarios = {
+        "toggle_storm": lambda requester: toggle_storm(requester, hot, args.clients, args.commands, args.seed),
+        "retries": lambda requester: retries(requester, entities, args.seed),
+        "scene_flood": lambda requester: scene_flood(requester, entities),
+        "isolated": lambda requester: latencies.extend(isolated(requester, quiet, fleet, args.window_ms / 1000 + 0.05))
+    }
+    for name, scenario in scenarios.items():
+        settle(app, fleet)
+        fleet.reset()
+        requester = Requester(app)
+        started = time.perf_counter()
+        scenario(requester)
+        submitted_s = time.perf_counter() - started
+        settle(app, fleet)
+        delivered = sum(len(times) for times in fleet.received.values())
+        results[name] = {
+            "requested": requester.requested,
+            "delivered": delivered,
+            "reduction_pct": round(100 * (1 - delivered / max(1, requester.requested)), 1),
+            "max_per_device_per_s": max_per_second(fleet.received),
+            "final_state_mismatches": mismatches(requester, fleet, app),
+            "submit_s": round(submitted_s, 3)
+        }
+        if name == "isolated" and latencies:
+            results[name]["latency_p50_ms"] = round(statistics.median(latencies) * 1000, 2)
+            results[name]["latency_max_ms"] = round(max(latencies) * 1000, 2)
+    if app.api.command_scheduler:
+        results["scheduler"] = app.api.command_scheduler.stats()
+        app.api.command_scheduler.close()
+    app.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Comandos directos frente a planificados (fusión y límite por dispositivo).")
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--relays', type=int, default=2)
+    parser.add_argument('--ha-ratio', type=float, default=0.5)
+    parser.add_argument('--hot-entities', type=int, default=10, help="Entidades que reciben la tormenta de toggle_storm.")
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--commands', type=int, default=400, help="Comandos de toggle_storm (entre todos los clientes).")
+    parser.add_argument('--isolated', type=int, default=20)
+    parser.add_argument('--window-ms', type=float, default=200)
+    parser.add_argument('--device-rate', type=float, default=4)
+    parser.add_argument('--device-burst', type=int, default=4)
+    parser.add_argument('--broker-rate', type=float, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    broker = FakeMQTTBroker().start()
+    fleet = RecordingFleet(broker.host, broker.port, devices=args.devices, relays=args.relays, ha_ratio=args.ha_ratio, connections=2, seed=args.seed)
+    fleet.connect()
+    fleet.announce()
+    expected = args.devices * args.relays
+    try:
+        results = {mode: run_mode(mode, broker.host, broker.port, fleet, expected, args) for mode in ("direct", "scheduled")}
+    finally:
+        fleet.disconnect()
+        broker.stop()
+    print(json.dumps(results, indent=4))
+
+    scheduled = results["scheduled"]
+    scenarios = ("toggle_storm", "retries", "scene_flood", "isolated")
+    device_bound = args.device_burst + args.device_rate # Fichas iniciales + las repuestas en 1 s
+    ok = all(scheduled[name]["final_state_mismatches"] == 0 for name in scenarios) and \
+         scheduled["toggle_storm"]["delivered"] < results["direct"]["toggle_storm"]["delivered"] and \
+         all(scheduled[name]["max_per_device_per_s"] <= device_bound for name in scenarios)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
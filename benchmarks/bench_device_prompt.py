@@ -0,0 +1,90 @@
+# bench_device_prompt.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_device_prompt.py)
+#
+# Tamaño del prompt (tokens aproximados) y latencia de process_command frente al número de
+# entidades descubiertas, con la lista completa (device_top_k = 0) y con la lista podada por
+# relevancia. Gemini falso añade latencia proporcional a los tokens del prompt.
+#
+# Uso: python benchmarks/bench_device_prompt.py --entities 10 100 1000 5000 --top-k 25 --runs 20
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeGeminiServer, FakeHomeAssistantAPI, FakeMLServer
+from core_logic.neuron_network import RedNeuronal
+
+ROOMS = ["salon", "cocina", "dormitorio", "baño", "biblioteca", "garaje", "jardin", "despacho", "pasillo", "terraza"]
+KINDS = [("light", "Luz"), ("switch", "Enchufe"), ("fan", "Ventilador"), ("cover", "Persiana")]
+
+def build_entities(count):
+    entities = {}
+    for i in range(count):
+        domain, kind = KINDS[i % len(KINDS)]
+        room = ROOMS[(i // len(KINDS)) % len(ROOMS)]
+        entity_id = f"{domain}.{kind.lower()}_{room}_{i}"
+        entities[entity_id] = {"name": f"{kind} {room} {i}", "domain": domain}
+    return entities
+
+async def measure(network, fake_gemini, runs, entity_count):
+    await network.device_retriever.sync() # Embeddings de las entidades ya calculados (descubrimiento)
+    latencies, prompt_chars = [], []
+    for i in range(runs):
+        target = (i * 7919) % entity_count
+        domain, kind = KINDS[target % len(KINDS)]
+        room = ROOMS[(target // len(KINDS)) % len(ROOMS)]
+        started = time.perf_counter()
+        await network.process_command(f"enciende {kind.lower()} {room} {target} por favor {i}")
+        latencies.append(time.perf_counter() - started)
+        prompt_chars.append(fake_gemini.last_prompt_chars)
+    return {
+        "entities": entity_count,
+        "top_k": network.device_retriever.top_k,
+        "prompt_tokens_approx": int(statistics.median(prompt_chars) / 4),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens del prompt y latencia frente al número de entidades.")
+    parser.add_argument('--entities', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--top-k', type=int, default=25)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--llm-latency', type=float, default=0.1, help="Latencia fija de Gemini falso (s).")
+    parser.add_argument('--llm-latency-per-1k-tokens', type=float, default=0.05, help="Latencia por cada 1000 tokens de prompt (s).")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fake_ml = FakeMLServer(latency_s=0.002).start()
+    fake_gemini = FakeGeminiServer(latency_s=args.llm_latency, latency_per_1k_tokens_s=args.llm_latency_per_1k_tokens).start()
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_bench_"))
+    os.makedirs("knowledge")
+
+    results = []
+
+    async def run_all():
+        for entity_count in args.entities:
+            ha_api = FakeHomeAssistantAPI(build_entities(entity_count))
+            for top_k in (0, args.top_k):
+                network = RedNeuronal(fake_ml.host, "fake-key", ha_api, gemini_api_base=fake_gemini.base_url,
+                                      ml_server_port=fake_ml.port, device_top_k=top_k)
+                results.append(await measure(network, fake_gemini, args.runs, entity_count))
+                await network.aclose()
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        fake_ml.stop()
+        fake_gemini.stop()
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
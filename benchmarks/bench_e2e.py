@@ -0,0 +1,219 @@
+# bench_e2e.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_e2e.py)
+#
+# Benchmark de latencia de extremo a extremo con sustitutos locales de todas las dependencias:
+# cliente MQTT en proceso, ML Server falso con embeddings deterministas y Gemini falso con
+# latencia configurable. Mide p50/p95/p99 y throughput para cada camino de resolución:
+#
+#   memory_hit        -> coincidencia exacta en RedNeuronal.memory
+#   lexical_hit       -> coincidencia clara en el índice léxico de KnowledgeManager (sin embedding)
+#   embedding_hit     -> embedding del ML Server + búsqueda por similitud en KnowledgeManager
+#   llm_fallback      -> sin respuesta local, respuesta de texto de Gemini
+#   tasmota_dispatch  -> Gemini devuelve un ha_command que se publica por MQTT a un Tasmota
+#
+# Uso:
+#   python benchmarks/bench_e2e.py --requests 200 --concurrency 1 10 --memory-size 1000 --output bench.json
+#   python benchmarks/bench_e2e.py --via-flask --output bench_flask.json
+#   python benchmarks/bench_e2e.py --compare bench.json     (falla si hay regresiones)
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeGeminiServer, FakeMLServer, FakeMQTTClient, deterministic_embedding
+from core_logic.home_assistant_api import HomeAssistantAPI
+from core_logic.knowledge_manager import KnowledgeManager
+from core_logic.neuron_network import RedNeuronal
+
+TASMOTA_DEVICE = "bench_device"
+
+def bench_responder(command):
+    """
+    Gemini falso: los comandos 'enciende ...' se traducen a un ha_command sobre el Tasmota de prueba.
+    """
+    if command.startswith("enciende"):
+        return {"action_type": "ha_command", "command": {"domain": "light", "service": "turn_on", "entity_id": f"light.{TASMOTA_DEVICE}", "payload": "{}"}}
+    return {"action_type": "text_response", "response_text": f"Respuesta simulada para: {command}."}
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies, elapsed, errors, concurrency):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+def build_environment(args):
+    """
+    Crea los sustitutos y las instancias reales de RedNeuronal/HomeAssistantAPI/KnowledgeManager
+    en un directorio temporal (RedNeuronal guarda su memoria en ./knowledge).
+    """
+    fake_ml = FakeMLServer(latency_s=args.ml_latency).start()
+    fake_gemini = FakeGeminiServer(latency_s=args.llm_latency, responder=bench_responder).start()
+
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_bench_"))
+    os.makedirs("knowledge")
+
+    mqtt_client = FakeMQTTClient()
+    ha_api = HomeAssistantAPI(mqtt_client=mqtt_client)
+    mqtt_client.message_callback = ha_api.process_mqtt_message
+    mqtt_client.inject(f"tasmota/discovery/{TASMOTA_DEVICE}/config", {"hn": TASMOTA_DEVICE, "t": TASMOTA_DEVICE, "fn": ["BenchLight"]})
+
+    knowledge = KnowledgeManager(base_dir="knowledge")
+    knowledge.add_knowledge_batch("learned_responses", [
+        (f"pregunta aprendida {i}", f"respuesta aprendida {i}", deterministic_embedding(f"pregunta aprendida {i}")) for i in range(args.memory_size)
+    ])
+
+    network = RedNeuronal(fake_ml.host, "fake-key", ha_api, gemini_api_base=fake_gemini.base_url, ml_server_port=fake_ml.port, knowledge_manager=knowledge)
+    network.memory = [{"command": f"comando en memoria {i}", "response": f"respuesta {i}"} for i in range(args.memory_size)]
+
+    return fake_ml, fake_gemini, mqtt_client, network, knowledge
+
+def scenario_commands(name, i, memory_size):
+    if name == "memory_hit":
+        return f"comando en memoria {(i * 7919) % memory_size}"
+    if name == "lexical_hit":
+        return f"¿Pregunta aprendida {(i * 7919) % memory_size}?"
+    if name == "embedding_hit":
+        return f"pregunta aprendida {(i * 7919) % memory_size}"
+    if name == "llm_fallback":
+        return f"pregunta sin respuesta local {i}" # Comandos únicos: sin coalescencia
+    return f"enciende la luz {i}"
+
+async def embedding_lookup(network, knowledge, command):
+    embedding = await network.get_embedding(command)
+    return knowledge.find_similar_response_by_embedding(embedding, knowledge.learned_responses_embeddings, knowledge.learned_responses, threshold=0.9)
+
+async def run_direct(name, network, knowledge, args, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        command = scenario_commands(name, i, args.memory_size)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if name == "embedding_hit":
+                    if not await embedding_lookup(network, knowledge, command):
+                        errors += 1
+                else:
+                    await network.process_command(command)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    return summarize(latencies, time.perf_counter() - started, errors, concurrency)
+
+def run_flask(name, client, args, concurrency):
+    def one(i):
+        command = scenario_commands(name, i, args.memory_size)
+        started = time.perf_counter()
+        response = client.post('/enviar_comando', json={"comando": command})
+        ok = response.status_code == 200 and response.get_json().get("status") == "success"
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _ in outcomes], elapsed, sum(1 for _, ok in outcomes if not ok), concurrency)
+
+def compare(results, baseline, tolerance):
+    """
+    Compara p95 y throughput con una ejecución anterior. Devuelve la lista de regresiones.
+    """
+    regressions = []
+    for key, current in results["results"].items():
+        previous = baseline.get("results", {}).get(key)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con dependencias simuladas.")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--memory-size', type=int, default=1000)
+    parser.add_argument('--ml-latency', type=float, default=0.005, help="Latencia del ML Server falso (s).")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="Latencia de Gemini falso (s).")
+    parser.add_argument('--scenarios', nargs='+', default=["memory_hit", "lexical_hit", "embedding_hit", "llm_fallback", "tasmota_dispatch"])
+    parser.add_argument('--via-flask', action='store_true', help="Pasar por la ruta /enviar_comando de main_app.")
+    parser.add_argument('--output', help="Archivo JSON donde guardar los resultados.")
+    parser.add_argument('--compare', help="Resultados JSON anteriores con los que comparar.")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Margen de regresión permitido (0.15 = 15%%).")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    logging.getLogger().setLevel(logging.WARNING)
+    fake_ml, fake_gemini, mqtt_client, network, knowledge = build_environment(args)
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {}
+    }
+    try:
+        if args.via_flask:
+            import main_app.app as smart_home_app
+            smart_home_app.start_app_loop()
+            smart_home_app.neuron_network_global = network
+            smart_home_app.home_assistant_api_global = network.home_assistant_api
+            client = smart_home_app.app.test_client()
+            for name in args.scenarios:
+                if name == "embedding_hit":
+                    continue # Todavía no hay ruta que resuelva por similitud de embeddings
+                for concurrency in args.concurrency:
+                    results["results"][f"flask/{name}/c{concurrency}"] = run_flask(name, client, args, concurrency)
+            smart_home_app.run_on_app_loop(network.aclose())
+        else:
+            async def run_all():
+                for name in args.scenarios:
+                    for concurrency in args.concurrency:
+                        results["results"][f"direct/{name}/c{concurrency}"] = await run_direct(name, network, knowledge, args, concurrency)
+                await network.aclose()
+            asyncio.run(run_all())
+    finally:
+        fake_ml.stop()
+        fake_gemini.stop()
+
+    results["mqtt_published"] = len(mqtt_client.published)
+    print(json.dumps(results["results"], indent=4))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN: {regression}")
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
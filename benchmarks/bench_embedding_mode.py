@@ -0,0 +1,106 @@
+# bench_embedding_mode.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_embedding_mode.py)
+#
+# Latencia por llamada de RedNeuronal.get_embedding / get_embeddings con el ML Server remoto
+# (HTTP + JSON) frente al motor de embeddings en proceso. Ambos modos usan el mismo 'encode'
+# simulado (misma latencia y mismos vectores), así que la diferencia es el coste del salto HTTP
+# y de la serialización JSON. Comprueba además que los dos modos devuelven los mismos vectores.
+#
+# Con --real-model se usa SentenceTransformer en proceso (requiere sentence-transformers) y se
+# compara contra un ML Server real en --ml-server (host:puerto).
+#
+# Uso: python benchmarks/bench_embedding_mode.py --calls 200 --encode-latency 0.005 --batch-size 64
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeHomeAssistantAPI, FakeMLServer, FakeSentenceTransformer
+from core_logic.embedding_engine import LocalEmbeddingEngine
+from core_logic.neuron_network import RedNeuronal
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def measure(network, calls, batch_size):
+    first_started = time.perf_counter()
+    await network.get_embedding("primera llamada (incluye la carga perezosa del modelo)")
+    first_call_ms = (time.perf_counter() - first_started) * 1000
+
+    latencies = []
+    vectors = []
+    for i in range(calls):
+        text = f"enciende la luz del salón número {i}"
+        started = time.perf_counter()
+        vectors.append(await network.get_embedding(text))
+        latencies.append(time.perf_counter() - started)
+
+    batch_texts = [f"texto de conocimiento {i}" for i in range(batch_size)]
+    started = time.perf_counter()
+    batch_vectors = await network.get_embeddings(batch_texts)
+    batch_ms = (time.perf_counter() - started) * 1000
+
+    stats = {
+        "first_call_ms": round(first_call_ms, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        f"batch_{batch_size}_ms": round(batch_ms, 1)
+    }
+    return stats, vectors + batch_vectors
+
+def same_vectors(a, b, tolerance=1e-6):
+    return len(a) == len(b) and all(len(x) == len(y) and all(abs(p - q) <= tolerance for p, q in zip(x, y)) for x, y in zip(a, b))
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de embeddings: ML Server remoto frente a motor en proceso.")
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--encode-latency', type=float, default=0.005, help="Duración simulada de cada 'encode' (s).")
+    parser.add_argument('--load-time', type=float, default=0.5, help="Duración simulada de la carga del modelo (s).")
+    parser.add_argument('--real-model', default=None, help="Nombre de un modelo SentenceTransformer para el modo en proceso.")
+    parser.add_argument('--ml-server', default=None, help="host:puerto de un ML Server real (con --real-model).")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fake_ml = None
+    if args.real_model and args.ml_server:
+        ml_host, ml_port = args.ml_server.rsplit(":", 1)
+        engine = LocalEmbeddingEngine(args.real_model)
+    else:
+        fake_ml = FakeMLServer(latency_s=args.encode_latency).start()
+        ml_host, ml_port = fake_ml.host, fake_ml.port
+        engine = LocalEmbeddingEngine("fake", model_loader=lambda name: FakeSentenceTransformer(latency_s=args.encode_latency, load_s=args.load_time))
+
+    results = {}
+
+    async def run():
+        remote = RedNeuronal(ml_host, "fake-key", FakeHomeAssistantAPI(), ml_server_port=int(ml_port))
+        embedded = RedNeuronal(ml_host, "fake-key", FakeHomeAssistantAPI(), ml_server_port=int(ml_port), embedding_engine=engine)
+        try:
+            results["remote"], remote_vectors = await measure(remote, args.calls, args.batch_size)
+            results["embedded"], embedded_vectors = await measure(embedded, args.calls, args.batch_size)
+        finally:
+            await remote.aclose()
+            await embedded.aclose()
+        results["same_vectors"] = same_vectors(remote_vectors, embedded_vectors)
+        results["p50_saved_ms"] = round(results["remote"]["p50_ms"] - results["embedded"]["p50_ms"], 3)
+
+    try:
+        asyncio.run(run())
+    finally:
+        if fake_ml is not None:
+            fake_ml.stop()
+    print(json.dumps(results, indent=4))
+    sys.exit(0 if results.get("same_vectors") else 1)
+
+if __name__ == '__main__':
+    main()
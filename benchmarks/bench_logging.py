@@ -0,0 +1,149 @@
+# bench_logging.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_logging.py)
+#
+# Coste por llamada a logging en el hilo de la petición: escritura síncrona (StreamHandler, como
+# con logging.basicConfig) frente al registro asíncrono de core_logic/log_pipeline.py, con una
+# salida rápida y con una salida lenta (p. ej. el driver de logs de Docker con la tubería llena).
+#
+#   null_handler        -> suelo: lo que cuesta crear el LogRecord, sin escribir nada
+#   sync_*              -> el llamador formatea y escribe: paga la salida lenta en cada llamada
+#   pipeline_*          -> el llamador sólo encola; sin límite por origen, con la cola llena se descarta
+#   pipeline_slow_rated -> configuración por defecto: una avalancha desde un mismo origen se muestrea
+#
+# Comprueba además que los secretos no llegan a la salida (texto y JSON) y termina con código 1
+# si el p99 por llamada del registro asíncrono supera --bound-us o si se filtra algún secreto.
+#
+# Uso: python benchmarks/bench_logging.py --calls 20000 --sink-latency-us 200 --bound-us 50
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from core_logic.log_pipeline import REDACTOR, TEXT_FORMAT, LogPipeline, redact_mapping
+
+SECRETS = {"gemini_api_key": "AIzaSyD-prueba-0123456789abcdefghijklmnopq", "mqtt_password": "Kolke.prueba.2576", "admin_token": "tok-admin-9f8e7d"}
+
+class Sink:
+    """
+    Salida simulada: cuenta las líneas y tarda 'latency_s' en cada escritura.
+    """
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        with self._lock:
+            self.lines.append(text)
+
+    def flush(self):
+        pass
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def measure(logger, calls):
+    latencies = []
+    for i in range(calls):
+        started = time.perf_counter_ns()
+        logger.info(f"Comando HA de servicio enviado: Tópico='homeassistant/light/salon_{i % 50}/set', Payload='ON'")
+        latencies.append(time.perf_counter_ns() - started)
+    return {
+        "p50_us": round(statistics.median(latencies) / 1000, 2),
+        "p99_us": round(percentile(latencies, 0.99) / 1000, 2),
+        "max_us": round(max(latencies) / 1000, 1)
+    }
+
+def run_sync(name, calls, sink_latency_s):
+    sink = Sink(sink_latency_s)
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    started = time.perf_counter()
+    result = measure(logger, calls)
+    result["caller_total_s"] = round(time.perf_counter() - started, 3)
+    result["written"] = len(sink.lines)
+    return result
+
+def run_null(calls):
+    logger = logging.getLogger("bench.null")
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.INFO)
+    return measure(logger, calls)
+
+def run_pipeline(name, calls, sink_latency_s, **settings):
+    sink = Sink(sink_latency_s)
+    pipeline = LogPipeline(name, f"bench_{name}", stream=sink, **settings)
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    pipeline.install(logger)
+    started = time.perf_counter()
+    result = measure(logger, calls)
+    result["caller_total_s"] = round(time.perf_counter() - started, 3)
+    pipeline.stop()
+    dropped = {key[0]: value for key, value in pipeline.dropped._values.items()}
+    result.update({"written": len(sink.lines), "rate_limited": dropped.get("rate_limited", 0), "queue_full": dropped.get("queue_full", 0)})
+    return result
+
+def check_redaction(fmt):
+    for value in SECRETS.values():
+        REDACTOR.add_secret(value)
+    sink = Sink()
+    pipeline = LogPipeline("redaction", f"bench_redaction_{fmt}", fmt=fmt, stream=sink, rate_per_s=0)
+    logger = logging.getLogger(f"bench.redaction.{fmt}")
+    logger.propagate = False
+    pipeline.install(logger)
+    logger.info(f"Configuración final: {redact_mapping({**SECRETS, 'mqtt_username': 'leo'})}")
+    logger.info(f"Configuración (sin redactar): {SECRETS}")
+    logger.error(f"Error: Client error '400' for url 'https://generativelanguage.googleapis.com/v1beta/models/x:generateContent?key={SECRETS['gemini_api_key']}'")
+    logger.warning("Cabecera recibida: Authorization: Bearer abc.def.ghi", extra={"mqtt_password": SECRETS["mqtt_password"], "endpoint": "get_embedding"})
+    pipeline.stop()
+    output = "".join(sink.lines)
+    if fmt == "json":
+        for line in sink.lines:
+            json.loads(line)
+    leaked = [key for key, value in SECRETS.items() if value in output] + (["bearer"] if "abc.def.ghi" in output else [])
+    return {"lines": len(sink.lines), "leaked": leaked, "kept_username": "leo" in output}
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro síncrono frente a asíncrono (coste por llamada).")
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--sink-latency-us', type=float, default=200, help="Duración de cada escritura en la salida lenta.")
+    parser.add_argument('--bound-us', type=float, default=50, help="Límite del p99 por llamada del registro asíncrono.")
+    args = parser.parse_args()
+
+    slow = args.sink_latency_us / 1e6
+    unlimited = {"rate_per_s": 0}
+    results = {
+        "null_handler": run_null(args.calls),
+        "sync_fast": run_sync("sync_fast", args.calls, 0.0),
+        "sync_slow": run_sync("sync_slow", args.calls // 10, slow), # Es lenta: menos llamadas
+        "pipeline_fast": run_pipeline("pipeline_fast", args.calls, 0.0, **unlimited),
+        "pipeline_slow": run_pipeline("pipeline_slow", args.calls, slow, queue_size=1000, **unlimited),
+        "pipeline_slow_rated": run_pipeline("pipeline_slow_rated", args.calls, slow)
+    }
+    redaction = {fmt: check_redaction(fmt) for fmt in ("text", "json")}
+    overhead = {name: round(result["p50_us"] - results["null_handler"]["p50_us"], 2) for name, result in results.items() if name != "null_handler"}
+    print(json.dumps({"per_call": results, "p50_overhead_over_null_us": overhead, "redaction": redaction}, indent=4))
+
+    bounded = all(results[name]["p99_us"] <= args.bound_us for name in ("pipeline_fast", "pipeline_slow", "pipeline_slow_rated"))
+    clean = all(not check["leaked"] and check["kept_username"] for check in redaction.values())
+    sys.exit(0 if bounded and clean else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# bench_rules.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_rules.py)
+#
+# Motor de reglas con miles de reglas sobre el flujo MQTT: cada mensaje pasa por
+# HomeAssistantAPI.process_mqtt_message (cliente MQTT simulado) y sólo se evalúan las reglas
+# indexadas para su tópico. Compara el coste por mensaje y las reglas evaluadas con una evaluación
+# lineal de todas las reglas, y comprueba que ambas disparan exactamente las mismas reglas.
+# También carga reglas mal formadas junto a una válida: cada una se descarta con un aviso y
+# la válida se carga igualmente.
+#
+# Uso: python benchmarks/bench_rules.py --rules 10000 --devices 2000 --messages 50000
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeMQTTClient
+from core_logic.home_assistant_api import HomeAssistantAPI
+from core_logic.rules_engine import RulesEngine
+
+def discover_devices(api, devices):
+    for d in range(devices):
+        name = f"tasmota_{d:05d}"
+        api.process_mqtt_message(f"homeassistant/switch/{name}/config", json.dumps({
+            "name": f"Enchufe {d}", "state_topic": f"stat/{name}/POWER", "command_topic": f"cmnd/{name}/POWER"
+        }))
+
+def build_rules(rng, count, devices):
+    rules = []
+    for i in range(count):
+        device = f"tasmota_{rng.randrange(devices):05d}"
+        target = f"switch.tasmota_{rng.randrange(devices):05d}"
+        kind = i % 10
+        if kind < 4: # Estado de un enchufe por tópico
+            trigger = {"topic": f"stat/{device}/POWER", "payload": rng.choice(("ON", "OFF")), "transition": True}
+        elif kind < 7: # Estado de una entidad (su state_topic)
+            trigger = {"entity_id": f"switch.{device}", "state": rng.choice(("ON", "OFF"))}
+        elif kind < 9: # Umbral sobre la telemetría
+            trigger = {"topic": f"tele/{device}/STATE", "field": "Wifi.RSSI", "op": "<", "value": rng.randint(30, 60)}
+        else: # Comodín: cualquier enchufe
+            trigger = {"topic": "stat/+/POWER", "payload": "ON", "transition": True} if i % 1000 == 9 else \
+                      {"topic": f"tele/{device}/#", "field": "LoadAvg", "op": ">", "value": 90}
+        rules.append({"id": f"regla_{i}", "trigger": trigger, "cooldown_s": 0,
+                      "actions": [{"entity_id": target, "service": rng.choice(("turn_on", "turn_off"))}]})
+    return rules
+
+def build_messages(rng, count, devices):
+    messages = []
+    for _ in range(count):
+        device = f"tasmota_{rng.randrange(devices):05d}"
+        if rng.random() < 0.5:
+            messages.append((f"stat/{device}/POWER", rng.choice(("ON", "OFF"))))
+        else:
+            messages.append((f"tele/{device}/STATE", json.dumps({"LoadAvg": rng.randint(0, 100), "Wifi": {"RSSI": rng.randint(20, 100)}})))
+    return messages
+
+def topic_matches(topic_filter, topic):
+    filter_levels, levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+class LinearRulesEngine(RulesEngine):
+    """
+    Referencia sin índice: comprueba el disparador de todas las reglas en cada mensaje.
+    """
+
+    def candidates(self, topic):
+        matches = []
+        entities = self.home_assistant_api.entities_for_state_topic(topic)
+        for rule in self.rules:
+            if rule.topic:
+                if topic_matches(rule.topic, topic):
+                    matches.append(rule)
+            elif rule.entity_id in entities:
+                matches.append(rule)
+        return matches
+
+VALID_ACTION = [{"entity_id": "light.pasillo", "service": "turn_off"}]
+MALFORMED_RULES = [
+    {"id": "cooldown_texto", "trigger": {"topic": "stat/a/POWER"}, "actions": VALID_ACTION, "cooldown_s": "rápido"},
+    {"id": "cooldown_lista", "trigger": {"topic": "stat/a/POWER"}, "actions": VALID_ACTION, "cooldown_s": [1]},
+    {"id": "cooldown_negativo", "trigger": {"topic": "stat/a/POWER"}, "actions": VALID_ACTION, "cooldown_s": -5},
+    {"id": "hora_fuera_de_rango", "trigger": {"topic": "stat/a/POWER"}, "conditions": {"after": "25:99"}, "actions": VALID_ACTION},
+    {"id": "hora_numero", "trigger": {"topic": "stat/a/POWER"}, "conditions": {"before": 22}, "actions": VALID_ACTION},
+    {"id": "dias_fuera_de_rango", "trigger": {"topic": "stat/a/POWER"}, "conditions": {"weekdays": [7]}, "actions": VALID_ACTION},
+    {"id": "dias_objeto", "trigger": {"topic": "stat/a/POWER"}, "conditions": {"weekdays": [{}]}, "actions": VALID_ACTION},
+    {"id": "condiciones_lista", "trigger": {"topic": "stat/a/POWER"}, "conditions": ["22:00"], "actions": VALID_ACTION},
+    {"id": "disparador_texto", "trigger": "stat/a/POWER", "actions": VALID_ACTION},
+    {"id": "topico_numero", "trigger": {"topic": 5}, "actions": VALID_ACTION},
+    {"id": "operador_lista", "trigger": {"topic": "tele/a/STATE", "field": "LoadAvg", "op": [">"], "value": 1}, "actions": VALID_ACTION},
+    {"id": "accion_sin_servicio", "trigger": {"topic": "stat/a/POWER"}, "actions": [{"entity_id": "light.pasillo", "service": 1}]}
+]
+
+def check_malformed():
+    """
+    Carga las reglas mal formadas más una válida. :return: (errores, reglas cargadas).
+    """
+    engine = RulesEngine(HomeAssistantAPI(FakeMQTTClient()))
+    valid = {"id": "valida", "trigger": {"topic": "stat/a/POWER", "payload": "ON"},
+             "conditions": {"after": "23:59", "before": "00:00", "weekdays": [0, 6]}, "actions": VALID_ACTION, "cooldown_s": 0}
+    errors = engine.set_rules(MALFORMED_RULES + [valid])
+    return errors, [rule.rule_id for rule in engine.rules]
+
+def run(engine_class, definitions, messages, devices, linear_limit=None):
+    mqtt = FakeMQTTClient()
+    api = HomeAssistantAPI(mqtt)
+    discover_devices(api, devices)
+    engine = engine_class(api)
+    engine.set_rules(definitions)
+    api.rules_engine = engine
+    mqtt.published.clear()
+    messages = messages[:linear_limit] if linear_limit else messages
+    fired = []
+    started = time.perf_counter()
+    for topic, payload in messages:
+        before = engine.firings
+        api.process_mqtt_message(topic, payload)
+        fired.append(engine.firings - before)
+    elapsed = time.perf_counter() - started
+    return {
+        "messages": len(messages),
+        "us_per_msg": round(elapsed / len(messages) * 1e6, 2),
+        "msgs_per_s": round(len(messages) / elapsed),
+        "evaluations_per_msg": round(engine.evaluations / len(messages), 2),
+        "firings": engine.firings,
+        "actions_published": len(mqtt.published)
+    }, fired
+
+def main():
+    parser = argparse.ArgumentParser(description="Motor de reglas indexado frente a evaluación lineal.")
+    parser.add_argument('--rules', type=int, default=10000)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--linear-messages', type=int, default=2000, help="Mensajes para la referencia lineal (es lenta).")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(7)
+    definitions = build_rules(rng, args.rules, args.devices)
+    messages = build_messages(rng, args.messages, args.devices)
+
+    indexed, indexed_fired = run(RulesEngine, definitions, messages, args.devices)
+    linear, linear_fired = run(LinearRulesEngine, definitions, messages, args.devices, linear_limit=args.linear_messages)
+    same_firings = indexed_fired[:len(linear_fired)] == linear_fired
+    malformed_errors, loaded = check_malformed()
+    malformed_ok = len(malformed_errors) == len(MALFORMED_RULES) and loaded == ["valida"]
+    print(json.dumps({
+        "rules": args.rules,
+        "devices": args.devices,
+        "indexed": indexed,
+        "linear": linear,
+        "speedup": round(linear["us_per_msg"] / indexed["us_per_msg"], 1),
+        "same_firings": same_firings,
+        "malformed_rejected": f"{len(malformed_errors)}/{len(MALFORMED_RULES)}",
+        "malformed_valid_loaded": loaded
+    }, indent=4, ensure_ascii=False))
+    sys.exit(0 if same_firings and malformed_ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# bench_speculative.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_speculative.py)
+#
+# Resolución especulativa de RedNeuronal: la búsqueda en el conocimiento local (léxica +
+# re-ranking por embeddings) y Gemini en paralelo tras un retardo de cobertura (hedge). Compara
+# en serie (sin hedge), con hedge y en paralelo total, por escenario:
+#
+#   lexical_hit     -> coincidencia léxica clara: nunca debe llamar a Gemini
+#   embedding_hit   -> candidatos ambiguos resueltos por similitud (embedding lento)
+#   llm_ambiguous   -> candidatos léxicos que no superan el umbral: acaba en Gemini
+#   llm_unrelated   -> sin candidatos léxicos: Gemini directamente
+#   stream_ambiguous -> como llm_ambiguous, pero en streaming (tiempo hasta el primer token)
+#
+# El modelo de embeddings simulado ignora las palabras de relleno ("oye", "porfa"), de modo que
+# "oye, pregunta aprendida 5" tiene el mismo vector que "pregunta aprendida 5"; con una palabra
+# nueva ("pregunta aprendida 5 hoy") la cobertura léxica también es parcial, pero el vector no se parece.
+#
+# gemini_cancelled_per_command cuenta las llamadas a Gemini canceladas porque ganó el conocimiento local
+# (nadie más las esperaba); con paralelo total, en embedding_hit deben ser todas las lanzadas.
+#
+# Uso: python benchmarks/bench_speculative.py --requests 20 --encode-latency 0.15 --llm-latency 0.4 --hedge-ms 100
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeGeminiServer, FakeHomeAssistantAPI, deterministic_embedding
+from core_logic.embedding_engine import LocalEmbeddingEngine
+from core_logic.knowledge_manager import KnowledgeManager
+from core_logic.neuron_network import RedNeuronal
+
+FILLER_WORDS = {"oye", "porfa"}
+
+class FillerInsensitiveModel:
+    """
+    Modelo simulado: mismo vector con o sin palabras de relleno; 'encode' tarda latency_s.
+    """
+
+    def __init__(self, latency_s):
+        self.latency_s = latency_s
+
+    def _vector(self, text):
+        words = [word.strip("¿?,.!¡") for word in text.lower().split()]
+        return deterministic_embedding(" ".join(word for word in words if word and word not in FILLER_WORDS))
+
+    def encode(self, texts, batch_size=32):
+        time.sleep(self.latency_s)
+        if isinstance(texts, str):
+            return _Vector(self._vector(texts))
+        return _Vector([self._vector(text) for text in texts])
+
+class _Vector(list):
+    def tolist(self):
+        return list(self)
+
+def scenario_command(name, i):
+    if name == "lexical_hit":
+        return f"pregunta aprendida {i}"
+    if name == "embedding_hit":
+        return f"oye, pregunta aprendida {i}"
+    if name in ("llm_ambiguous", "stream_ambiguous"):
+        return f"pregunta aprendida {i} hoy"
+    return f"cuéntame un chiste número {i}"
+
+async def run_scenario(network, fake_gemini, name, requests):
+    latencies, first_tokens, answered_locally = [], [], 0
+    calls_before = fake_gemini.request_count
+    abandoned_before = network.llm_flight.abandoned
+    for i in range(requests):
+        command = scenario_command(name, i)
+        started = time.perf_counter()
+        if name == "stream_ambiguous":
+            async for event in network.process_command_stream(command):
+                if event["type"] == "final":
+                    first_tokens.append(event["ttft_ms"])
+        else:
+            response = await network.process_command(command)
+            answered_locally += response.get("response_text", "").startswith("respuesta aprendida")
+        latencies.append(time.perf_counter() - started)
+    await asyncio.sleep(0.05) # Deja terminar las llamadas canceladas para contarlas
+    result = {
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "gemini_calls_per_command": round((fake_gemini.request_count - calls_before) / requests, 2),
+        "gemini_cancelled_per_command": round((network.llm_flight.abandoned - abandoned_before) / requests, 2),
+        "answered_locally": answered_locally
+    }
+    if first_tokens:
+        result["ttft_p50_ms"] = round(statistics.median(first_tokens), 1)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolución en serie frente a especulativa (conocimiento local y Gemini).")
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--encode-latency', type=float, default=0.15, help="Duración de cada 'encode' (s): búsqueda local lenta.")
+    parser.add_argument('--llm-latency', type=float, default=0.4)
+    parser.add_argument('--hedge-ms', type=float, default=100)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    fake_gemini = FakeGeminiServer(latency_s=args.llm_latency, first_token_s=args.llm_latency / 2).start()
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_speculative_"))
+    os.makedirs("knowledge")
+    knowledge = KnowledgeManager(base_dir="knowledge")
+    knowledge.add_knowledge_batch("learned_responses", [
+        (f"pregunta aprendida {i}", f"respuesta aprendida {i}", deterministic_embedding(f"pregunta aprendida {i}")) for i in range(args.requests)
+    ])
+
+    modes = {"sequential": None, f"hedged_{args.hedge_ms:g}ms": args.hedge_ms / 1000, "parallel": 0.0}
+    scenarios = ("lexical_hit", "embedding_hit", "llm_ambiguous", "llm_unrelated", "stream_ambiguous")
+    results = {}
+
+    async def run():
+        for mode, hedge_delay_s in modes.items():
+            engine = LocalEmbeddingEngine("fake", max_workers=4, model_loader=lambda name: FillerInsensitiveModel(args.encode_latency))
+            network = RedNeuronal("127.0.0.1", "fake-key", FakeHomeAssistantAPI(), gemini_api_base=fake_gemini.base_url,
+                                  knowledge_manager=knowledge, embedding_engine=engine, llm_hedge_delay_s=hedge_delay_s)
+            await network.get_embedding("calentamiento") # Carga perezosa del modelo fuera de la medida
+            results[mode] = {}
+            for name in scenarios:
+                results[mode][name] = await run_scenario(network, fake_gemini, name, args.requests)
+            await network.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        fake_gemini.stop()
+    print(json.dumps(results, indent=4))
+    hedged = results[f"hedged_{args.hedge_ms:g}ms"]
+    # En paralelo total gana el embedding: cada llamada a Gemini lanzada debe cancelarse, no pagarse entera
+    losing = results["parallel"]["embedding_hit"]
+    ok = hedged["lexical_hit"]["gemini_calls_per_command"] == 0 and \
+         hedged["llm_ambiguous"]["p50_ms"] < results["sequential"]["llm_ambiguous"]["p50_ms"] and \
+         losing["gemini_calls_per_command"] > 0 and losing["gemini_cancelled_per_command"] == losing["gemini_calls_per_command"]
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
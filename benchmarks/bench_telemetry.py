@@ -0,0 +1,123 @@
+# bench_telemetry.py (ubicado en ~/Smart-Home-AI/benchmarks/bench_telemetry.py)
+#
+# Ingesta de mensajes tele/<dispositivo>/STATE de Tasmota en TelemetryStore: miles de dispositivos
+# informando cada pocos segundos (tiempo simulado), más una pasada por HomeAssistantAPI.process_mqtt_message. Mide mensajes por segundo, memoria retenida tras el calentamiento (debe
+# ser ~0: la ingesta escribe en matrices ya reservadas), latencia de consultas y comprueba que
+# los agregados de 1 minuto coinciden con las muestras brutas.
+#
+# Uso: python benchmarks/bench_telemetry.py --devices 2000 --interval 5 --minutes 30
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeMQTTClient
+from core_logic.home_assistant_api import HomeAssistantAPI
+from core_logic.telemetry_store import TelemetryStore
+
+def state_payload(rng, uptime):
+    return json.dumps({
+        "Time": "2024-01-01T00:00:00", "Uptime": "0T00:00:00", "UptimeSec": uptime, "Heap": rng.randint(20, 30),
+        "SleepMode": "Dynamic", "Sleep": 50, "LoadAvg": rng.randint(5, 40), "MqttCount": 1,
+        "POWER": rng.choice(("ON", "OFF")),
+        "Wifi": {"AP": 1, "SSId": "casa", "Channel": 6, "Mode": "11n", "RSSI": rng.randint(40, 100), "Signal": rng.randint(-80, -40), "LinkCount": 1}
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta y consultas de telemetría de Tasmota.")
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=5.0, help="Segundos simulados entre mensajes de cada dispositivo.")
+    parser.add_argument('--minutes', type=float, default=30.0, help="Duración simulada.")
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(42)
+    store = TelemetryStore(max_series=args.devices * 8)
+    api = HomeAssistantAPI(FakeMQTTClient(), telemetry_store=store)
+    # Mensajes preparados de antemano: se mide la ingesta, no la generación del JSON
+    payloads = [state_payload(rng, i) for i in range(64)]
+    topics = [f"tele/tasmota_{d:05d}/STATE" for d in range(args.devices)]
+
+    started_at = time.time() - args.minutes * 60
+    rounds = int(args.minutes * 60 / args.interval)
+    warmup_rounds = max(1, rounds // 10)
+
+    def ingest_round(r):
+        # Inyección directa del instante simulado; process_mqtt_message usa time.time()
+        now = started_at + r * args.interval
+        for d, topic in enumerate(topics):
+            store.ingest_state(topic.split('/')[1], payloads[(d + r) % len(payloads)], timestamp=now + d * args.interval / args.devices)
+
+    for r in range(warmup_rounds):
+        ingest_round(r)
+
+    ingest_started = time.perf_counter()
+    for r in range(warmup_rounds, rounds):
+        ingest_round(r)
+    ingest_s = time.perf_counter() - ingest_started
+    messages = (rounds - warmup_rounds) * args.devices
+
+    # Memoria retenida por la ingesta con todas las series ya creadas (tracemalloc la ralentiza: pasada aparte)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for r in range(rounds, rounds + warmup_rounds):
+        ingest_round(r)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Camino real del broker (process_mqtt_message) con el instante actual
+    mqtt_started = time.perf_counter()
+    for d, topic in enumerate(topics):
+        api.process_mqtt_message(topic, payloads[d % len(payloads)])
+    mqtt_us = (time.perf_counter() - mqtt_started) / args.devices * 1e6
+
+    query_latencies = {"raw_last_5m": [], "1m_last_30m": [], "aggregate_1h": [], "summary": []}
+    now = time.time()
+    for i in range(args.queries):
+        device = f"tasmota_{rng.randrange(args.devices):05d}"
+        for name, call in (("raw_last_5m", lambda: store.query(device, "LoadAvg", now - 300, now, "raw")),
+                           ("1m_last_30m", lambda: store.query(device, "LoadAvg", now - 1800, now, "1m")),
+                           ("aggregate_1h", lambda: store.aggregate(device, "Wifi.RSSI", now - 3600, now)),
+                           ("summary", lambda: store.summary(device))):
+            started = time.perf_counter()
+            call()
+            query_latencies[name].append(time.perf_counter() - started)
+
+    # Coherencia del submuestreo: media de 1 minuto frente a la media de las muestras brutas del mismo minuto
+    device = "tasmota_00000"
+    raw_points = store.query(device, "LoadAvg", resolution="raw")["points"]
+    minute_points = {point[0]: point for point in store.query(device, "LoadAvg", resolution="1m")["points"]}
+    checked = mismatches = 0
+    for bucket_start, point in minute_points.items():
+        values = [value for ts, value in raw_points if bucket_start <= ts < bucket_start + 60]
+        if len(values) == point[4]: # Minutos completos dentro del anillo de muestras brutas
+            checked += 1
+            mismatches += abs(sum(values) / len(values) - point[3]) > 1e-3
+
+    stats = store.stats()
+    print(json.dumps({
+        "devices": args.devices,
+        "series": stats["series"],
+        "max_memory_mb": stats["max_memory_mb"],
+        "messages": messages,
+        "ingest_msgs_per_s": round(messages / ingest_s),
+        "ingest_us_per_msg": round(ingest_s / messages * 1e6, 2),
+        "process_mqtt_message_us": round(mqtt_us, 2),
+        "retained_bytes_per_round": round((after - before) / warmup_rounds),
+        "query_p50_us": {name: round(sorted(values)[len(values) // 2] * 1e6, 1) for name, values in query_latencies.items()},
+        "downsampling_checked_minutes": checked,
+        "downsampling_mismatches": mismatches
+    }, indent=4))
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# check_entity_resolution.py (ubicado en ~/Smart-Home-AI/benchmarks/check_entity_resolution.py)
+#
+# Comprueba HomeAssistantAPI.resolve_entity_id, que valida los entity_id generados por el LLM antes
+# de publicar un comando. Termina con código 1 si alguna comprobación falla.
+#
+#   resolves   -> identificadores existentes, con erratas o con las palabras en otro orden se corrigen
+#   rejects    -> identificadores con palabras que no existen en ninguna entidad ('jardin', 'horno')
+#                 no se resuelven a otro dispositivo parecido: devuelven None
+#   ambiguous  -> si dos entidades encajan casi igual, None en vez de elegir una
+#   partial    -> find_entities(partial=True) sí encuentra el nombre dentro de una frase (DeviceRetriever)
+#
+# Uso: python benchmarks/check_entity_resolution.py
+
+import logging
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.check_resilience import Checker
+from benchmarks.fakes import FakeMQTTClient
+from core_logic.home_assistant_api import HomeAssistantAPI
+
+ENTITIES = {
+    "light.luz_salon": "Luz Salón",
+    "light.luz_biblioteca": "Luz Biblioteca",
+    "light.luz_cocina": "Luz Cocina",
+    "light.luz_dormitorio": "Luz Dormitorio",
+    "light.lampara_lectura": "Lámpara Lectura",
+    "switch.enchufe_cocina": "Enchufe Cocina",
+    "switch.enchufe_tele": "Enchufe Tele",
+    "switch.ventilador_bano": "Ventilador Baño",
+    "light.tira_led_pasillo_1": "Tira LED Pasillo 1",
+    "light.tira_led_pasillo_2": "Tira LED Pasillo 2"
+}
+
+RESOLVES = {
+    "light.luz_salon": "light.luz_salon",
+    "light.luz_bibloteca": "light.luz_biblioteca",
+    "light.salon_luz": "light.luz_salon",
+    "switch.enchufe_cosina": "switch.enchufe_cocina",
+    "switch.ventilador_baño": "switch.ventilador_bano"
+}
+
+REJECTS = ("light.luz_jardin_salon", "light.luz_salon_exterior", "light.salon_luz_techo",
+           "switch.enchufe_cocina_horno", "light.luz_garaje")
+
+AMBIGUOUS = ("light.tira_led_pasillo",)
+
+def build_api():
+    api = HomeAssistantAPI(FakeMQTTClient())
+    for entity_id, name in ENTITIES.items():
+        api.ha_entity_info[entity_id] = {"name": name, "domain": entity_id.split('.', 1)[0], "command_topic": f"cmnd/{entity_id}/POWER"}
+        api._index_entity(entity_id)
+    return api
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    checker = Checker()
+    api = build_api()
+
+    resolved = {entity_id: api.resolve_entity_id(entity_id) for entity_id in RESOLVES}
+    checker.check("resolves", resolved == RESOLVES, f"{resolved}")
+
+    rejected = {entity_id: api.resolve_entity_id(entity_id) for entity_id in REJECTS}
+    scores = {entity_id: api.find_entities(entity_id.split('.', 1)[-1].replace('_', ' '), limit=1) for entity_id in REJECTS}
+    checker.check("rejects", all(value is None for value in rejected.values()), f"{rejected}, mejor candidato: {scores}")
+
+    ambiguous = {entity_id: api.resolve_entity_id(entity_id) for entity_id in AMBIGUOUS}
+    checker.check("ambiguous", all(value is None for value in ambiguous.values()), f"{ambiguous}")
+
+    found = api.find_entities("enciende la luz de la bibloteca, porfa", limit=1, partial=True)
+    checker.check("partial", found[:1] and found[0][0] == "light.luz_biblioteca" and found[0][1] >= 0.75, f"{found}")
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == '__main__':
+    main()
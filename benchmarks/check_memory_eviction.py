@@ -0,0 +1,185 @@
+# check_memory_eviction.py (ubicado en ~/Smart-Home-AI/benchmarks/check_memory_eviction.py)
+#
+# Comprueba la capacidad limitada de la memoria conversacional (RedNeuronal.memory) y de las
+# respuestas aprendidas (KnowledgeManager) con expulsión LFU con envejecimiento.
+# Termina con código 1 si alguna comprobación falla.
+#
+#   frequency_wins     -> con aciertos recientes, la entrada más usada sobrevive a una nueva
+#   aging              -> los aciertos antiguos pierden peso: una entrada muy usada hace meses se expulsa
+#   memory_bounded     -> la memoria no supera la capacidad; las entradas usadas y las fijadas se quedan
+#   memory_restart     -> tras reiniciar, la memoria y los aciertos se recuperan del diario/instantánea
+#   memory_shared      -> con el backend compartido, las expulsiones de una réplica llegan a la otra
+#   shared_compacted   -> el registro compartido de memoria se resume en una instantánea: no crece sin límite,
+#                         una réplica rezagada y una que arranca de nuevo llegan a la misma memoria
+#   shared_off_loop    -> con otra réplica reteniendo el cerrojo de escritura de SQLite, el bucle de eventos sigue atendiendo
+#   learned_bounded    -> las respuestas aprendidas expulsadas salen también del almacén de vectores y del índice léxico
+#   learned_restart    -> las estadísticas de uso de las respuestas aprendidas sobreviven a un reinicio
+#
+# Uso: python benchmarks/check_memory_eviction.py
+
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.check_resilience import Checker
+from benchmarks.fakes import FakeHomeAssistantAPI, deterministic_embedding
+from core_logic.eviction import FrequencyEviction
+from core_logic.knowledge_manager import KnowledgeManager
+from core_logic import neuron_network
+from core_logic.neuron_network import RedNeuronal
+from core_logic.state_backend import SQLiteStateBackend
+
+DAY = 86400
+
+def check_policy(checker):
+    def popular_policy(clock):
+        policy = FrequencyEviction("check", capacity=1, half_life_s=14 * DAY, clock=clock)
+        policy.add("popular")
+        for _ in range(10):
+            policy.hit("popular")
+        return policy
+
+    now = [0.0]
+    policy = popular_policy(lambda: now[0])
+    now[0] = 1 * DAY # 11 aciertos de ayer pesan ~10.5; una entrada nueva pesa 1
+    policy.add("nueva")
+    evicted = policy.evict()
+    checker.check("frequency_wins", evicted == ["nueva"], f"expulsadas={evicted}")
+
+    now[0] = 0.0
+    policy = popular_policy(lambda: now[0])
+    now[0] = 90 * DAY # 11 aciertos de hace tres meses pesan ~0.13
+    policy.add("nueva")
+    evicted = policy.evict()
+    checker.check("aging", evicted == ["popular"], f"expulsadas={evicted}")
+
+def new_network(capacity, state_backend=None):
+    return RedNeuronal("127.0.0.1", "fake-key", FakeHomeAssistantAPI(), memory_capacity=capacity, state_backend=state_backend)
+
+async def save(network, command, session="check"):
+    await network._set_pending_interaction(session, command, {"action_type": "text_response", "response_text": f"respuesta a {command}"})
+    await network.save_last_interaction(session)
+
+async def check_memory(checker, capacity=50, saved=200):
+    network = new_network(capacity)
+    await save(network, "¿cuál es la contraseña del wifi?")
+    network.pin_memory("¿cuál es la contraseña del wifi?")
+    await save(network, "¿a qué hora pasa la basura?")
+    for i in range(saved):
+        await save(network, f"pregunta de prueba {i}")
+        network._find_in_memory("¿A qué hora pasa la basura?") # Se usa a menudo
+    commands = {entry["command"] for entry in network.memory}
+    checker.check("memory_bounded", len(network.memory) == capacity and "¿cuál es la contraseña del wifi?" in commands
+                  and "¿a qué hora pasa la basura?" in commands and "pregunta de prueba 0" not in commands,
+                  f"{len(network.memory)} entradas, {network.get_memory_stats()['evictions']} expulsadas")
+
+    hits = network.memory_policy.export("¿a qué hora pasa la basura?")["hits"]
+    network.save_memory()
+    await network.aclose()
+    restarted = new_network(capacity)
+    restored = restarted.memory_policy.export("¿a qué hora pasa la basura?")
+    checker.check("memory_restart", {entry["command"] for entry in restarted.memory} == commands and restored["hits"] == hits
+                  and restarted.memory_policy.export("¿cuál es la contraseña del wifi?")["pinned"],
+                  f"{len(restarted.memory)} entradas, aciertos={restored['hits']}")
+    await restarted.aclose()
+
+async def check_shared_memory(checker, capacity=5):
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_memory_shared_")) # Sin diario local que importar
+    os.makedirs("knowledge")
+    path = os.path.join("knowledge", "shared_state.sqlite3")
+    backends = [SQLiteStateBackend(path), SQLiteStateBackend(path)]
+    replica_a, replica_b = (new_network(capacity, backend) for backend in backends)
+    for i in range(capacity + 3):
+        await save(replica_a, f"comando compartido {i}")
+    replica_b.sync_memory(force=True)
+    commands_a = [entry["command"] for entry in replica_a.memory]
+    commands_b = [entry["command"] for entry in replica_b.memory]
+    checker.check("memory_shared", len(commands_b) == capacity and commands_a == commands_b, f"réplica b: {commands_b}")
+
+    # La réplica b no sincroniza mientras a guarda (y expulsa) cientos de entradas y compacta el registro
+    neuron_network.MEMORY_LOG_COMPACT_MIN = 50
+    for i in range(300):
+        await save(replica_a, f"comando rezagado {i}")
+    replica_b.sync_memory(force=True)
+    replica_c = new_network(capacity, SQLiteStateBackend(path)) # Arranque nuevo: instantánea + cola del registro
+    with sqlite3.connect(path) as conn:
+        log_rows = conn.execute("SELECT COUNT(*) FROM logs WHERE log_name = 'memory'").fetchone()[0]
+    memories = [[entry["command"] for entry in replica.memory] for replica in (replica_a, replica_b, replica_c)]
+    checker.check("shared_compacted", log_rows <= 2 * neuron_network.MEMORY_LOG_COMPACT_MIN + 2 * capacity
+                  and memories[0] == memories[1] == memories[2] and len(memories[0]) == capacity,
+                  f"{log_rows} registros tras ~600 cambios, memoria: {memories[2]}")
+
+    # Otra réplica retiene el cerrojo de escritura; el bucle debe seguir atendiendo mientras esta espera
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.5, lambda: holder.execute("COMMIT")).start()
+    gaps = []
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await replica_c._set_pending_interaction("bloqueada", "pregunta", {"action_type": "text_response", "response_text": "respuesta"})
+    waited = time.perf_counter() - started
+    ticking.cancel()
+    holder.close()
+    checker.check("shared_off_loop", waited >= 0.4 and max(gaps) < 0.1,
+                  f"escritura esperó {waited * 1000:.0f} ms, mayor pausa del bucle {max(gaps) * 1000:.0f} ms")
+    neuron_network.MEMORY_LOG_COMPACT_MIN = 1000
+    for replica in (replica_a, replica_b, replica_c):
+        await replica.aclose()
+        replica.state_backend.close()
+
+def check_learned(checker, capacity=100, learned=300):
+    base_dir = "learned"
+    os.makedirs(base_dir)
+    manager = KnowledgeManager(base_dir=base_dir, learned_capacity=capacity)
+    manager.add_learned_response("receta de la tarta de queso", "Horno a 180 grados...", deterministic_embedding("receta de la tarta de queso"))
+    manager.pin_learned_response("receta de la tarta de queso")
+    entries = [(f"pregunta aprendida número {i}", f"respuesta {i}", deterministic_embedding(f"pregunta aprendida número {i}")) for i in range(learned)]
+    for start in range(0, learned, 10):
+        manager.add_knowledge_batch("learned_responses", entries[start:start + 10], save=True)
+        manager.get_response_from_memory("pregunta aprendida número 5")
+    vectors = manager.learned_responses_embeddings
+    lexical_hits = [key for _, key, _, _ in manager.lexical_index.search("pregunta aprendida número 0", top_k=5)]
+    checker.check("learned_bounded", len(manager.learned_responses) == capacity and set(vectors) == set(manager.learned_responses)
+                  and "receta de la tarta de queso" in manager.learned_responses and "pregunta aprendida número 5" in manager.learned_responses
+                  and "pregunta aprendida número 0" not in lexical_hits,
+                  f"{len(manager.learned_responses)} respuestas, {len(vectors)} vectores, filas muertas={manager.vector_store.dead_rows}")
+
+    hits = manager.learned_policy.export("pregunta aprendida número 5")["hits"]
+    manager.save_state() # Los aciertos se guardan con el estado (al apagar), no en cada consulta
+    restarted = KnowledgeManager(base_dir=base_dir, learned_capacity=capacity)
+    stats = restarted.get_learned_stats(top=3)
+    checker.check("learned_restart", set(restarted.learned_responses) == set(manager.learned_responses)
+                  and restarted.learned_policy.export("pregunta aprendida número 5")["hits"] == hits
+                  and restarted.learned_policy.export("receta de la tarta de queso")["pinned"],
+                  f"más usadas: {[(entry['key'], entry['hits']) for entry in stats['top']]}")
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_memory_eviction_"))
+    os.makedirs("knowledge")
+    checker = Checker()
+    check_policy(checker)
+    asyncio.run(check_memory(checker))
+    asyncio.run(check_shared_memory(checker))
+    check_learned(checker)
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == '__main__':
+    main()
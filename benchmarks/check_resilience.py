@@ -0,0 +1,113 @@
+# check_resilience.py (ubicado en ~/Smart-Home-AI/benchmarks/check_resilience.py)
+#
+# Comprueba el plazo por petición y los cortacircuitos del ML Server y de Gemini con sustitutos
+# locales que inyectan latencia y errores. Termina con código 1 si alguna comprobación falla.
+#
+#   gemini_slow       -> Gemini tarda más que el plazo: el comando termina dentro del plazo con el camino local
+#   gemini_breaker    -> tras N errores el circuito se abre y los comandos fallan al instante
+#   gemini_local_fallback -> con el circuito abierto se responde con el conocimiento local
+#   gemini_recovery   -> pasado reset_timeout, una llamada de prueba correcta vuelve a cerrar el circuito
+#   ml_server_errors  -> con el ML Server caído, la búsqueda de conocimiento no bloquea y Gemini sigue respondiendo
+#
+# Uso: python benchmarks/check_resilience.py
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeGeminiServer, FakeHomeAssistantAPI, FakeMLServer, deterministic_embedding
+from core_logic.knowledge_manager import KnowledgeManager
+from core_logic.neuron_network import RedNeuronal
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = 0.5
+
+class Checker:
+    def __init__(self):
+        self.failures = []
+
+    def check(self, name, condition, detail):
+        print(f"[{'OK' if condition else 'FALLO'}] {name}: {detail}")
+        if not condition:
+            self.failures.append(name)
+
+async def timed_command(network, command):
+    started = time.perf_counter()
+    response = await network.process_command(command)
+    return response, time.perf_counter() - started
+
+async def run_checks(network, fake_ml, fake_gemini, checker):
+    # Plazo: Gemini tarda 3 s y el plazo del comando es 0.5 s
+    fake_gemini.latency_s = 3.0
+    network.request_deadline_s = 0.5
+    response, elapsed = await timed_command(network, "pregunta lenta 1")
+    checker.check("gemini_slow", elapsed < 1.0, f"{elapsed * 1000:.0f} ms, respuesta: {response['response_text'][:60]!r}")
+
+    # Errores 500: el circuito se abre tras FAILURE_THRESHOLD fallos seguidos
+    fake_gemini.latency_s = 0.05
+    fake_gemini.error_status = 500
+    network.request_deadline_s = 5.0
+    network.gemini_breaker.record_success() # Parte del estado cerrado, sin el fallo del caso anterior
+    for i in range(FAILURE_THRESHOLD):
+        await network.process_command(f"pregunta con error {i}")
+    requests_before = fake_gemini.request_count
+    response, elapsed = await timed_command(network, "pregunta con circuito abierto")
+    checker.check("gemini_breaker", network.gemini_breaker.state == "open" and fake_gemini.request_count == requests_before and elapsed < 0.05,
+                  f"estado={network.gemini_breaker.state}, {elapsed * 1000:.1f} ms, sin llamada a Gemini: {fake_gemini.request_count == requests_before}")
+
+    # Conocimiento local como respaldo con el circuito abierto
+    response, _ = await timed_command(network, "¿qué hora es en Madrid ahora?")
+    checker.check("gemini_local_fallback", response["response_text"] == "Son las doce.", f"respuesta: {response['response_text']!r}")
+
+    # Recuperación: sin errores y pasado reset_timeout, la llamada de prueba cierra el circuito
+    fake_gemini.error_status = None
+    await asyncio.sleep(RESET_TIMEOUT)
+    response, _ = await timed_command(network, "pregunta tras la recuperación")
+    checker.check("gemini_recovery", network.gemini_breaker.state == "closed", f"estado={network.gemini_breaker.state}, respuesta: {response['response_text'][:40]!r}")
+
+    # ML Server con errores: la búsqueda por embedding falla rápido y el comando sigue por Gemini
+    fake_ml.error_status = 503
+    for i in range(FAILURE_THRESHOLD + 2):
+        response, elapsed = await timed_command(network, f"que hora es en madrid hoy {i}") # Candidato léxico ambiguo: pide embedding
+    checker.check("ml_server_errors", network.ml_breaker.state == "open" and response["response_text"].startswith("Respuesta simulada"),
+                  f"estado={network.ml_breaker.state}, último comando {elapsed * 1000:.0f} ms")
+    print(f"Circuitos: {network.get_breaker_stats()}")
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    fake_ml = FakeMLServer(latency_s=0.005).start()
+    fake_gemini = FakeGeminiServer(latency_s=0.05).start()
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_resilience_"))
+    os.makedirs("knowledge")
+
+    knowledge = KnowledgeManager(base_dir="knowledge")
+    knowledge.add_knowledge_batch("general_knowledge", [("¿Qué hora es en Madrid?", "Son las doce.", deterministic_embedding("¿Qué hora es en Madrid?"))])
+    network = RedNeuronal(fake_ml.host, "fake-key", FakeHomeAssistantAPI(), gemini_api_base=fake_gemini.base_url,
+                          ml_server_port=fake_ml.port, knowledge_manager=knowledge)
+    for breaker in (network.ml_breaker, network.gemini_breaker):
+        breaker.failure_threshold = FAILURE_THRESHOLD
+        breaker.reset_timeout = RESET_TIMEOUT
+
+    checker = Checker()
+
+    async def run():
+        try:
+            await run_checks(network, fake_ml, fake_gemini, checker)
+        finally:
+            await network.aclose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        fake_ml.stop()
+        fake_gemini.stop()
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# check_shared_state.py (ubicado en ~/Smart-Home-AI/benchmarks/check_shared_state.py)
+#
+# Comprueba el estado compartido entre réplicas de main_app con el backend SQLite: dos instancias
+# de RedNeuronal y HomeAssistantAPI sobre el mismo archivo, como dos réplicas tras un balanceador.
+# Termina con código 1 si alguna comprobación falla.
+#
+#   pending_per_session -> dos conversaciones concurrentes no se pisan la interacción pendiente
+#   confirm_other_replica -> /confirm_save atendido por otra réplica guarda la interacción correcta
+#   memory_shared       -> la memoria guardada en una réplica responde en la otra
+#   discovery_leader    -> sólo una réplica obtiene la concesión de descubrimiento
+#   entity_registry     -> la réplica sin descubrimiento copia el registro de entidades del líder
+#   leader_failover     -> al caducar la concesión del líder, otra réplica la toma
+#
+# Uso: python benchmarks/check_shared_state.py
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.check_resilience import Checker
+from benchmarks.fakes import FakeGeminiServer, FakeMLServer, FakeMQTTClient
+from core_logic.home_assistant_api import HomeAssistantAPI
+from core_logic.neuron_network import RedNeuronal
+from core_logic.state_backend import SQLiteStateBackend
+
+async def check_conversations(replica_a, replica_b, checker):
+    # Dos usuarios envían comandos a la vez a réplicas distintas
+    await asyncio.gather(replica_a.process_command("¿qué tiempo hace?", "usuario-1"),
+                         replica_b.process_command("cuéntame un chiste", "usuario-2"))
+    checker.check("pending_per_session", replica_a.has_pending_interaction("usuario-1") and replica_a.has_pending_interaction("usuario-2"),
+                  "cada sesión conserva su interacción pendiente")
+
+    # El usuario 1 confirma a través de la otra réplica; la del usuario 2 sigue pendiente
+    await replica_b.save_last_interaction("usuario-1")
+    saved = [entry["command"] for entry in replica_b.memory]
+    checker.check("confirm_other_replica", saved == ["¿qué tiempo hace?"] and replica_b.has_pending_interaction("usuario-2"),
+                  f"memoria={saved}")
+
+    replica_a.sync_memory(force=True)
+    response = await replica_a.process_command("¿Qué tiempo hace?", "usuario-3")
+    checker.check("memory_shared", response["response_text"] == replica_b.memory[0]["response"],
+                  f"respuesta desde la memoria compartida: {response['response_text'][:50]!r}")
+
+def check_discovery(path, checker):
+    backend_a, backend_b = SQLiteStateBackend(path), SQLiteStateBackend(path)
+    leader = HomeAssistantAPI(FakeMQTTClient(), state_backend=backend_a)
+    follower = HomeAssistantAPI(FakeMQTTClient(), state_backend=backend_b)
+    lease_ttl = 0.5
+    leader.consume_discovery = backend_a.try_acquire_lease("discovery", "replica-a", lease_ttl)
+    follower.consume_discovery = backend_b.try_acquire_lease("discovery", "replica-b", lease_ttl)
+    checker.check("discovery_leader", leader.consume_discovery and not follower.consume_discovery,
+                  f"líder={leader.consume_discovery}, seguidor={follower.consume_discovery}")
+
+    # Ambas réplicas reciben los mensajes retenidos; sólo el líder los procesa
+    config = '{"name": "Luz Lectura", "command_topic": "biblioteca/luz/set", "device": {"suggested_area": "Biblioteca"}}'
+    for api in (leader, follower):
+        api.process_mqtt_message("homeassistant/light/biblioteca/lectura/config", config)
+    copied_before = len(follower.ha_entity_info)
+    follower.sync_from_state()
+    checker.check("entity_registry", copied_before == 0 and follower.ha_entity_info == leader.ha_entity_info
+                  and follower.find_entities("luz lectura bibloteca")[:1] == leader.find_entities("luz lectura bibloteca")[:1],
+                  f"entidades copiadas: {list(follower.ha_entity_info)}")
+
+    time.sleep(lease_ttl) # El líder deja de renovar su concesión
+    follower.consume_discovery = backend_b.try_acquire_lease("discovery", "replica-b", lease_ttl)
+    checker.check("leader_failover", follower.consume_discovery and not backend_a.try_acquire_lease("discovery", "replica-a", lease_ttl),
+                  "la concesión pasa a la réplica b")
+    backend_a.close()
+    backend_b.close()
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    fake_ml = FakeMLServer(latency_s=0.002).start()
+    fake_gemini = FakeGeminiServer(latency_s=0.05).start()
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_shared_state_"))
+    os.makedirs("knowledge")
+    path = os.path.join("knowledge", "shared_state.sqlite3")
+    checker = Checker()
+
+    async def run():
+        backends = [SQLiteStateBackend(path), SQLiteStateBackend(path)]
+        replicas = [RedNeuronal(fake_ml.host, "fake-key", HomeAssistantAPI(FakeMQTTClient()), gemini_api_base=fake_gemini.base_url,
+                                ml_server_port=fake_ml.port, state_backend=backend) for backend in backends]
+        try:
+            await check_conversations(*replicas, checker)
+        finally:
+            for replica, backend in zip(replicas, backends):
+                await replica.aclose()
+                backend.close()
+
+    try:
+        asyncio.run(run())
+        check_discovery(os.path.join("knowledge", "discovery_state.sqlite3"), checker)
+    finally:
+        fake_ml.stop()
+        fake_gemini.stop()
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == '__main__':
+    main()
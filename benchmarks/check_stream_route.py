@@ -0,0 +1,92 @@
+# check_stream_route.py (ubicado en ~/Smart-Home-AI/benchmarks/check_stream_route.py)
+#
+# Consume la ruta /enviar_comando_stream de main_app de punta a punta (cliente de pruebas de Flask,
+# bucle de la aplicación en su hilo y Gemini simulado). Termina con código 1 si alguna comprobación falla.
+#
+#   stream_complete  -> una respuesta de texto llega en líneas 'delta' y termina con una línea 'final'
+#                       sin errores al leer el cuerpo (cada paso del generador corre en otra tarea del bucle)
+#   stream_memory    -> un comando ya guardado en memoria devuelve sólo la línea 'final'
+#   stream_deadline  -> con un Gemini más lento que el plazo, el streaming respeta request_deadline_s
+#                       en todos los pasos y termina con la respuesta local
+#   stream_closed    -> si el cliente deja de leer tras la primera línea, el generador se cierra sin errores
+#
+# Uso: python benchmarks/check_stream_route.py
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.check_resilience import Checker
+from benchmarks.fakes import FakeGeminiServer, FakeHomeAssistantAPI
+from core_logic.neuron_network import RedNeuronal
+
+DEADLINE_S = 1.0
+
+def stream(client, command):
+    """
+    Envía un comando a la ruta en streaming y devuelve (eventos, error al leer el cuerpo, segundos).
+    """
+    started = time.perf_counter()
+    try:
+        body = client.post('/enviar_comando_stream', json={"comando": command}).get_data(as_text=True)
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}", time.perf_counter() - started
+    events = [json.loads(line) for line in body.splitlines() if line.strip()]
+    return events, None, time.perf_counter() - started
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    checker = Checker()
+    fake_gemini = FakeGeminiServer(first_token_s=0.05, chunk_delay_s=0.01).start()
+
+    # RedNeuronal guarda su memoria en ./knowledge: usar un directorio temporal
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_check_"))
+    os.makedirs("knowledge")
+
+    import main_app.app as smart_home_app
+    smart_home_app.start_app_loop()
+    network = RedNeuronal("127.0.0.1", "fake-key", FakeHomeAssistantAPI(), gemini_api_base=fake_gemini.base_url, request_deadline_s=DEADLINE_S)
+    smart_home_app.neuron_network_global = network
+    smart_home_app.home_assistant_api_global = network.home_assistant_api
+    client = smart_home_app.app.test_client()
+    try:
+        events, error, _ = stream(client, "cuéntame algo")
+        deltas = "".join(event["text"] for event in events if event["type"] == "delta")
+        final = events[-1] if events else {}
+        checker.check("stream_complete", error is None and deltas and final.get("type") == "final" and final.get("response_text") == deltas,
+                      f"{len(events)} líneas, error={error}, final={final.get('response_text', '')[:40]!r}")
+
+        network.memory.append({"command": "comando en memoria", "response": "respuesta en memoria"})
+        events, error, _ = stream(client, "comando en memoria")
+        checker.check("stream_memory", error is None and [event["type"] for event in events] == ["final"] and
+                      events[0]["response_text"] == "respuesta en memoria", f"eventos={events}, error={error}")
+
+        # El primer fragmento llega enseguida; el resto tardaría ~5 s, mucho más que el plazo
+        fake_gemini.chunk_delay_s = 0.2
+        events, error, elapsed = stream(client, "cuéntame algo largo")
+        final = events[-1] if events else {}
+        checker.check("stream_deadline", error is None and final.get("type") == "final" and elapsed < DEADLINE_S + 0.5,
+                      f"{elapsed:.2f} s con un plazo de {DEADLINE_S} s, error={error}, final={final.get('response_text', '')[:40]!r}")
+        fake_gemini.chunk_delay_s = 0.01
+
+        response = client.post('/enviar_comando_stream', json={"comando": "cuéntame otra cosa"}, buffered=False)
+        try:
+            first = json.loads(next(iter(response.response)))
+            response.close()
+            error = None
+        except Exception as e:
+            first, error = {}, f"{type(e).__name__}: {e}"
+        checker.check("stream_closed", error is None and first.get("type") == "delta", f"primera línea={first}, error={error}")
+    finally:
+        smart_home_app.run_on_app_loop(network.aclose())
+        fake_gemini.stop()
+    sys.exit(1 if checker.failures else 0)
+
+if __name__ == '__main__':
+    main()
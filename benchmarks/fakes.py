@@ -0,0 +1,476 @@
+# fakes.py (ubicado en ~/Smart-Home-AI/benchmarks/fakes.py)
+#
+# Servidores locales que sustituyen a las dependencias externas en los benchmarks.
+# Sólo usan la librería estándar para poder ejecutarse en cualquier entorno.
+
+import hashlib
+import json
+import random
+import queue
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256 # Evita reintentos de conexión (1 s) con concurrencia alta
+
+def default_gemini_responder(command):
+    """
+    Respuesta estructurada por defecto: una respuesta de texto que repite el comando.
+    """
+    return {"action_type": "text_response", "response_text": f"Respuesta simulada para: {command}. " + "Texto de relleno. " * 8}
+
+class FakeGeminiServer:
+    """
+    Sustituto local de la API de Gemini ('generateContent' y 'streamGenerateContent?alt=sse').
+
+    :param latency_s: Latencia total de una respuesta completa (generateContent).
+    :param first_token_s: Latencia hasta el primer fragmento en streaming.
+    :param chunk_delay_s: Pausa entre fragmentos en streaming.
+    :param chunk_size: Caracteres del JSON de respuesta por fragmento.
+    :param responder: Función comando -> dict con la respuesta estructurada.
+    :param latency_per_1k_tokens_s: Latencia añadida por cada 1000 tokens del prompt (~4 caracteres por token).
+    """
+
+    def __init__(self, latency_s=0.5, first_token_s=0.1, chunk_delay_s=0.02, chunk_size=16, responder=default_gemini_responder, latency_per_1k_tokens_s=0.0):
+        self.latency_s = latency_s
+        self.latency_per_1k_tokens_s = latency_per_1k_tokens_s
+        self.last_prompt_chars = 0
+        self.first_token_s = first_token_s
+        self.chunk_delay_s = chunk_delay_s
+        self.chunk_size = chunk_size
+        self.responder = responder
+        self.error_status = None # Código HTTP de error a devolver en lugar de la respuesta (inyección de fallos)
+        self.request_count = 0
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta/models/fake-gemini"
+
+    def _response_text(self, body):
+        prompt = body["contents"][-1]["parts"][0]["text"]
+        match = re.search(r"Comando del usuario:\s*(.*)", prompt)
+        command = match.group(1).strip() if match else prompt
+        return json.dumps(self.responder(command), ensure_ascii=False)
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.request_count += 1
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if fake.error_status:
+                    time.sleep(fake.latency_s)
+                    self.send_error(fake.error_status)
+                    return
+                text = fake._response_text(body)
+                fake.last_prompt_chars = len(body["contents"][-1]["parts"][0]["text"])
+                if ":streamGenerateContent" in self.path:
+                    self._stream(text)
+                else:
+                    time.sleep(fake.latency_s + fake.latency_per_1k_tokens_s * fake.last_prompt_chars / 4000)
+                    data = json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def _stream(self, text):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(fake.first_token_s)
+                for i in range(0, len(text), fake.chunk_size):
+                    event = {"candidates": [{"content": {"parts": [{"text": text[i:i + fake.chunk_size]}]}}]}
+                    self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode())
+                    time.sleep(fake.chunk_delay_s)
+                self._write_chunk(b"")
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        self._server = _FakeHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+def deterministic_embedding(text, dim=384):
+    """
+    Embedding determinista (mismo texto normalizado -> mismo vector unitario), sin modelo.
+    """
+    seed = int.from_bytes(hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+class FakeMLServer:
+    """
+    Sustituto local del ML Server ('/get_embedding' y '/get_embeddings') con embeddings deterministas.
+
+    :param latency_s: Latencia añadida a cada petición (simula el tiempo de 'encode').
+    :param dim: Dimensión de los embeddings.
+    """
+
+    def __init__(self, latency_s=0.01, dim=384):
+        self.latency_s = latency_s
+        self.dim = dim
+        self.error_status = None # Código HTTP de error a devolver en lugar del embedding (inyección de fallos)
+        self.request_count = 0
+        self._server = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True # Cabeceras y cuerpo van en escrituras separadas: sin esto, cada respuesta espera el ACK retardado
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.request_count += 1
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                time.sleep(fake.latency_s)
+                if fake.error_status:
+                    self.send_error(fake.error_status)
+                    return
+                if self.path == "/get_embedding":
+                    data = {"embedding": deterministic_embedding(body["text"], fake.dim)}
+                elif self.path == "/get_embeddings":
+                    data = {"embeddings": [deterministic_embedding(text, fake.dim) for text in body["texts"]], "model": "fake"}
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = _FakeHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class _EncodedVectors(list):
+    def tolist(self):
+        return list(self)
+
+class FakeSentenceTransformer:
+    """
+    Sustituto en proceso de SentenceTransformer con los mismos embeddings que FakeMLServer.
+
+    :param latency_s: Tiempo de cada 'encode' (se bloquea el hilo que codifica, como el modelo real).
+    :param load_s: Tiempo de carga del modelo.
+    """
+
+    def __init__(self, latency_s=0.01, dim=384, load_s=0.0):
+        time.sleep(load_s)
+        self.latency_s = latency_s
+        self.dim = dim
+        self.encode_count = 0
+
+    def encode(self, texts, batch_size=32):
+        self.encode_count += 1
+        time.sleep(self.latency_s)
+        if isinstance(texts, str):
+            return _EncodedVectors(deterministic_embedding(texts, self.dim))
+        return _EncodedVectors(_EncodedVectors(deterministic_embedding(text, self.dim)) for text in texts)
+
+class FakeMQTTClient:
+    """
+    Sustituto en proceso de MQTTClient: registra las publicaciones y permite inyectar
+    mensajes entrantes en el callback como si llegaran del broker.
+    """
+
+    def __init__(self, message_callback=None):
+        self.message_callback = message_callback
+        self.published = []
+        self.subscriptions = []
+
+    def connect(self):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+
+    def subscribe(self, topic):
+        self.subscriptions.append(topic)
+
+    def subscribe_to_all_ha_topics(self, base_topic):
+        for topic in (f"{base_topic}/#", "tasmota/discovery/+/config", "tele/+/STATE", "stat/+/POWER"):
+            self.subscribe(topic)
+
+    def inject(self, topic, payload):
+        if self.message_callback:
+            self.message_callback(topic, payload if isinstance(payload, str) else json.dumps(payload))
+
+def mqtt_topic_matches(topic_filter, topic):
+    """
+    Coincidencia de un tópico con un filtro MQTT ('+' un nivel, '#' el resto).
+    """
+    filter_levels, levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+def _mqtt_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (128 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+def _mqtt_publish_packet(topic, payload, retain=False):
+    topic = topic.encode("utf-8")
+    body = len(topic).to_bytes(2, "big") + topic + payload
+    return bytes([0x30 | (1 if retain else 0)]) + _mqtt_length(len(body)) + body
+
+class _BrokerConnection:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.filters = []
+        self.outbox = queue.SimpleQueue()
+        self.closed = False
+
+    def send(self, packet):
+        self.outbox.put(packet)
+
+    def write_loop(self):
+        # Un hilo escritor por conexión: un suscriptor lento no bloquea a quien publica
+        while True:
+            packet = self.outbox.get()
+            if packet is None:
+                return
+            chunks = [packet]
+            while len(chunks) < 256:
+                try:
+                    packet = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if packet is None:
+                    self.outbox.put(None)
+                    break
+                chunks.append(packet)
+            try:
+                self.sock.sendall(b"".join(chunks))
+            except OSError:
+                return
+
+    def read_loop(self):
+        reader = self.sock.makefile("rb")
+        try:
+            while True:
+                header = reader.read(1)
+                if not header:
+                    return
+                length, multiplier = 0, 1
+                while True:
+                    byte = reader.read(1)[0]
+                    length += (byte & 127) * multiplier
+                    if not byte & 128:
+                        break
+                    multiplier *= 128
+                body = reader.read(length)
+                if not self.broker._handle(self, header[0], body):
+                    return
+        except (OSError, IndexError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker._disconnect(self)
+            self.outbox.put(None)
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+class FakeMQTTBroker:
+    """
+    Broker MQTT 3.1.1 mínimo en proceso (TCP local) para probar MQTTClient/paho sin un broker real:
+    CONNECT, PUBLISH (QoS 0; QoS 1 con PUBACK), SUBSCRIBE/UNSUBSCRIBE con comodines, mensajes
+    retenidos (se reenvían al suscribirse; un payload vacío los borra), PINGREQ y DISCONNECT.
+    Todo se entrega con QoS 0. Cuenta los mensajes recibidos y entregados.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.retained = {} # {tópico: payload}
+        self.received = 0
+        self.delivered = 0
+        self._connections = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _BrokerConnection(self, sock)
+            with self._lock:
+                self._connections.append(connection)
+            threading.Thread(target=connection.read_loop, daemon=True).start()
+            threading.Thread(target=connection.write_loop, daemon=True).start()
+
+    def _handle(self, connection, first_byte, body):
+        packet_type = first_byte >> 4
+        if packet_type == 1: # CONNECT
+            connection.send(b"\x20\x02\x00\x00")
+        elif packet_type == 3: # PUBLISH
+            qos, retain = (first_byte >> 1) & 3, first_byte & 1
+            topic_length = int.from_bytes(body[:2], "big")
+            topic = body[2:2 + topic_length].decode("utf-8")
+            offset = 2 + topic_length
+            if qos:
+                connection.send(b"\x40\x02" + body[offset:offset + 2])
+                offset += 2
+            self._route(topic, body[offset:], retain)
+        elif packet_type == 8: # SUBSCRIBE
+            packet_id, offset, new_filters = body[:2], 2, []
+            while offset < len(body):
+                filter_length = int.from_bytes(body[offset:offset + 2], "big")
+                new_filters.append(body[offset + 2:offset + 2 + filter_length].decode("utf-8"))
+                offset += 2 + filter_length + 1
+            with self._lock:
+                connection.filters.extend(new_filters)
+                retained = list(self.retained.items())
+            connection.send(b"\x90" + _mqtt_length(2 + len(new_filters)) + packet_id + b"\x00" * len(new_filters))
+            for topic, payload in retained:
+                if any(mqtt_topic_matches(topic_filter, topic) for topic_filter in new_filters):
+                    connection.send(_mqtt_publish_packet(topic, payload, retain=True))
+                    self.delivered += 1
+        elif packet_type == 10: # UNSUBSCRIBE
+            offset, removed = 2, set()
+            while offset < len(body):
+                filter_length = int.from_bytes(body[offset:offset + 2], "big")
+                removed.add(body[offset + 2:offset + 2 + filter_length].decode("utf-8"))
+                offset += 2 + filter_length
+            with self._lock:
+                connection.filters = [topic_filter for topic_filter in connection.filters if topic_filter not in removed]
+            connection.send(b"\xb0\x02" + body[:2])
+        elif packet_type == 12: # PINGREQ
+            connection.send(b"\xd0\x00")
+        elif packet_type == 14: # DISCONNECT
+            return False
+        return True
+
+    def _route(self, topic, payload, retain):
+        with self._lock:
+            self.received += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            targets = [connection for connection in self._connections
+                       if any(mqtt_topic_matches(topic_filter, topic) for topic_filter in connection.filters)]
+            self.delivered += len(targets)
+        packet = _mqtt_publish_packet(topic, payload)
+        for connection in targets:
+            connection.send(packet)
+
+    def _disconnect(self, connection):
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.close()
+
+class FakeHomeAssistantAPI:
+    """
+    Sustituto mínimo de HomeAssistantAPI sin cliente MQTT (registra los comandos enviados).
+    """
+
+    def __init__(self, entities=None):
+        self.ha_entity_info = entities or {}
+        self.tasmota_command_map = {}
+        self.entity_version = 0
+        self.sent_commands = []
+
+    @staticmethod
+    def entity_aliases(entity_id, info):
+        return [info.get("name") or entity_id, entity_id.split('.', 1)[-1].replace('_', ' ')]
+
+    def find_entities(self, query, limit=5, domain=None, partial=False):
+        return []
+
+    def resolve_entity_id(self, entity_id, domain=None):
+        return entity_id if entity_id in self.ha_entity_info else None
+
+    def telemetry_summary(self, entity_id, info):
+        return None
+
+    def send_tasmota_command(self, entity_id, state):
+        self.sent_commands.append(("tasmota", entity_id, state))
+        return True, f"Comando '{state}' enviado directamente a '{entity_id}' (Tasmota)."
+
+    def send_ha_command(self, domain, service, entity_id, payload=None):
+        self.sent_commands.append(("ha", entity_id, service))
+        return True, f"Comando '{service}' enviado a '{entity_id}' a través de Home Assistant MQTT."
@@ -0,0 +1,70 @@
+# load_enviar_comando.py (ubicado en ~/Smart-Home-AI/benchmarks/load_enviar_comando.py)
+#
+# Prueba de carga de /enviar_comando contra una instancia de main_app en ejecución.
+# Lanza N peticiones con una concurrencia dada y muestra el throughput y las latencias.
+#
+# Uso:
+#   uvicorn main_app.asgi:asgi_app --port 5000    (en otra terminal)
+#   python benchmarks/load_enviar_comando.py --url http://localhost:5000 --requests 200 --concurrency 20
+
+import argparse
+import asyncio
+import json
+import time
+import httpx
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def run_load(url, total_requests, concurrency, commands):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120.0, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one_request(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post('/enviar_comando', json={"comando": commands[i % len(commands)]})
+                    response.raise_for_status()
+                    if response.json().get("status") != "success":
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga concurrente de /enviar_comando.")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--command', action='append', help="Comando a enviar (se puede repetir). Por defecto uno que está en memoria.")
+    args = parser.parse_args()
+
+    commands = args.command or ["Hola"]
+    results = [asyncio.run(run_load(args.url, args.requests, c, commands)) for c in args.concurrency]
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+# mqtt_fleet.py (ubicado en ~/Smart-Home-AI/benchmarks/mqtt_fleet.py)
+#
+# Simulador de una flota de dispositivos Tasmota sobre MQTT y prueba de carga de MQTTClient +
+# HomeAssistantAPI sin hardware. Cada dispositivo simulado:
+#
+#   - anuncia su configuración retenida: descubrimiento nativo (tasmota/discovery/<MAC>/config)
+#     o HA Discovery (homeassistant/switch/<topic>/config), más tele/<topic>/LWT = Online
+#   - publica tele/<topic>/STATE periódicamente (repartido uniformemente en el intervalo)
+#   - responde a cmnd/<topic>/POWER[n] (ON, OFF, TOGGLE o vacío) con stat/<topic>/RESULT y stat/<topic>/POWER[n]
+#
+# Los dispositivos se reparten entre unas pocas conexiones paho (como una pasarela), contra un
+# broker real (--broker host:port) o el broker en proceso de benchmarks/fakes.py.
+#
+# Fases e informe:
+#   discovery -> la aplicación conectada recibe los anuncios en directo: entidades/s y latencia del callback
+#   steady    -> telemetría a la frecuencia configurada y comandos: mensajes/s, latencia del callback e ida y
+#                vuelta de los comandos (publicación en cmnd -> eco en stat recibido por la aplicación)
+#   storms    -> tormentas de reenvío de retenidos: réplicas nuevas que se conectan a la vez y reciben
+#                todos los anuncios retenidos; tiempo hasta tener todas las entidades y latencia del callback
+#   memory    -> bytes retenidos por entidad en HomeAssistantAPI (tracemalloc, ingesta directa)
+#
+# Termina con código 1 si la aplicación no descubre todas las entidades o algún comando queda sin eco.
+#
+# Uso: python benchmarks/mqtt_fleet.py --devices 2000 --ha-ratio 0.3 --tele-interval 10 --duration 20 --command-rate 20 --storms 2
+
+import argparse
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+import paho.mqtt.client as mqtt
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeMQTTBroker, FakeMQTTClient
+from core_logic.home_assistant_api import HomeAssistantAPI
+from core_logic.mqtt_client import MQTTClient
+from core_logic.telemetry_store import TelemetryStore
+
+class SimulatedDevice:
+    """
+    Un dispositivo Tasmota: topic, MAC, relés y estado de cada relé.
+    """
+
+    def __init__(self, index, relays=1, ha_discovery=False):
+        self.index = index
+        self.mac = f"A0B1C2{index:06X}"
+        self.topic = f"tasmota_{self.mac[-6:]}"
+        self.hostname = f"tasmota-{self.mac[-6:]}-{index % 10000:04d}"
+        self.relays = relays
+        self.ha_discovery = ha_discovery
+        self.power = ["OFF"] * relays
+        self.uptime = 0
+
+    def entity_ids(self):
+        if self.ha_discovery:
+            return [f"switch.{self.topic}_{relay + 1}" if self.relays > 1 else f"switch.{self.topic}" for relay in range(self.relays)]
+        base = f"light.{self.hostname.lower().replace('-', '_')}"
+        return [f"{base}_{relay + 1}" for relay in range(self.relays)] if self.relays > 1 else [base]
+
+    def power_key(self, relay):
+        return f"POWER{relay + 1}" if self.relays > 1 else "POWER"
+
+    def discovery_messages(self):
+        """
+        Anuncios retenidos del dispositivo: [(tópico, payload)].
+        """
+        if self.ha_discovery:
+            messages = []
+            for relay in range(self.relays):
+                object_id = f"{self.topic}_{relay + 1}" if self.relays > 1 else self.topic
+                messages.append((f"homeassistant/switch/{object_id}/config", json.dumps({
+                    "name": f"Enchufe {self.index}" + (f" {relay + 1}" if self.relays > 1 else ""),
+                    "object_id": object_id,
+                    "unique_id": f"{self.mac}_RL_{relay + 1}",
+                    "state_topic": f"stat/{self.topic}/{self.power_key(relay)}",
+                    "command_topic": f"cmnd/{self.topic}/{self.power_key(relay)}",
+                    "availability_topic": f"tele/{self.topic}/LWT",
+                    "payload_on": "ON", "payload_off": "OFF",
+                    "device": {"identifiers": [self.mac], "name": f"Enchufe {self.index}", "model": "Sonoff Basic", "sw_version": "13.1.0"}
+                })))
+            return messages
+        return [(f"tasmota/discovery/{self.mac}/config", json.dumps({
+            "ip": f"10.{self.index // 65536 % 256}.{self.index // 256 % 256}.{self.index % 256}",
+            "dn": f"Enchufe {self.index}",
+            "fn": [f"Enchufe {self.index}" + (f" {relay + 1}" if self.relays > 1 else "") for relay in range(self.relays)],
+            "hn": self.hostname, "mac": self.mac, "md": "Sonoff Basic", "ty": 0, "if": 0,
+            "ofln": "Offline", "onln": "Online", "state": ["OFF", "ON", "TOGGLE", "HOLD"],
+            "sw": "13.1.0", "t": self.topic, "ft": "%prefix%/%topic%/", "tp": ["cmnd", "stat", "tele"],
+            "rl": [1] * self.relays, "swc": [-1] * self.relays, "btn": [0] * self.relays, "ver": 1
+        }))]
+
+    def state_payload(self, rng):
+        self.uptime += 1
+        state = {"Time": time.strftime("%Y-%m-%dT%H:%M:%S"), "UptimeSec": self.uptime, "Heap": rng.randint(20, 30),
+                 "SleepMode": "Dynamic", "Sleep": 50, "LoadAvg": rng.randint(5, 40), "MqttCount": 1}
+        for relay in range(self.relays):
+            state[self.power_key(relay)] = self.power[relay]
+        state["Wifi"] = {"AP": 1, "SSId": "casa", "Channel": 6, "RSSI": rng.randint(40, 100), "Signal": rng.randint(-80, -40), "LinkCount": 1}
+        return json.dumps(state)
+
+    def handle_command(self, command, payload):
+        """
+        Aplica cmnd/<topic>/<comando>; devuelve los ecos [(tópico, payload)] o [] si no es un POWER conocido.
+        """
+        command = command.upper()
+        if command == "POWER" or (command.startswith("POWER") and command[5:].isdigit()):
+            relay = int(command[5:] or 1) - 1
+        else:
+            return []
+        if relay >= self.relays:
+            return []
+        value = payload.strip().upper()
+        if value in ("ON", "1"):
+            self.power[relay] = "ON"
+        elif value in ("OFF", "0"):
+            self.power[relay] = "OFF"
+        elif value in ("TOGGLE", "2"):
+            self.power[relay] = "OFF" if self.power[relay] == "ON" else "ON"
+        key = self.power_key(relay)
+        return [(f"stat/{self.topic}/RESULT", json.dumps({key: self.power[relay]})), (f"stat/{self.topic}/{key}", self.power[relay])]
+
+class TasmotaFleet:
+    """
+    Flota de SimulatedDevice repartida entre 'connections' clientes paho.
+    """
+
+    def __init__(self, host, port, devices=1000, relays=1, ha_ratio=0.0, connections=4, seed=7):
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.devices = [SimulatedDevice(i, relays, ha_discovery=self.rng.random() < ha_ratio) for i in range(devices)]
+        self.by_topic = {device.topic: device for device in self.devices}
+        self.connections = connections
+        self.clients = []
+        self.commands_handled = 0
+        self.published = 0
+        self._stop = threading.Event()
+        self._tele_thread = None
+
+    def _client_for(self, device):
+        return self.clients[device.index % len(self.clients)]
+
+    def connect(self):
+        for c in range(self.connections):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"fleet-{c}-{uuid.uuid4().hex[:6]}")
+            connected = threading.Event()
+            client.on_connect = lambda client, userdata, flags, reason_code, properties, connected=connected: connected.set()
+            client.on_message = self._on_command
+            # Varios dispositivos comparten conexión: sin esto, los dos ecos seguidos de un comando
+            # esperan al ACK retardado del primero (Nagle, ~40 ms) y la ida y vuelta no sería la de un dispositivo real
+            client.on_socket_open = lambda client, userdata, sock: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client.max_queued_messages_set(0)
+            client.connect(self.host, self.port, 60)
+            client.loop_start()
+            if not connected.wait(10):
+                raise RuntimeError(f"La flota no pudo conectarse al broker {self.host}:{self.port}")
+            # Un filtro por conexión (como una pasarela); cada conexión sólo atiende a sus dispositivos
+            client.subscribe("cmnd/#")
+            self.clients.append(client)
+        return self
+
+    def _on_command(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        device = self.by_topic.get(parts[1]) if len(parts) == 3 else None
+        if device is None or self._client_for(device) is not client:
+            return
+        for topic, payload in device.handle_command(parts[2], msg.payload.decode()):
+            client.publish(topic, payload)
+            self.published += 1
+        self.commands_handled += 1
+
+    def announce(self):
+        """
+        Publica todos los anuncios retenidos (arranque de la flota). Devuelve el número de mensajes.
+        """
+        count = 0
+        for device in self.devices:
+            client = self._client_for(device)
+            for topic, payload in device.discovery_messages():
+                client.publish(topic, payload, retain=True)
+                count += 1
+            client.publish(f"tele/{device.topic}/LWT", "Online", retain=True)
+            count += 1
+        self.published += count
+        return count
+
+    def start_telemetry(self, interval_s):
+        """
+        tele/<topic>/STATE de cada dispositivo cada 'interval_s' segundos, repartidos en el intervalo.
+        """
+        def loop():
+            tick = 0.01
+            per_tick = len(self.devices) * tick / interval_s
+            due, position = 0.0, 0
+            next_tick = time.perf_counter()
+            while not self._stop.is_set():
+                due += per_tick
+                while due >= 1.0:
+                    device = self.devices[position % len(self.devices)]
+                    self._client_for(device).publish(f"tele/{device.topic}/STATE", device.state_payload(self.rng))
+                    self.published += 1
+                    position += 1
+                    due -= 1.0
+                next_tick += tick
+                self._stop.wait(max(0.0, next_tick - time.perf_counter()))
+
+        self._stop.clear()
+        self._tele_thread = threading.Thread(target=loop, name="fleet-telemetry", daemon=True)
+        self._tele_thread.start()
+
+    def stop_telemetry(self):
+        self._stop.set()
+        if self._tele_thread:
+            self._tele_thread.join()
+
+    def clear_retained(self):
+        """
+        Borra los anuncios retenidos (payload vacío) para no dejar la flota en un broker real.
+        """
+        for device in self.devices:
+            client = self._client_for(device)
+            for topic, _ in device.discovery_messages():
+                client.publish(topic, b"", retain=True)
+            client.publish(f"tele/{device.topic}/LWT", b"", retain=True)
+
+    def disconnect(self):
+        self.stop_telemetry()
+        for client in self.clients:
+            client.disconnect()
+            client.loop_stop()
+        self.clients = []
+
+class AppSide:
+    """
+    Lado de la aplicación: MQTTClient + HomeAssistantAPI como en main_app, con el callback
+    instrumentado (duración por fase y eco de los comandos enviados).
+    """
+
+    def __init__(self, host, port, name="app", telemetry_max_series=20000):
+        self.callback_seconds = {} # {fase: [duraciones]}
+        self.phase = "discovery"
+        self.pending_commands = {} # {state_topic: [instante_de_envío]}
+        self.round_trips = []
+        self._lock = threading.Lock()
+        self.mqtt_client = MQTTClient(host, port, "", "", f"{name}-{uuid.uuid4().hex[:6]}", self._on_message)
+        self.api = HomeAssistantAPI(self.mqtt_client, telemetry_store=TelemetryStore(max_series=telemetry_max_series))
+
+    def start(self):
+        self.mqtt_client.connect()
+        self.mqtt_client.loop_start()
+        self.mqtt_client.subscribe_to_all_ha_topics(self.api.base_topic)
+        return self
+
+    def _on_message(self, topic, payload):
+        started = time.perf_counter()
+        self.api.process_mqtt_message(topic, payload)
+        finished = time.perf_counter()
+        self.callback_seconds.setdefault(self.phase, []).append(finished - started)
+        if topic.startswith("stat/"):
+            with self._lock:
+                sent = self.pending_commands.get(topic)
+                if sent:
+                    self.round_trips.append(finished - sent.pop(0))
+
+    def send_command(self, entity_id, state):
+        info = self.api.ha_entity_info[entity_id]
+        with self._lock:
+            self.pending_commands.setdefault(info["state_topic"], []).append(time.perf_counter())
+        self.api.send_tasmota_command(entity_id, state)
+
+    def unanswered(self):
+        with self._lock:
+            return sum(len(sent) for sent in self.pending_commands.values())
+
+    def wait_for_entities(self, expected, timeout_s):
+        deadline = time.perf_counter() + timeout_s
+        while len(self.api.ha_entity_info) < expected and time.perf_counter() < deadline:
+            time.sleep(0.005)
+        return len(self.api.ha_entity_info)
+
+    def stop(self):
+        self.mqtt_client.client.disconnect()
+        self.mqtt_client.loop_stop()
+
+def latency_summary(seconds, unit=1e6, suffix="us"):
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+    return {
+        f"p50_{suffix}": round(statistics.median(ordered) * unit, 1),
+        f"p99_{suffix}": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * unit, 1),
+        f"max_{suffix}": round(ordered[-1] * unit, 1)
+    }
+
+def measure_memory(fleet):
+    """
+    Bytes retenidos por entidad: los mismos anuncios inyectados directamente en una HomeAssistantAPI nueva.
+    """
+    api = HomeAssistantAPI(FakeMQTTClient())
+    messages = [message for device in fleet.devices for message in device.discovery_messages()]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for topic, payload in messages:
+        api.process_mqtt_message(topic, payload)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {"entities": len(api.ha_entity_info), "bytes_per_entity": round(retained / max(1, len(api.ha_entity_info)))}
+
+def run_storm(host, port, expected, subscribers, timeout_s):
+    """
+    Réplicas nuevas que se conectan a la vez: el broker les reenvía todos los anuncios retenidos.
+    """
+    apps = [AppSide(host, port, name=f"storm-{i}") for i in range(subscribers)]
+    for app in apps:
+        app.phase = "storm"
+    started = time.perf_counter()
+    for app in apps:
+        app.start()
+    discovered = [app.wait_for_entities(expected, timeout_s) for app in apps]
+    elapsed = time.perf_counter() - started
+    callbacks = [duration for app in apps for duration in app.callback_seconds.get("storm", [])]
+    for app in apps:
+        app.stop()
+    return {
+        "subscribers": subscribers,
+        "entities_per_subscriber": min(discovered),
+        "seconds": round(elapsed, 3),
+        "entities_per_s": round(sum(discovered) / elapsed),
+        "callback": latency_summary(callbacks)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Flota Tasmota simulada: descubrimiento, telemetría, comandos y tormentas de retenidos.")
+    parser.add_argument('--broker', default=None, help="host:puerto de un broker real (por defecto, broker en proceso).")
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--relays', type=int, default=1, help="Relés por dispositivo (una entidad por relé).")
+    parser.add_argument('--ha-ratio', type=float, default=0.3, help="Fracción de dispositivos con HA Discovery (el resto, nativo).")
+    parser.add_argument('--connections', type=int, default=4, help="Conexiones MQTT de la flota.")
+    parser.add_argument('--tele-interval', type=float, default=10.0, help="Segundos entre tele/STATE de cada dispositivo.")
+    parser.add_argument('--duration', type=float, default=20.0, help="Duración de la fase estable (s).")
+    parser.add_argument('--command-rate', type=float, default=20.0, help="Comandos por segundo durante la fase estable.")
+    parser.add_argument('--storms', type=int, default=2, help="Tormentas de reenvío de retenidos.")
+    parser.add_argument('--storm-subscribers', type=int, default=2, help="Réplicas que se conectan a la vez en cada tormenta.")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        port = int(port)
+    else:
+        broker = FakeMQTTBroker().start()
+        host, port = broker.host, broker.port
+
+    fleet = TasmotaFleet(host, port, args.devices, args.relays, args.ha_ratio, args.connections)
+    expected = sum(len(device.entity_ids()) for device in fleet.devices)
+    report = {"broker": args.broker or "en proceso", "devices": args.devices, "entities_expected": expected}
+    ok = True
+    app = AppSide(host, port).start()
+    try:
+        fleet.connect()
+        # Descubrimiento en directo: la aplicación ya está suscrita cuando la flota se anuncia
+        started = time.perf_counter()
+        fleet.announce()
+        discovered = app.wait_for_entities(expected, args.timeout)
+        elapsed = time.perf_counter() - started
+        report["discovery"] = {"entities": discovered, "seconds": round(elapsed, 3), "entities_per_s": round(discovered / elapsed),
+                               "callback": latency_summary(app.callback_seconds.get("discovery", []))}
+        ok = ok and discovered == expected
+
+        # Fase estable: telemetría y comandos a entidades al azar
+        app.phase = "steady"
+        entity_ids = sorted(app.api.ha_entity_info)
+        rng = random.Random(11)
+        received_before = broker.delivered if broker else None
+        fleet.start_telemetry(args.tele_interval)
+        started = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - started < args.duration:
+            if args.command_rate and sent < (time.perf_counter() - started) * args.command_rate:
+                app.send_command(rng.choice(entity_ids), rng.choice(("ON", "OFF")))
+                sent += 1
+            time.sleep(0.001)
+        fleet.stop_telemetry()
+        deadline = time.perf_counter() + 5
+        while app.unanswered() and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        steady_callbacks = app.callback_seconds.get("steady", [])
+        report["steady"] = {
+            "seconds": args.duration,
+            "messages_to_app": len(steady_callbacks),
+            "messages_per_s": round(len(steady_callbacks) / args.duration),
+            "broker_deliveries": broker.delivered - received_before if broker else None,
+            "callback": latency_summary(steady_callbacks),
+            "telemetry_series": app.api.telemetry_store.stats()["series"]
+        }
+        report["commands"] = {"sent": sent, "echoed": len(app.round_trips), "unanswered": app.unanswered(),
+                              "round_trip": latency_summary(app.round_trips, unit=1e3, suffix="ms")}
+        ok = ok and sent > 0 and app.unanswered() == 0 if args.command_rate else ok
+
+        report["storms"] = []
+        for _ in range(args.storms):
+            storm = run_storm(host, port, expected, args.storm_subscribers, args.timeout)
+            report["storms"].append(storm)
+            ok = ok and storm["entities_per_subscriber"] == expected
+
+        report["memory"] = measure_memory(fleet)
+        if args.broker:
+            fleet.clear_retained()
+    finally:
+        app.stop()
+        fleet.disconnect()
+        if broker:
+            broker.stop()
+
+    print(json.dumps(report, indent=4, ensure_ascii=False))
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
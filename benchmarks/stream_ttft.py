@@ -0,0 +1,64 @@
+# stream_ttft.py (ubicado en ~/Smart-Home-AI/benchmarks/stream_ttft.py)
+#
+# Compara el tiempo hasta el primer token (TTFT) del camino en streaming con la latencia
+# del camino sin streaming, usando un sustituto local de Gemini.
+#
+# Uso: python benchmarks/stream_ttft.py --runs 10 --first-token 0.2 --chunk-delay 0.03
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeGeminiServer, FakeHomeAssistantAPI
+from core_logic.neuron_network import RedNeuronal
+
+async def measure(network, runs):
+    full_ms, ttft_ms, stream_total_ms = [], [], []
+    for i in range(runs):
+        started = time.perf_counter()
+        await network.process_command(f"cuéntame algo {i}")
+        full_ms.append((time.perf_counter() - started) * 1000)
+
+        async for event in network.process_command_stream(f"cuéntame algo más {i}"):
+            if event["type"] == "final":
+                ttft_ms.append(event["ttft_ms"])
+                stream_total_ms.append(event["total_ms"])
+    await network.aclose()
+    return {
+        "runs": runs,
+        "non_streaming_p50_ms": round(statistics.median(full_ms), 1),
+        "streaming_ttft_p50_ms": round(statistics.median(ttft_ms), 1),
+        "streaming_total_p50_ms": round(statistics.median(stream_total_ms), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="TTFT en streaming frente a respuesta completa.")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--first-token', type=float, default=0.2)
+    parser.add_argument('--chunk-delay', type=float, default=0.03)
+    args = parser.parse_args()
+
+    fake_gemini = FakeGeminiServer(first_token_s=args.first_token, chunk_delay_s=args.chunk_delay).start()
+    # La longitud de la respuesta completa equivale a la del streaming completo
+    sample = fake_gemini._response_text({"contents": [{"parts": [{"text": "Comando del usuario: x"}]}]})
+    fake_gemini.latency_s = args.first_token + args.chunk_delay * (len(sample) // fake_gemini.chunk_size + 1)
+
+    # RedNeuronal guarda su memoria en ./knowledge: usar un directorio temporal
+    os.chdir(tempfile.mkdtemp(prefix="smart_home_bench_"))
+    os.makedirs("knowledge")
+    network = RedNeuronal("127.0.0.1", "fake-key", FakeHomeAssistantAPI(), gemini_api_base=fake_gemini.base_url)
+    try:
+        print(json.dumps(asyncio.run(measure(network, args.runs)), indent=4))
+    finally:
+        fake_gemini.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# sent: publicados; coalesced: sustituidos por otro posterior de la misma entidad antes de salir;
+# throttled: retrasados por el límite del dispositivo o del broker (se publican después);
+# unchanged: descartados porque el dispositivo ya está en ese estado; dropped: cola de la entidad llena
+COMMANDS_TOTAL = REGISTRY.counter("smart_home_device_commands_total", "Comandos de dispositivo por resultado en el planificador de salida.", ("outcome",))
+
+MAX_PENDING_PER_ENTITY = 32 # Sólo se acumulan los comandos no idempotentes (TOGGLE); los demás se fusionan
+
+class TokenBucket:
+    """
+    Cubo de 'burst' fichas que se rellena a 'rate_per_s'.
+    """
+
+    __slots__ = ("rate_per_s", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate_per_s, burst, now):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        """
+        Segundos hasta tener una ficha (0 = disponible ya). No la consume.
+        """
+        if not self.rate_per_s:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_s)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate_per_s
+
+    def take(self):
+        if self.rate_per_s:
+            self.tokens -= 1.0
+
+class _Command:
+    __slots__ = ("topic", "payload", "state", "coalesce", "throttled")
+
+    def __init__(self, topic, payload, state, coalesce):
+        self.topic = topic
+        self.payload = payload
+        self.state = state
+        self.coalesce = coalesce
+        self.throttled = False
+
+class _Lane:
+    """
+    Cola de salida de una entidad: comandos pendientes, estado conocido y último enviado.
+    """
+
+    __slots__ = ("device", "pending", "known_state", "sent_state", "sent_at", "window_until", "due")
+
+    def __init__(self, device):
+        self.device = device
+        self.pending = deque()
+        self.known_state = None # Último estado confirmado por el dispositivo (stat/...)
+        self.sent_state = None # Estado pedido por el último comando enviado y aún sin confirmar
+        self.sent_at = 0.0
+        self.window_until = 0.0 # Hasta cuándo se retienen (y fusionan) los comandos siguientes
+        self.due = None # Instante programado en el montículo, si hay
+
+class CommandScheduler:
+    """
+    Planificador de salida de comandos por entidad, entre HomeAssistantAPI y el broker.
+
+    El primer comando de una entidad sale en el acto (sin latencia añadida). Los siguientes dentro
+    de 'coalesce_window_s' se retienen y sólo sale el último (gana el último en escribir), al
+    cerrarse la ventana. Cada dispositivo (un ESP con varios relés comparte límite) y el broker
+    tienen un cubo de fichas; sin fichas, el comando espera en su cola y sigue pudiendo fusionarse.
+    Un comando que pide el estado en el que ya está el dispositivo no se envía; mientras un
+    comando enviado no se confirma (hasta 'confirm_timeout_s'), se toma su estado como el actual.
+    Los comandos no idempotentes (TOGGLE) nunca se fusionan ni se descartan, sólo se espacian.
+    """
+
+    def __init__(self, publish, coalesce_window_s=0.2, device_rate_per_s=4.0, device_burst=4,
+                 broker_rate_per_s=100.0, broker_burst=200, confirm_timeout_s=2.0, clock=time.monotonic):
+        """
+        :param publish: Función (tópico, payload) que publica en el broker.
+        :param device_rate_per_s: Comandos por segundo por dispositivo (0 = sin límite).
+        :param broker_rate_per_s: Comandos por segundo en total (0 = sin límite).
+        """
+        self.publish = publish
+        self.coalesce_window_s = coalesce_window_s
+        self.device_rate_per_s = device_rate_per_s
+        self.device_burst = device_burst
+        self.confirm_timeout_s = confirm_timeout_s
+        self.clock = clock
+        self._lanes = {} # {entity_id: _Lane}
+        self._device_buckets = {} # {dispositivo: TokenBucket}
+        self._broker_bucket = TokenBucket(broker_rate_per_s, broker_burst, clock())
+        self._heap = [] # [(instante, entity_id)] con entradas obsoletas (ver _Lane.due)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+        self._closed = False
+        self.counts = {"sent": 0, "coalesced": 0, "throttled": 0, "unchanged": 0, "dropped": 0}
+        REGISTRY.gauge("smart_home_command_queue_depth", "Comandos retenidos en el planificador de salida.", self.pending_count)
+
+    def _count(self, outcome, amount=1):
+        self.counts[outcome] += amount
+        COMMANDS_TOTAL.inc(amount, outcome=outcome)
+
+    def _lane(self, entity_id, device):
+        lane = self._lanes.get(entity_id)
+        if lane is None:
+            lane = self._lanes[entity_id] = _Lane(device)
+        lane.device = device
+        return lane
+
+    def _effective_state(self, lane, now):
+        if lane.sent_state is not None and now - lane.sent_at < self.confirm_timeout_s:
+            return lane.sent_state
+        return lane.known_state
+
+    def observe_state(self, entity_id, state):
+        """
+        Estado confirmado por el dispositivo ('ON'/'OFF'), desde su state_topic.
+        """
+        with self._lock:
+            lane = self._lanes.get(entity_id)
+            if lane is None:
+                lane = self._lanes[entity_id] = _Lane(entity_id)
+            lane.known_state = state
+            if lane.sent_state == state:
+                lane.sent_state = None # Confirmado
+
+    def submit(self, entity_id, device, topic, payload, state=None, coalesce=True):
+        """
+        Encola un comando para una entidad.
+        :param device: Clave del dispositivo físico (límite de frecuencia compartido entre sus entidades).
+        :param state: Estado que deja el comando ('ON'/'OFF'), o None si no se conoce (no se descarta).
+        :param coalesce: False para comandos no idempotentes (TOGGLE): ni se fusionan ni se descartan.
+        :return: 'sent', 'scheduled', 'coalesced' o 'unchanged'.
+        """
+        command = _Command(topic, payload, state, coalesce)
+        with self._lock:
+            now = self.clock()
+            lane = self._lane(entity_id, device)
+            outcome = None
+            if coalesce and lane.pending and lane.pending[-1].coalesce:
+                lane.pending.pop() # Gana el último en escribir
+                self._count("coalesced")
+                outcome = "coalesced"
+            if coalesce and state is not None and not lane.pending and state == self._effective_state(lane, now):
+                self._count("unchanged")
+                return "unchanged"
+            wait = self._take_tokens(lane, now) if not lane.pending and now >= lane.window_until else None
+            send = wait == 0.0
+            if send:
+                self._mark_sent(lane, command, now)
+            else:
+                if wait:
+                    command.throttled = True
+                    self._count("throttled")
+                if len(lane.pending) >= MAX_PENDING_PER_ENTITY:
+                    lane.pending.popleft()
+                    self._count("dropped")
+                lane.pending.append(command)
+                self._schedule(entity_id, lane, now, at=now + (wait or 0.0))
+        if send:
+            self._publish(command)
+            return "sent"
+        return outcome or "scheduled"
+
+    def _take_tokens(self, lane, now):
+        """
+        Consume una ficha del dispositivo y otra del broker si hay ambas; si no, devuelve la espera.
+        """
+        bucket = self._device_buckets.get(lane.device)
+        if bucket is None:
+            bucket = self._device_buckets[lane.device] = TokenBucket(self.device_rate_per_s, self.device_burst, now)
+        wait = max(bucket.wait_time(now), self._broker_bucket.wait_time(now))
+        if wait == 0.0:
+            bucket.take()
+            self._broker_bucket.take()
+        return wait
+
+    def _mark_sent(self, lane, command, now):
+        lane.window_until = now + self.coalesce_window_s
+        if command.coalesce:
+            lane.sent_state, lane.sent_at = command.state, now
+        else:
+            lane.sent_state = None # Tras un TOGGLE el estado resultante se desconoce hasta el eco
+            lane.known_state = None
+        self._count("sent")
+
+    def _schedule(self, entity_id, lane, now, at=None):
+        due = max(at or now, lane.window_until)
+        if lane.due is not None and lane.due <= due:
+            return
+        lane.due = due
+        heapq.heappush(self._heap, (due, entity_id))
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="command-scheduler", daemon=True)
+            self._worker.start()
+        self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            to_send = []
+            with self._lock:
+                while not self._closed and (not self._heap or self._heap[0][0] > self.clock()):
+                    self._wakeup.wait(self._heap[0][0] - self.clock() if self._heap else None)
+                if self._closed:
+                    return
+                now = self.clock()
+                while self._heap and self._heap[0][0] <= now:
+                    due, entity_id = heapq.heappop(self._heap)
+                    lane = self._lanes.get(entity_id)
+                    if lane is None or lane.due != due:
+                        continue # Obsoleta
+                    lane.due = None
+                    command, wait = self._next_command(lane, now)
+                    if command is not None:
+                        to_send.append(command)
+                    if lane.pending:
+                        self._schedule(entity_id, lane, now, at=now + wait)
+            for command in to_send:
+                self._publish(command)
+
+    def _next_command(self, lane, now):
+        """
+        Saca el siguiente comando de la cola de la entidad si puede salir ya (con el cerrojo tomado).
+        :return: (comando o None, segundos hasta poder reintentar si no hay fichas).
+        """
+        while lane.pending:
+            command = lane.pending[0]
+            if command.coalesce and command.state is not None and command.state == self._effective_state(lane, now):
+                lane.pending.popleft()
+                self._count("unchanged")
+                continue
+            wait = self._take_tokens(lane, now)
+            if wait:
+                if not command.throttled:
+                    command.throttled = True
+                    self._count("throttled")
+                return None, wait
+            lane.pending.popleft()
+            self._mark_sent(lane, command, now)
+            return command, 0.0
+        return None, 0.0
+
+    def _publish(self, command):
+        try:
+            self.publish(command.topic, command.payload)
+        except Exception as e:
+            logging.error(f"Error al publicar el comando en '{command.topic}': {e}")
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(lane.pending) for lane in self._lanes.values())
+
+    def stats(self):
+        return {**self.counts, "pending": self.pending_count(), "entities": len(self._lanes)}
+
+    def close(self):
+        """
+        Detiene el hilo de envío; los comandos aún retenidos se descartan.
+        """
+        with self._lock:
+            self._closed = True
+            pending = sum(len(lane.pending) for lane in self._lanes.values())
+            self._wakeup.notify()
+        if pending:
+            logging.warning(f"Planificador de comandos cerrado con {pending} comandos sin enviar.")
+            self._count("dropped", pending)
@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import logging
+
+import numpy as np
+
+from core_logic.keyword_matcher import KeywordAutomaton, normalize_phrase
+from core_logic.metrics import timed
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class DeviceRetriever:
+    """
+    Selecciona las entidades relevantes para un comando, para no enviar a Gemini la lista completa.
+
+    Los nombres y alias de cada entidad se convierten en embedding una sola vez, cuando se descubre
+    (o cambia su nombre), en segundo plano y por lotes. Por comando se incluyen:
+      - las entidades cuyo nombre o alias aparece literalmente en el comando (o con erratas), y
+      - las top_k entidades más similares al embedding del comando.
+    Con top_k = 0, o con menos entidades que top_k, se incluyen todas.
+    """
+
+    def __init__(self, home_assistant_api, embed_batch, top_k=25, batch_size=64):
+        """
+        :param embed_batch: Corrutina que recibe una lista de textos y devuelve sus embeddings.
+        """
+        self.home_assistant_api = home_assistant_api
+        self.embed_batch = embed_batch
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.fuzzy_min_score = 0.75 # Puntuación mínima de find_entities para incluir una entidad sin embedding
+
+        self._embedded_text = {} # {entity_id: texto con el que se calculó su embedding}
+        self._entity_ids = [] # Orden de las filas de _matrix
+        self._matrix = None # Embeddings normalizados de las entidades (una fila por entidad)
+        self._synced_version = -1
+        self._sync_task = None
+        self._name_matcher = KeywordAutomaton({})
+        self._matcher_version = -1
+
+    def _entity_text(self, entity_id, info):
+        return " / ".join(self.home_assistant_api.entity_aliases(entity_id, info))
+
+    def needs_pruning(self):
+        return self.top_k > 0 and len(self.home_assistant_api.ha_entity_info) > self.top_k
+
+    def schedule_sync(self):
+        """
+        Lanza en segundo plano el cálculo de embeddings si hubo descubrimientos desde la última sincronización.
+        """
+        if self._synced_version == self.home_assistant_api.entity_version:
+            return
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.ensure_future(self.sync())
+
+    async def sync(self):
+        """
+        Calcula los embeddings de las entidades nuevas o renombradas y descarta los de las que ya no existen.
+        """
+        version = self.home_assistant_api.entity_version
+        entities = dict(self.home_assistant_api.ha_entity_info)
+        pending = []
+        for entity_id, info in entities.items():
+            text = self._entity_text(entity_id, info)
+            if self._embedded_text.get(entity_id) != text:
+                pending.append((entity_id, text))
+
+        vectors = {entity_id: self._matrix[row] for row, entity_id in enumerate(self._entity_ids) if entity_id in entities}
+        try:
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                embeddings = await self.embed_batch([text for _, text in chunk])
+                for (entity_id, text), embedding in zip(chunk, embeddings):
+                    vector = np.asarray(embedding, dtype=np.float32)
+                    norm = np.linalg.norm(vector)
+                    vectors[entity_id] = vector / norm if norm else vector
+                    self._embedded_text[entity_id] = text
+        except Exception as e:
+            logging.warning(f"No se pudieron calcular los embeddings de las entidades: {e}")
+            version = -1 # Se reintentará en la próxima sincronización
+        finally:
+            self._entity_ids = list(vectors)
+            self._matrix = np.vstack([vectors[entity_id] for entity_id in self._entity_ids]) if vectors else None
+        self._synced_version = version
+        if pending:
+            logging.info(f"Embeddings de entidades actualizados: {len(pending)} nuevas o renombradas, {len(self._entity_ids)} en total.")
+
+    def exact_hits(self, command):
+        """
+        Entidades cuyo nombre o alias aparece literalmente (normalizado) en el comando.
+        """
+        if self._matcher_version != self.home_assistant_api.entity_version:
+            phrases = {}
+            for entity_id, info in dict(self.home_assistant_api.ha_entity_info).items():
+                for alias in self.home_assistant_api.entity_aliases(entity_id, info):
+                    phrases.setdefault(alias, []).append(entity_id)
+            self._name_matcher = KeywordAutomaton(phrases)
+            self._matcher_version = self.home_assistant_api.entity_version
+        hits = []
+        # Primero los nombres más largos (más específicos): 'luz lectura' antes que 'luz'
+        for _, entity_ids in sorted(self._name_matcher.find_all(command), key=lambda match: -len(match[0])):
+            hits.extend(entity_id for entity_id in entity_ids if entity_id not in hits)
+        return hits
+
+    def _rank_by_tokens(self, command, exclude, limit):
+        """
+        Respaldo sin embeddings: entidades que comparten más palabras con el comando.
+        """
+        command_tokens = set(normalize_phrase(command).split())
+        scored = []
+        for entity_id, info in dict(self.home_assistant_api.ha_entity_info).items():
+            if entity_id in exclude:
+                continue
+            overlap = len(command_tokens & set(normalize_phrase(self._entity_text(entity_id, info)).split()))
+            if overlap:
+                scored.append((overlap, entity_id))
+        return [entity_id for _, entity_id in heapq.nlargest(limit, scored)]
+
+    async def select(self, command, get_embedding):
+        """
+        Devuelve el subconjunto {entity_id: info} de entidades relevantes para el comando.
+        :param get_embedding: Corrutina texto -> embedding (sólo se llama si hay que podar).
+        """
+        entities = self.home_assistant_api.ha_entity_info
+        self.schedule_sync()
+        if not self.needs_pruning():
+            return dict(entities)
+
+        with timed("device_retrieval"):
+            selected = self.exact_hits(command)[:self.top_k] # Un nombre genérico ('Luz') no debe arrastrar cientos de entidades
+            # Nombres con erratas ('luz bibloteca') mediante el índice aproximado de HomeAssistantAPI
+            for entity_id, score in self.home_assistant_api.find_entities(command, limit=3, partial=True):
+                if score >= self.fuzzy_min_score and entity_id not in selected:
+                    selected.append(entity_id)
+            limit = len(selected) + self.top_k
+            query_embedding = None
+            if self._matrix is not None:
+                try:
+                    query_embedding = await get_embedding(command)
+                except Exception as e:
+                    logging.warning(f"Selección de entidades sin embedding del comando: {e}")
+
+            if query_embedding is not None:
+                query = np.asarray(query_embedding, dtype=np.float32)
+                norm = np.linalg.norm(query)
+                scores = self._matrix @ (query / norm if norm else query)
+                count = min(limit, len(scores))
+                best_rows = np.argpartition(-scores, count - 1)[:count]
+                for row in best_rows[np.argsort(-scores[best_rows])]:
+                    if len(selected) >= limit:
+                        break
+                    entity_id = self._entity_ids[row]
+                    if entity_id not in selected:
+                        selected.append(entity_id)
+            else:
+                selected.extend(self._rank_by_tokens(command, set(selected), self.top_k))
+
+        return {entity_id: entities[entity_id] for entity_id in selected if entity_id in entities}
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LOCAL_ENCODE_SECONDS = REGISTRY.histogram("smart_home_local_encode_seconds", "Duración de model.encode en el motor de embeddings en proceso.")
+
+def _load_sentence_transformer(model_name):
+    from sentence_transformers import SentenceTransformer # Dependencia pesada: sólo se importa en modo 'embedded'
+    return SentenceTransformer(model_name)
+
+class LocalEmbeddingEngine:
+    """
+    Motor de embeddings en proceso, para instalaciones en un solo equipo sin ML Server.
+
+    El modelo se carga la primera vez que se usa y cada 'encode' se ejecuta en un pool de hilos
+    propio, de modo que el bucle de eventos de la aplicación nunca se bloquea. Las llamadas
+    a model.encode son las mismas que hace el ML Server, así que los vectores son idénticos.
+    """
+
+    def __init__(self, model_name, max_workers=1, batch_size=64, load_retry_s=60.0, model_loader=_load_sentence_transformer):
+        """
+        :param max_workers: Hilos de codificación (el modelo ya paraleliza cada 'encode' internamente).
+        :param load_retry_s: Tras un fallo de carga, segundos antes de volver a intentarlo.
+        :param model_loader: Función nombre_del_modelo -> modelo con el método 'encode'.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.load_retry_s = load_retry_s
+        self.model_loader = model_loader
+        self._model = None
+        self._load_error = None
+        self._load_failed_at = 0.0
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding-engine")
+        REGISTRY.gauge("smart_home_embedding_model_loaded", "1 si el modelo de embeddings en proceso está cargado.",
+                       lambda: 1 if self._model is not None else 0)
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def _get_model(self):
+        if self._model is not None:
+            return self._model
+        with self._load_lock:
+            if self._model is None:
+                if self._load_error is not None and time.monotonic() - self._load_failed_at < self.load_retry_s:
+                    raise RuntimeError(f"Modelo de embeddings no disponible: {self._load_error}")
+                logging.info(f"Cargando modelo de embeddings en proceso: {self.model_name}...")
+                started = time.perf_counter()
+                try:
+                    self._model = self.model_loader(self.model_name)
+                except Exception as e:
+                    self._load_error, self._load_failed_at = e, time.monotonic()
+                    logging.error(f"Error al cargar el modelo de embeddings '{self.model_name}': {e}")
+                    raise RuntimeError(f"Modelo de embeddings no disponible: {e}") from e
+                self._load_error = None
+                logging.info(f"Modelo de embeddings cargado en {time.perf_counter() - started:.1f} s.")
+        return self._model
+
+    def _encode(self, text):
+        model = self._get_model()
+        with LOCAL_ENCODE_SECONDS.time():
+            return model.encode(text).tolist()
+
+    def _encode_batch(self, texts):
+        model = self._get_model()
+        with LOCAL_ENCODE_SECONDS.time():
+            return model.encode(texts, batch_size=self.batch_size).tolist()
+
+    async def embed(self, text):
+        """
+        Embedding de un texto (igual que /get_embedding del ML Server).
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, text)
+
+    async def embed_batch(self, texts):
+        """
+        Embeddings de varios textos en un único 'encode' (igual que /get_embeddings del ML Server).
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._encode_batch, texts)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,175 @@
+import heapq
+import math
+import threading
+
+from core_logic.keyword_matcher import normalize_phrase
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class EntityIndex:
+    """
+    Índice de búsqueda aproximada de entidades por nombre.
+
+    Cada entidad tiene varios alias (nombre amigable, identificador, dispositivo, área...) y
+    cada alias es un conjunto de palabras normalizadas. La búsqueda:
+      - busca cada palabra de la consulta en el vocabulario; si no existe, la corrige con un
+        índice de trigramas del vocabulario (tolerancia a erratas: 'bibloteca' -> 'biblioteca');
+      - puntúa cada alias con la similitud de Jaccard ponderada por IDF entre sus palabras y las
+        de la consulta, y cada entidad por su mejor alias. Una palabra de la consulta sin ninguna
+        coincidencia en el vocabulario cuenta en la unión con el IDF máximo (el de una palabra
+        única): 'luz jardin salon' no puede puntuar 1.0 sobre 'luz salon' por ignorar 'jardin'.
+        Con partial=True (la consulta es una frase que contiene el nombre, 'enciende la luz del
+        salón') esas palabras no cuentan.
+    Las palabras frecuentes ('luz') sólo suman a candidatos ya encontrados por palabras más raras,
+    así que el coste no crece con el número de entidades que comparten una palabra común.
+    """
+
+    def __init__(self, min_similarity=0.5, common_fraction=0.05):
+        self.min_similarity = min_similarity # Similitud de Dice mínima para corregir una palabra
+        self.common_fraction = common_fraction # Palabras presentes en más de esta fracción de entidades son "comunes"
+        self._aliases = {} # {entity_id: [frozenset(palabras)]}
+        self._domains = {} # {entity_id: dominio}
+        self._postings = {} # {palabra: {(entity_id, índice_de_alias)}}
+        self._token_entities = {} # {palabra: {entity_id: número de alias que la contienen}}
+        self._trigrams = {} # {trigrama: {palabra}}
+        self._alias_weights = {} # Caché {(entity_id, índice_de_alias): suma de IDF}; se vacía al cambiar el índice
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._aliases)
+
+    def add(self, entity_id, aliases, domain=None):
+        alias_tokens = []
+        for alias in aliases:
+            tokens = frozenset(normalize_phrase(alias).split())
+            if tokens and tokens not in alias_tokens:
+                alias_tokens.append(tokens)
+        with self._lock:
+            self._remove_locked(entity_id)
+            self._alias_weights = {}
+            self._aliases[entity_id] = alias_tokens
+            self._domains[entity_id] = domain or entity_id.split('.', 1)[0]
+            for alias_index, tokens in enumerate(alias_tokens):
+                for token in tokens:
+                    if token not in self._postings:
+                        self._postings[token] = set()
+                        self._token_entities[token] = {}
+                        for trigram in trigrams(token):
+                            self._trigrams.setdefault(trigram, set()).add(token)
+                    self._postings[token].add((entity_id, alias_index))
+                    entities = self._token_entities[token]
+                    entities[entity_id] = entities.get(entity_id, 0) + 1
+
+    def remove(self, entity_id):
+        with self._lock:
+            self._remove_locked(entity_id)
+            self._alias_weights = {}
+
+    def _remove_locked(self, entity_id):
+        alias_tokens = self._aliases.pop(entity_id, None)
+        self._domains.pop(entity_id, None)
+        if alias_tokens is None:
+            return
+        for alias_index, tokens in enumerate(alias_tokens):
+            for token in tokens:
+                self._postings[token].discard((entity_id, alias_index))
+                entities = self._token_entities[token]
+                entities[entity_id] -= 1
+                if not entities[entity_id]:
+                    del entities[entity_id]
+                if not self._postings[token]:
+                    del self._postings[token]
+                    del self._token_entities[token]
+                    for trigram in trigrams(token):
+                        vocabulary = self._trigrams.get(trigram)
+                        if vocabulary is not None:
+                            vocabulary.discard(token)
+                            if not vocabulary:
+                                del self._trigrams[trigram]
+
+    def _idf(self, token):
+        return math.log(1 + len(self._aliases) / len(self._token_entities[token]))
+
+    def _alias_weight(self, key):
+        weight = self._alias_weights.get(key)
+        if weight is None:
+            entity_id, alias_index = key
+            weight = self._alias_weights[key] = sum(self._idf(token) for token in self._aliases[entity_id][alias_index])
+        return weight
+
+    def _vocabulary_matches(self, query_token):
+        """
+        {palabra_del_vocabulario: similitud} para una palabra de la consulta (exacta o corregida).
+        """
+        if query_token in self._postings:
+            return {query_token: 1.0}
+        if len(query_token) < 3:
+            return {}
+        query_trigrams = trigrams(query_token)
+        shared = {}
+        for trigram in query_trigrams:
+            for token in self._trigrams.get(trigram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        matches = {}
+        for token, count in shared.items():
+            similarity = 2 * count / (len(query_trigrams) + len(trigrams(token)))
+            if similarity >= self.min_similarity:
+                matches[token] = similarity
+        return matches
+
+    def search(self, query, limit=5, domain=None, partial=False):
+        """
+        Devuelve hasta 'limit' tuplas (entity_id, puntuación), con puntuación entre 0.0 y 1.0.
+        :param domain: Si se indica, sólo se devuelven entidades de ese dominio.
+        :param partial: True si la consulta es una frase con más palabras que el nombre buscado.
+        """
+        with self._lock:
+            if not self._aliases:
+                return []
+            common_threshold = max(50, len(self._aliases) * self.common_fraction)
+            # Por palabra de la consulta: {palabra_del_vocabulario: similitud * idf}
+            query_matches = []
+            unmatched = 0
+            for query_token in dict.fromkeys(normalize_phrase(query).split()):
+                matches = {token: similarity * self._idf(token) for token, similarity in self._vocabulary_matches(query_token).items()}
+                if matches:
+                    query_matches.append(matches)
+                elif not partial:
+                    unmatched += 1
+            if not query_matches:
+                return []
+
+            def document_frequency(matches):
+                return sum(len(self._token_entities[token]) for token in matches)
+            query_matches.sort(key=document_frequency)
+
+            scores = {} # {(entity_id, índice_de_alias): peso cubierto}
+            for matches in query_matches:
+                contribution = {}
+                if scores and document_frequency(matches) > common_threshold:
+                    # Palabra común: sólo se suma a los candidatos ya encontrados
+                    for key in scores:
+                        for token, weight in matches.items():
+                            if key in self._postings[token] and weight > contribution.get(key, 0.0):
+                                contribution[key] = weight
+                else:
+                    for token, weight in matches.items():
+                        for key in self._postings[token]:
+                            if weight > contribution.get(key, 0.0):
+                                contribution[key] = weight
+                for key, weight in contribution.items():
+                    scores[key] = scores.get(key, 0.0) + weight
+
+            query_weight = sum(max(matches.values()) for matches in query_matches) + unmatched * math.log(1 + len(self._aliases))
+            best = {}
+            for key, covered in scores.items():
+                entity_id = key[0]
+                if domain is not None and self._domains.get(entity_id) != domain:
+                    continue
+                union = self._alias_weight(key) + query_weight - covered
+                score = min(1.0, covered / union) if union > 0 else 0.0
+                if score > best.get(entity_id, 0.0):
+                    best[entity_id] = score
+        return heapq.nlargest(limit, best.items(), key=lambda item: item[1])
@@ -0,0 +1,162 @@
+import heapq
+import logging
+import math
+import threading
+import time
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MEMORY_HITS_TOTAL = REGISTRY.counter("smart_home_memory_hits_total", "Respuestas servidas desde una memoria aprendida.", ("store",))
+MEMORY_EVICTIONS_TOTAL = REGISTRY.counter("smart_home_memory_evictions_total", "Entradas expulsadas por capacidad.", ("store",))
+
+DEFAULT_HALF_LIFE_S = 14 * 86400 # Un acierto pierde la mitad de su peso cada dos semanas
+
+def _log2_add(a, b):
+    """
+    log2(2^a + 2^b) sin desbordamiento.
+    """
+    high, low = (a, b) if a >= b else (b, a)
+    return high + math.log2(1.0 + 2.0 ** (low - high))
+
+class FrequencyEviction:
+    """
+    Política de expulsión LFU con envejecimiento para una memoria de capacidad limitada.
+
+    Cada entrada acumula un peso que suma 1 por acierto (la inserción cuenta como el primero) y
+    se reduce a la mitad cada 'half_life_s' segundos: una entrada muy usada hace meses acaba
+    valiendo menos que una usada ayer. El peso se guarda en escala logarítmica referida al
+    instante 0 (log2(peso) + t / half_life_s); así el orden no cambia con el paso del tiempo y
+    un montículo con borrado perezoso da la entrada de menor peso en O(log n).
+    Las entradas fijadas nunca se expulsan (pero cuentan para la capacidad).
+    """
+
+    def __init__(self, name, capacity=None, half_life_s=DEFAULT_HALF_LIFE_S, clock=time.time):
+        """
+        :param capacity: Número máximo de entradas; None o 0 = sin límite.
+        :param clock: Reloj de pared (los pesos se persisten y deben sobrevivir a un reinicio).
+        """
+        self.name = name
+        self.capacity = capacity or None
+        self.half_life_s = half_life_s
+        self.clock = clock
+        self._entries = {} # {clave: [prioridad, aciertos, último_acierto, fijada]}
+        self._heap = [] # [(prioridad, clave)] con entradas obsoletas que se descartan al extraer
+        self.hits = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _now_priority(self):
+        return self.clock() / self.half_life_s
+
+    def add(self, key, pinned=False, hits=0, last_hit=None, priority=None, added_at=None):
+        """
+        Registra una entrada nueva (o restaura una persistida con sus estadísticas). No expulsa: ver evict().
+        :param added_at: Instante de creación (por defecto, ahora); sólo se usa si no hay 'priority'.
+        """
+        with self._lock:
+            if priority is None:
+                priority = (added_at if added_at is not None else self.clock()) / self.half_life_s
+            self._entries[key] = [priority, hits, last_hit, pinned]
+            if not pinned:
+                heapq.heappush(self._heap, (priority, key))
+
+    def hit(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[0] = _log2_add(entry[0], self._now_priority())
+            entry[1] += 1
+            entry[2] = self.clock()
+            if not entry[3]:
+                heapq.heappush(self._heap, (entry[0], key))
+            self.hits += 1
+            self._compact_heap_locked()
+        MEMORY_HITS_TOTAL.inc(store=self.name)
+
+    def remove(self, key):
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+            self._compact_heap_locked()
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._heap.clear()
+
+    def set_pinned(self, key, pinned=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry[3] = pinned
+            if not pinned:
+                heapq.heappush(self._heap, (entry[0], key))
+            return True
+
+    def evict(self):
+        """
+        Expulsa las entradas de menor peso hasta volver a la capacidad.
+        :return: Lista de claves expulsadas (el llamador las borra de sus estructuras).
+        """
+        evicted = []
+        with self._lock:
+            while self.capacity is not None and len(self._entries) > self.capacity and self._heap:
+                priority, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is None or entry[3] or entry[0] != priority:
+                    continue # Obsoleta: borrada, fijada o con un acierto posterior
+                del self._entries[key]
+                evicted.append(key)
+            if self.capacity is not None and len(self._entries) > self.capacity:
+                logging.warning(f"Memoria '{self.name}': {len(self._entries)} entradas fijadas superan la capacidad ({self.capacity}).")
+        if evicted:
+            self.evictions += len(evicted)
+            MEMORY_EVICTIONS_TOTAL.inc(len(evicted), store=self.name)
+        return evicted
+
+    def _compact_heap_locked(self):
+        # Cada acierto deja una copia obsoleta en el montículo; se reconstruye si dominan
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry[0], key) for key, entry in self._entries.items() if not entry[3]]
+            heapq.heapify(self._heap)
+
+    def export(self, key):
+        """
+        Estadísticas persistibles de una entrada (se restauran con add(key, **export)).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return {"priority": entry[0], "hits": entry[1], "last_hit": entry[2], "pinned": entry[3]}
+
+    def _score(self, priority, now_priority):
+        return 2.0 ** (priority - now_priority) # Peso actual (aciertos envejecidos)
+
+    def stats(self, top=10):
+        """
+        Resumen de uso: entradas, fijadas, aciertos, expulsiones, las más útiles y las nunca usadas.
+        """
+        with self._lock:
+            now_priority = self._now_priority()
+            ranked = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "pinned": sum(1 for entry in self._entries.values() if entry[3]),
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "never_hit": sum(1 for entry in self._entries.values() if not entry[1]),
+                "top": [{"key": key, "hits": entry[1], "score": round(self._score(entry[0], now_priority), 3),
+                         "last_hit": entry[2], "pinned": entry[3]} for key, entry in ranked[:top]]
+            }
@@ -1,17 +1,42 @@
 import json
 import logging
+from core_logic.entity_index import EntityIndex
+from core_logic.metrics import REGISTRY, timed
+
+# Servicios que fijan un estado: repetirlos equivale a ejecutarlos una vez, así que el planificador
+# de comandos puede quedarse sólo con el último. 'toggle' o 'script.turn_on' no lo cumplen.
+STATE_SETTING_SERVICES = {"turn_on", "turn_off", "lock", "unlock", "open_cover", "close_cover", "set_cover_position",
+                          "set_temperature", "set_hvac_mode", "set_percentage", "set_value", "select_option"}
+ACTION_DOMAINS = {"script", "scene", "automation", "button"}
+
+DISCOVERED_ENTITIES_TOTAL = REGISTRY.counter("smart_home_discovered_entities_total", "Mensajes de descubrimiento procesados por origen.", ("source",))
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class HomeAssistantAPI:
-    def __init__(self, mqtt_client):
+    def __init__(self, mqtt_client, state_backend=None, telemetry_store=None, command_scheduler=None):
         self.mqtt_client = mqtt_client
+        # Fusión y límite de frecuencia de los comandos salientes (CommandScheduler); None = publicar directamente
+        self.command_scheduler = command_scheduler
+        self.telemetry_store = telemetry_store # Series de tele/+/STATE (opcional)
+        self.rules_engine = None # Automatizaciones locales (RulesEngine), se asigna después de crear ambos
+        self.state_topic_entities = {} # {state_topic: {entity_id}} para los disparadores por entidad
+        self.entity_state_topics = {} # {entity_id: state_topic}
+        # Con un backend compartido, la réplica que consume el descubrimiento publica allí el registro
+        # de entidades y las demás lo copian con sync_from_state()
+        self.state_backend = state_backend
+        self.consume_discovery = True
+        self._state_entity_version = None # Versión del registro compartido copiada por última vez
         self.base_topic = "homeassistant"
         self.ha_entity_info = {} # Almacena la información de las entidades descubiertas por HA
         self.tasmota_command_map = {} # Mapeo de nombres amigables a comandos Tasmota
+        self.entity_version = 0 # Se incrementa con cada descubrimiento; permite detectar cambios sin comparar entidades
+        self.entity_index = EntityIndex() # Búsqueda aproximada por nombre, alias y área (tolera erratas)
         logging.info(f"HomeAssistantAPI inicializada con tópico base: {self.base_topic}")
 
     def process_mqtt_message(self, topic, payload):
+        if not self.consume_discovery and topic.endswith("/config"):
+            return # Otra réplica consume el descubrimiento
         # Lógica de descubrimiento de Home Assistant
         if topic.startswith(f"{self.base_topic}/"):
             try:
@@ -29,7 +54,10 @@ class HomeAssistantAPI:
                             "device": data.get("device", {}),
                             "raw_config": data # Guardar la configuración completa
                         }
-                        logging.info(f"Dispositivo Home Assistant descubierto y almacenado: {entity_id} (Nombre: {self.ha_entity_info[entity_id]['name']})")
+                        self._index_entity(entity_id)
+                        self._publish_entity(entity_id)
+                        DISCOVERED_ENTITIES_TOTAL.inc(source="home_assistant")
+                        logging.debug(f"Dispositivo Home Assistant descubierto y almacenado: {entity_id} (Nombre: {self.ha_entity_info[entity_id]['name']})")
             except json.JSONDecodeError:
                 pass 
             except Exception as e:
@@ -47,9 +75,10 @@ class HomeAssistantAPI:
                 functions = data.get("fn", ["Main"]) 
                 
                 for i, func_name in enumerate(functions):
-                    cmnd_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'cmnd').replace('%topic%', data.get('t', device_name))}"
-                    stat_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'stat').replace('%topic%', data.get('t', device_name))}"
-                    tele_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'tele').replace('%topic%', data.get('t', device_name))}"
+                    # 'ft' termina en '/' ("%prefix%/%topic%/"): sin quitarla, los tópicos quedarían como 'cmnd/x//POWER'
+                    cmnd_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'cmnd').replace('%topic%', data.get('t', device_name))}".rstrip('/')
+                    stat_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'stat').replace('%topic%', data.get('t', device_name))}".rstrip('/')
+                    tele_topic_base = f"{data.get('ft', '%prefix%/%topic%/').replace('%prefix%', 'tele').replace('%topic%', data.get('t', device_name))}".rstrip('/')
 
                     # Tópicos específicos de POWER para Tasmota
                     tasmota_power_command_topic = f"{cmnd_topic_base}/POWER{i+1}" if len(functions) > 1 else f"{cmnd_topic_base}/POWER"
@@ -69,17 +98,32 @@ class HomeAssistantAPI:
                             "raw_config": data 
                         }
                         self.tasmota_command_map[func_name.lower()] = entity_id
-                        logging.info(f"Dispositivo Tasmota nativo descubierto y almacenado: {entity_id} (Nombre: {func_name})")
+                        self._index_entity(entity_id)
+                        self._publish_entity(entity_id, tasmota_name=func_name.lower())
+                        DISCOVERED_ENTITIES_TOTAL.inc(source="tasmota")
+                        logging.debug(f"Dispositivo Tasmota nativo descubierto y almacenado: {entity_id} (Nombre: {func_name})")
             except json.JSONDecodeError:
                 pass 
             except Exception as e:
                 logging.error(f"Error al procesar mensaje MQTT de Tasmota para tópico {topic}: {e}")
         
         elif topic.startswith("tele/") and topic.endswith("/STATE"):
-            pass 
+            if self.telemetry_store is not None:
+                self.telemetry_store.ingest_state(topic.split('/')[1], payload)
         elif topic.startswith("stat/") and topic.endswith("/POWER"):
             pass
 
+        # Estado confirmado por los dispositivos: el planificador no reenvía comandos que no cambian nada
+        if self.command_scheduler is not None and topic in self.state_topic_entities:
+            self._observe_state(topic, payload)
+
+        # Las reglas sólo se ejecutan en la réplica que consume el descubrimiento (una vez por mensaje)
+        if self.rules_engine is not None and self.consume_discovery and not topic.endswith("/config"):
+            try:
+                self.rules_engine.process_message(topic, payload)
+            except Exception as e:
+                logging.error(f"Error al evaluar las reglas para el tópico {topic}: {e}")
+
 
     def _get_entity_id_from_ha_config_topic(self, topic, config_payload):
         parts = topic.split('/')
@@ -121,7 +165,14 @@ class HomeAssistantAPI:
         }
 
         try:
-            self.mqtt_client.publish(service_topic, json.dumps(ha_command_payload))
+            state = {"turn_on": "ON", "turn_off": "OFF"}.get(service) if not json_payload else None
+            coalesce = service in STATE_SETTING_SERVICES and domain not in ACTION_DOMAINS
+            with timed("mqtt_publish"):
+                outcome = self._publish_command(entity_id, service_topic, json.dumps(ha_command_payload), state, coalesce)
+            if outcome == "unchanged":
+                return True, f"'{entity_id}' ya está en ese estado; no hace falta enviar '{service}'."
+            if outcome != "sent":
+                return True, f"Comando '{service}' programado para '{entity_id}' a través de Home Assistant MQTT."
             logging.info(f"Comando HA de servicio enviado: Tópico='{service_topic}', Payload='{json.dumps(ha_command_payload)}'")
             return True, f"Comando '{service}' enviado a '{entity_id}' a través de Home Assistant MQTT."
         except Exception as e:
@@ -147,7 +198,13 @@ class HomeAssistantAPI:
         payload = state.upper() # Tasmota espera "ON" o "OFF"
 
         try:
-            self.mqtt_client.publish(command_topic, payload)
+            with timed("mqtt_publish"):
+                outcome = self._publish_command(entity_id, command_topic, payload, payload if payload in ("ON", "OFF") else None,
+                                                coalesce=payload not in ("TOGGLE", "2"))
+            if outcome == "unchanged":
+                return True, f"'{entity_info['name']}' ya está en {payload}; no hace falta enviar el comando."
+            if outcome != "sent":
+                return True, f"Comando '{state}' programado para '{entity_info['name']}' (Tasmota)."
             logging.info(f"Comando Tasmota directo enviado: Tópico='{command_topic}', Payload='{payload}'")
             return True, f"Comando '{state}' enviado directamente a '{entity_info['name']}' (Tasmota)."
         except Exception as e:
@@ -155,6 +212,154 @@ class HomeAssistantAPI:
             return False, f"Error al enviar comando Tasmota directo: {e}"
 
 
+    def _publish_command(self, entity_id, topic, payload, state, coalesce):
+        """
+        Publica un comando, directamente o a través del planificador de comandos.
+        :return: 'sent', 'scheduled', 'coalesced' o 'unchanged' (ver CommandScheduler.submit).
+        """
+        if self.command_scheduler is None:
+            self.mqtt_client.publish(topic, payload)
+            return "sent"
+        # Las entidades de un mismo dispositivo Tasmota (relés) comparten 'cmnd/<topic>' y su límite de frecuencia
+        command_topic = (self.ha_entity_info.get(entity_id) or {}).get("command_topic")
+        device = command_topic.rsplit('/', 1)[0] if command_topic else entity_id
+        return self.command_scheduler.submit(entity_id, device, topic, payload, state=state, coalesce=coalesce)
+
+    def _observe_state(self, topic, payload):
+        value = payload.strip()
+        for entity_id in self.state_topic_entities.get(topic, ()):
+            info = self.ha_entity_info.get(entity_id) or {}
+            if value == (info.get("payload_on") or "ON"):
+                self.command_scheduler.observe_state(entity_id, "ON")
+            elif value == (info.get("payload_off") or "OFF"):
+                self.command_scheduler.observe_state(entity_id, "OFF")
+
+    @staticmethod
+    def entity_aliases(entity_id, info):
+        """
+        Nombres con los que el usuario puede referirse a una entidad: nombre amigable, identificador
+        legible, nombre del dispositivo, nombre + área sugerida ('Luz' en 'Biblioteca' -> 'Luz Biblioteca')
+        en HA Discovery, o nombre/host en Tasmota.
+        """
+        raw_config = info.get("raw_config") or {}
+        device = info.get("device") or raw_config.get("device") or {}
+        if not isinstance(device, dict):
+            device = {}
+        area = device.get("suggested_area")
+        candidates = [
+            info.get("name"),
+            entity_id.split('.', 1)[-1].replace('_', ' '),
+            device.get("name"),
+            f"{info.get('name')} {area}" if area and info.get("name") else None,
+            raw_config.get("dn"),
+            raw_config.get("hn")
+        ]
+        aliases = []
+        for candidate in candidates:
+            if isinstance(candidate, str) and candidate.strip() and candidate not in aliases:
+                aliases.append(candidate)
+        return aliases
+
+    def _index_entity(self, entity_id):
+        info = self.ha_entity_info[entity_id]
+        self.entity_index.add(entity_id, self.entity_aliases(entity_id, info), info.get("domain"))
+        self._unindex_state_topic(entity_id) # El state_topic puede haber cambiado
+        if info.get("state_topic"):
+            self.state_topic_entities.setdefault(info["state_topic"], set()).add(entity_id)
+            self.entity_state_topics[entity_id] = info["state_topic"]
+        self.entity_version += 1
+
+    def _unindex_state_topic(self, entity_id):
+        topic = self.entity_state_topics.pop(entity_id, None)
+        if topic is not None:
+            self.state_topic_entities[topic].discard(entity_id)
+            if not self.state_topic_entities[topic]:
+                del self.state_topic_entities[topic]
+
+    def entities_for_state_topic(self, topic):
+        return self.state_topic_entities.get(topic, ())
+
+    def _publish_entity(self, entity_id, tasmota_name=None):
+        """
+        Publica una entidad descubierta en el registro compartido (sólo con un backend compartido).
+        """
+        if self.state_backend is None or not self.state_backend.shared:
+            return
+        try:
+            self.state_backend.set("entities", entity_id, self.ha_entity_info[entity_id])
+            if tasmota_name is not None:
+                self.state_backend.set("tasmota_map", tasmota_name, entity_id)
+            self._state_entity_version = self.state_backend.incr("meta", "entity_version")
+        except Exception as e:
+            logging.error(f"Error al publicar la entidad {entity_id} en el estado compartido: {e}")
+
+    def sync_from_state(self):
+        """
+        Copia el registro de entidades compartido si cambió desde la última copia (réplicas que no
+        consumen el descubrimiento). :return: True si hubo cambios.
+        """
+        if self.state_backend is None or not self.state_backend.shared:
+            return False
+        version = self.state_backend.get("meta", "entity_version", 0)
+        if version == self._state_entity_version:
+            return False
+        entities = self.state_backend.items("entities")
+        for entity_id in set(self.ha_entity_info) - set(entities):
+            del self.ha_entity_info[entity_id]
+            self.entity_index.remove(entity_id)
+            self._unindex_state_topic(entity_id)
+        for entity_id, info in entities.items():
+            if self.ha_entity_info.get(entity_id) != info:
+                self.ha_entity_info[entity_id] = info
+                self._index_entity(entity_id)
+        self.tasmota_command_map = self.state_backend.items("tasmota_map")
+        self.entity_version += 1
+        self._state_entity_version = version
+        logging.info(f"Registro de entidades sincronizado desde el estado compartido: {len(entities)} entidades (versión {version}).")
+        return True
+
+    def find_entities(self, query, limit=5, domain=None, partial=False):
+        """
+        Busca entidades por nombre, alias o área, tolerando erratas.
+        :param partial: True para buscar nombres dentro de una frase (las palabras de más no penalizan).
+        :return: Lista de tuplas (entity_id, puntuación de 0.0 a 1.0), de mayor a menor puntuación.
+        """
+        with timed("entity_lookup"):
+            return self.entity_index.search(query, limit=limit, domain=domain, partial=partial)
+
+    def resolve_entity_id(self, entity_id, domain=None, min_score=0.75, min_margin=0.1):
+        """
+        Valida un entity_id (p. ej. generado por el LLM). Si no existe, intenta corregirlo con la
+        búsqueda aproximada sobre su parte legible ('light.luz_bibloteca' -> 'luz bibloteca').
+        :return: El entity_id existente o corregido, o None si no hay una coincidencia clara.
+        """
+        if entity_id in self.ha_entity_info:
+            return entity_id
+        query = entity_id.split('.', 1)[-1].replace('_', ' ')
+        candidates = self.find_entities(query, limit=2, domain=domain)
+        if not candidates or candidates[0][1] < min_score:
+            return None
+        if len(candidates) > 1 and candidates[0][1] - candidates[1][1] < min_margin:
+            return None # Ambiguo: mejor rechazar que actuar sobre el dispositivo equivocado
+        return candidates[0][0]
+
+    @staticmethod
+    def telemetry_device(info):
+        """
+        Dispositivo de telemetría (el '+' de tele/+/STATE) de una entidad Tasmota, o None.
+        """
+        parts = [part for part in (info.get("tele_state_topic") or "").split('/') if part] # 'ft' puede dejar '//'
+        return parts[1] if len(parts) == 3 and parts[0] == "tele" else None
+
+    def telemetry_summary(self, entity_id, info):
+        """
+        Resumen de la telemetría reciente de la entidad para el prompt, o None si no tiene.
+        """
+        device = self.telemetry_device(info)
+        if self.telemetry_store is None or device is None:
+            return None
+        return self.telemetry_store.summary(device)
+
     def get_discovered_entities(self):
         return self.ha_entity_info
 
@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class MemoryJournal:
+    """
+    Diario de solo-anexado (JSONL) con instantáneas compactadas para la memoria conversacional.
+
+    Cada cambio se escribe como una línea pequeña en '<snapshot>.journal.jsonl'. Los fsync
+    se agrupan (cada 'fsync_batch' registros o cada 'fsync_interval' segundos) y, cuando
+    el diario crece más de 'compact_threshold' registros, se escribe en segundo plano una
+    instantánea atómica (archivo temporal + os.replace) y se empieza un diario nuevo.
+    Cada registro lleva un número de secuencia, de modo que la reproducción al cargar
+    ignora lo que ya está incluido en la instantánea aunque se interrumpa una compactación.
+    """
+
+    def __init__(self, snapshot_file, snapshot_provider, fsync_batch=32, fsync_interval=1.0, compact_threshold=1000):
+        self.snapshot_file = snapshot_file
+        self.journal_file = f"{snapshot_file}.journal.jsonl"
+        self.compacting_file = f"{snapshot_file}.journal.compacting.jsonl"
+        self.snapshot_provider = snapshot_provider # Devuelve una copia de la memoria actual
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0 # Último número de secuencia asignado
+        self._records_since_snapshot = 0
+        self._pending_fsync = 0
+        self._fsync_timer = None
+        self._compaction_thread = None
+
+    def load(self):
+        """
+        Carga la instantánea y reproduce los diarios pendientes.
+        Acepta también el formato antiguo (una lista JSON con la memoria completa).
+        :return: La lista de entradas de memoria.
+        """
+        memory = []
+        last_seq = 0
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if isinstance(snapshot, list):
+                memory = snapshot # Formato antiguo, sin número de secuencia
+            else:
+                memory = snapshot.get("memory", [])
+                last_seq = snapshot.get("last_seq", 0)
+
+        self._seq = last_seq
+        replayed = 0
+        for path in (self.compacting_file, self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # La última línea puede quedar truncada tras un corte; se descarta
+                        logging.warning(f"Registro inválido ignorado en el diario '{path}'.")
+                        continue
+                    if record["seq"] <= last_seq:
+                        continue
+                    self._apply(memory, record)
+                    self._seq = max(self._seq, record["seq"])
+                    replayed += 1
+
+        self._records_since_snapshot = replayed
+        logging.info(f"Diario de memoria reproducido: {replayed} registros sobre la instantánea (secuencia {self._seq}).")
+        return memory
+
+    def open(self):
+        """
+        Abre el diario para anexar. Si quedó una compactación interrumpida, se completa ahora.
+        """
+        if os.path.exists(self.compacting_file):
+            self.compact(wait=True)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_file, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _apply(memory, record):
+        op = record.get("op")
+        if op == "append":
+            memory.append(record["entry"])
+        elif op == "clear":
+            memory.clear()
+        elif op == "remove": # Expulsión por capacidad (clave: comando en minúsculas)
+            memory[:] = [entry for entry in memory if entry["command"].lower() != record["command"]]
+        elif op == "pin":
+            for entry in memory:
+                if entry["command"].lower() == record["command"]:
+                    entry["pinned"] = record["pinned"]
+
+    def append(self, op, **data):
+        """
+        Anexa un registro al diario. Coste: una línea pequeña, sin reescribir la memoria.
+        Debe llamarse después de aplicar el cambio en memoria, desde el mismo hilo.
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_file, 'a', encoding='utf-8')
+            self._seq += 1
+            record = {"seq": self._seq, "op": op, **data}
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+            self._file.flush()
+            self._pending_fsync += 1
+            self._records_since_snapshot += 1
+
+            if self._pending_fsync >= self.fsync_batch:
+                self._fsync_locked()
+            elif self._fsync_timer is None:
+                self._fsync_timer = threading.Timer(self.fsync_interval, self._fsync_from_timer)
+                self._fsync_timer.daemon = True
+                self._fsync_timer.start()
+
+            should_compact = self._records_since_snapshot >= self.compact_threshold
+
+        if should_compact:
+            self.compact()
+
+    def _fsync_locked(self):
+        if self._file is not None and self._pending_fsync:
+            os.fsync(self._file.fileno())
+        self._pending_fsync = 0
+        if self._fsync_timer is not None:
+            self._fsync_timer.cancel()
+            self._fsync_timer = None
+
+    def _fsync_from_timer(self):
+        with self._lock:
+            self._fsync_timer = None
+            self._fsync_locked()
+
+    def compact(self, wait=False):
+        """
+        Escribe una instantánea con la memoria actual y empieza un diario vacío.
+        La escritura de la instantánea se hace en un hilo en segundo plano salvo que wait=True.
+        """
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            if not wait:
+                return
+            self._compaction_thread.join()
+
+        with self._lock:
+            # Rotar el diario: lo escrito hasta ahora queda en el archivo de compactación
+            if self._file is not None:
+                self._fsync_locked()
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.journal_file):
+                if os.path.exists(self.compacting_file):
+                    # Compactación anterior pendiente: se añaden sus registros en orden
+                    with open(self.compacting_file, 'a', encoding='utf-8') as dst, open(self.journal_file, 'r', encoding='utf-8') as src:
+                        dst.write(src.read())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, self.compacting_file)
+            self._file = open(self.journal_file, 'a', encoding='utf-8')
+            snapshot = {"last_seq": self._seq, "memory": self.snapshot_provider()}
+            self._records_since_snapshot = 0
+
+        self._compaction_thread = threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+        self._compaction_thread.start()
+        if wait:
+            self._compaction_thread.join()
+
+    def _write_snapshot(self, snapshot):
+        tmp_file = f"{self.snapshot_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            if os.path.exists(self.compacting_file):
+                os.remove(self.compacting_file)
+            logging.info(f"Memoria compactada en '{self.snapshot_file}' ({len(snapshot['memory'])} entradas, secuencia {snapshot['last_seq']}).")
+        except Exception as e:
+            # El diario de compactación se conserva; se reproducirá en la próxima carga
+            logging.error(f"Error al compactar la memoria en '{self.snapshot_file}': {e}")
+
+    def close(self):
+        """
+        Fuerza el fsync pendiente, espera a la compactación en curso y cierra el diario.
+        """
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        with self._lock:
+            self._fsync_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,77 @@
+from collections import deque
+
+from core_logic.utils import normalize_text
+
+def normalize_phrase(text):
+    """
+    Texto normalizado con normalize_text y los espacios colapsados.
+    """
+    return " ".join(normalize_text(text).split())
+
+class KeywordAutomaton:
+    """
+    Autómata de Aho-Corasick sobre un conjunto de frases normalizadas.
+
+    Encuentra todas las frases presentes en un texto en una sola pasada, con un coste
+    independiente del número de frases. Las frases sólo coinciden con palabras completas
+    (se rodean de espacios tanto ellas como el texto).
+    """
+
+    def __init__(self, phrases):
+        """
+        :param phrases: Diccionario {frase: dato} (o iterable de frases) a buscar.
+        """
+        if not isinstance(phrases, dict):
+            phrases = {phrase: None for phrase in phrases}
+        self._goto = [{}] # Transiciones por estado: {caracter: estado}
+        self._fail = [0]
+        self._outputs = [[]] # Frases que terminan en cada estado: [(frase_normalizada, dato)]
+        self.size = 0
+        for phrase, data in phrases.items():
+            normalized = normalize_phrase(phrase)
+            if normalized:
+                self._insert(f" {normalized} ", (normalized, data))
+        self._build_failure_links()
+
+    def _insert(self, pattern, output):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append(output)
+        self.size += 1
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # Las salidas del estado de fallo también terminan aquí
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def find_all(self, text):
+        """
+        Devuelve la lista de (frase_normalizada, dato) presentes en el texto, en orden de aparición.
+        """
+        if not self.size:
+            return []
+        matches = []
+        state = 0
+        for char in f" {normalize_phrase(text)} ":
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._outputs[state]:
+                matches.extend(self._outputs[state])
+        return matches
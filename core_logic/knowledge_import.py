@@ -0,0 +1,225 @@
+# knowledge_import.py (ubicado en ~/Smart-Home-AI/core_logic/knowledge_import.py)
+#
+# Importación masiva de pares pregunta/respuesta (JSONL o CSV) en KnowledgeManager.
+#
+# Uso: python -m core_logic.knowledge_import corpus.jsonl --knowledge-dir knowledge --ml-server 127.0.0.1:5001
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+
+from core_logic.utils import normalize_text
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def dedup_key(text):
+    """
+    Clave de deduplicación: texto normalizado y con los espacios colapsados.
+    """
+    return " ".join(normalize_text(text).split())
+
+class KnowledgeImporter:
+    """
+    Importa un corpus grande leyendo por bloques acotados, sin cargarlo entero en memoria.
+
+    Por cada bloque: descarta preguntas repetidas (por texto normalizado, también frente a lo ya
+    importado), pide los embeddings en lotes grandes y añade el bloque al almacén de vectores con
+    una sola escritura. Cada 'checkpoint_interval' segundos guarda el estado de KnowledgeManager y
+    un punto de control con la posición en el archivo, de modo que una importación interrumpida
+    se reanuda desde el último punto de control.
+    """
+
+    def __init__(self, knowledge_manager, embed_batch, target="general_knowledge", chunk_size=1000,
+                 batch_size=128, checkpoint_interval=10.0, prompt_field="prompt", response_field="response",
+                 progress_callback=None):
+        """
+        :param embed_batch: Corrutina que recibe una lista de textos y devuelve sus embeddings.
+        :param target: Colección de destino: 'general_knowledge' o 'learned_responses'.
+        :param progress_callback: Función opcional que recibe el diccionario de progreso.
+        """
+        if target not in ("general_knowledge", "learned_responses"):
+            raise ValueError(f"Colección de destino no válida: '{target}'.")
+        self.knowledge_manager = knowledge_manager
+        self.embed_batch = embed_batch
+        self.target = target
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.prompt_field = prompt_field
+        self.response_field = response_field
+        self.progress_callback = progress_callback
+
+    @staticmethod
+    def checkpoint_path(path):
+        return f"{path}.import_checkpoint.json"
+
+    def _load_checkpoint(self, path):
+        """
+        Devuelve el punto de control si corresponde a este mismo archivo (tamaño y fecha) y destino.
+        """
+        checkpoint_file = self.checkpoint_path(path)
+        if not os.path.exists(checkpoint_file):
+            return None
+        try:
+            with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Punto de control de importación ilegible '{checkpoint_file}': {e}. Se empieza de cero.")
+            return None
+        stat = os.stat(path)
+        if checkpoint.get("size") != stat.st_size or checkpoint.get("mtime") != stat.st_mtime or checkpoint.get("target") != self.target:
+            logging.warning(f"El archivo '{path}' cambió desde el último punto de control. Se empieza de cero.")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, path, offset, stats):
+        stat = os.stat(path)
+        checkpoint = dict(stats, offset=offset, size=stat.st_size, mtime=stat.st_mtime, target=self.target)
+        checkpoint_file = self.checkpoint_path(path)
+        tmp_file = f"{checkpoint_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, checkpoint_file)
+
+    def _read_chunks(self, f, file_format, fieldnames):
+        """
+        Genera (filas, posición_tras_el_bloque). Se usa readline() para poder llamar a tell().
+        """
+        lines = iter(f.readline, '')
+        reader = csv.DictReader(lines, fieldnames=fieldnames) if file_format == "csv" else None
+        chunk = []
+        while True:
+            if reader is not None:
+                row = next(reader, None)
+            else:
+                line = next(lines, None)
+                row = None if line is None else self._parse_json_line(line)
+            if row is None:
+                break
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield chunk, f.tell()
+                chunk = []
+        if chunk:
+            yield chunk, f.tell()
+
+    @staticmethod
+    def _parse_json_line(line):
+        try:
+            return json.loads(line) if line.strip() else {}
+        except json.JSONDecodeError:
+            return {} # Se contabiliza como fila inválida
+
+    async def _embed(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(await self.embed_batch(texts[start:start + self.batch_size]))
+        return embeddings
+
+    async def import_file(self, path, file_format=None):
+        """
+        Importa el archivo y devuelve las estadísticas ('rows_read', 'imported', 'duplicates', 'invalid').
+        """
+        file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        texts = getattr(self.knowledge_manager, self.target)
+        seen = {dedup_key(prompt) for prompt in texts}
+        stored_embeddings = self.knowledge_manager.vector_store.get_collection(self.target)
+
+        stats = {"rows_read": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+        checkpoint = self._load_checkpoint(path)
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            fieldnames = None
+            if file_format == "csv":
+                fieldnames = next(csv.reader([f.readline()]), None)
+            if checkpoint:
+                f.seek(checkpoint["offset"])
+                stats.update({key: checkpoint.get(key, 0) for key in stats})
+                logging.info(f"Reanudando la importación de '{path}' tras {stats['rows_read']} filas.")
+
+            started = time.perf_counter()
+            rows_at_start = stats["rows_read"]
+            last_checkpoint = started
+            for rows, offset in self._read_chunks(f, file_format, fieldnames):
+                stats["rows_read"] += len(rows)
+                pending = [] # [(pregunta, respuesta)]
+                for row in rows:
+                    prompt = str(row.get(self.prompt_field) or "").strip() if isinstance(row, dict) else ""
+                    response = str(row.get(self.response_field) or "").strip() if isinstance(row, dict) else ""
+                    if not prompt or not response:
+                        stats["invalid"] += 1
+                        continue
+                    key = dedup_key(prompt)
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    pending.append((prompt, response))
+
+                # Al reanudar, las filas ya embebidas antes de la interrupción no se vuelven a pedir
+                to_embed = [prompt for prompt, _ in pending if prompt not in stored_embeddings]
+                embeddings = dict(zip(to_embed, await self._embed(to_embed))) if to_embed else {}
+                self.knowledge_manager.add_knowledge_batch(
+                    self.target, [(prompt, response, embeddings.get(prompt)) for prompt, response in pending]
+                )
+                stats["imported"] += len(pending)
+
+                now = time.perf_counter()
+                if now - last_checkpoint >= self.checkpoint_interval:
+                    self.knowledge_manager.save_state()
+                    self._save_checkpoint(path, offset, stats)
+                    last_checkpoint = now
+                self._report(stats, rows_at_start, now - started)
+
+        self.knowledge_manager.save_state()
+        if os.path.exists(self.checkpoint_path(path)):
+            os.remove(self.checkpoint_path(path))
+        elapsed = time.perf_counter() - started
+        logging.info(f"Importación de '{path}' completada en {elapsed:.1f}s: {stats}.")
+        return stats
+
+    def _report(self, stats, rows_at_start, elapsed):
+        progress = dict(stats, rows_per_second=round((stats["rows_read"] - rows_at_start) / elapsed, 1) if elapsed else 0.0)
+        if self.progress_callback:
+            self.progress_callback(progress)
+        else:
+            logging.info(
+                f"Importación: {progress['rows_read']} filas leídas, {progress['imported']} importadas, "
+                f"{progress['duplicates']} duplicadas, {progress['invalid']} inválidas ({progress['rows_per_second']} filas/s)."
+            )
+
+def main():
+    import httpx
+    from core_logic.knowledge_manager import KnowledgeManager
+
+    parser = argparse.ArgumentParser(description="Importa un corpus JSONL/CSV de preguntas y respuestas.")
+    parser.add_argument('path')
+    parser.add_argument('--knowledge-dir', default="knowledge")
+    parser.add_argument('--state-file', default="knowledge_state.json")
+    parser.add_argument('--ml-server', default="127.0.0.1:5001", help="host:puerto del ML Server.")
+    parser.add_argument('--target', default="general_knowledge", choices=["general_knowledge", "learned_responses"])
+    parser.add_argument('--format', choices=["jsonl", "csv"])
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=128)
+    args = parser.parse_args()
+
+    knowledge_manager = KnowledgeManager(base_dir=args.knowledge_dir, state_file_name=args.state_file)
+
+    async def run():
+        async with httpx.AsyncClient(timeout=120) as client:
+            async def embed_batch(texts):
+                response = await client.post(f"http://{args.ml_server}/get_embeddings", json={"texts": texts})
+                response.raise_for_status()
+                return response.json()["embeddings"]
+
+            importer = KnowledgeImporter(knowledge_manager, embed_batch, target=args.target,
+                                         chunk_size=args.chunk_size, batch_size=args.batch_size)
+            return await importer.import_file(args.path, args.format)
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
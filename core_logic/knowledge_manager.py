@@ -1,32 +1,71 @@
+import hashlib
 import json
 import os
+import time
 import numpy as np # Necesario para operaciones con embeddings
+from core_logic.eviction import DEFAULT_HALF_LIFE_S, FrequencyEviction
+from core_logic.keyword_matcher import KeywordAutomaton, normalize_phrase
+from core_logic.lexical_index import LexicalIndex
+from core_logic.vector_store import VectorStore
+
+def content_hash(text):
+    """
+    Hash del contenido de un texto; clave de los embeddings precalculados en el artefacto.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def embedding_artifact_path(base_dir, model_name):
+    """
+    Ruta del artefacto de embeddings precalculados para un modelo (junto a los JSON de conocimiento).
+    """
+    model_slug = model_name.replace('/', '__')
+    return os.path.join(base_dir, f"embeddings_artifact.{model_slug}.npz")
 
 class KnowledgeManager:
-    def __init__(self, base_dir="."):
+    def __init__(self, base_dir=".", state_file_name="network_state.json", learned_capacity=None, learned_half_life_s=DEFAULT_HALF_LIFE_S):
         self.base_dir = base_dir
         self.knowledge_file = os.path.join(base_dir, "knowledge.json")
-        self.network_state_file = os.path.join(base_dir, "network_state.json")
+        self.network_state_file = os.path.join(base_dir, state_file_name)
         self.default_knowledge_file = os.path.join(base_dir, "default_knowledge.json")
         self.keywords_file = os.path.join(base_dir, "keywords.json")
+        # Los embeddings viven en una matriz float32 mapeada en memoria, fuera del JSON
+        self.vector_store = VectorStore(os.path.join(base_dir, "network_state_vectors"))
+        # Índice léxico BM25 sobre preguntas y palabras clave; evita pedir embeddings en coincidencias claras
+        self.lexical_index = LexicalIndex()
         
         self.general_knowledge = {} # {pregunta: respuesta}
-        self.general_knowledge_embeddings = {} # {pregunta: embedding_vector}
-
         self.learned_responses = {} # {pregunta: respuesta}
-        self.learned_responses_embeddings = {} # {pregunta: embedding_vector}
+        # Las respuestas aprendidas tienen capacidad limitada: se expulsan las menos usadas (el conocimiento general no)
+        self.learned_policy = FrequencyEviction("learned_responses", learned_capacity, learned_half_life_s)
 
         self.ai_name = "Neo" # Nombre por defecto de la IA
         self.user_name = None # Nombre del usuario
 
         self.self_description_keywords = {} # Palabras clave de auto-descripción (texto)
-        self.self_description_embeddings = {} # NUEVO: Embeddings para palabras clave de auto-descripción
         self.out_of_scope_keywords = [] # Palabras clave fuera de alcance
+        # Autómata de palabras clave; se reconstruye sólo cuando cambia el archivo de palabras clave
+        self.keyword_matcher = KeywordAutomaton({})
+        self.keywords_check_interval = 1.0 # Segundos entre comprobaciones del archivo de palabras clave
+        self._keywords_signature = None
+        self._keywords_checked_at = 0.0
         
         # Cargar conocimiento por defecto, palabras clave y estado inicial al inicio
         self.load_default_knowledge()
         self.load_keywords_from_file() # Cargar las palabras clave (texto)
         self.load_state() # Cargar el estado de la red y embeddings (incluyendo los nuevos de self_description)
+        self.rebuild_lexical_index()
+
+    @property
+    def general_knowledge_embeddings(self):
+        return self.vector_store.get_collection("general_knowledge") # {pregunta: embedding_vector}
+
+    @property
+    def learned_responses_embeddings(self):
+        return self.vector_store.get_collection("learned_responses") # {pregunta: embedding_vector}
+
+    @property
+    def self_description_embeddings(self):
+        return self.vector_store.get_collection("self_description") # {palabra_clave: embedding_vector}
 
     def add_general_knowledge(self, prompt, response, embedding=None):
         """
@@ -34,8 +73,9 @@ class KnowledgeManager:
         :param embedding: El vector de embedding de la pregunta.
         """
         self.general_knowledge[prompt] = response
+        self.lexical_index.add("general_knowledge", prompt)
         if embedding is not None:
-            self.general_knowledge_embeddings[prompt] = embedding
+            self.vector_store.append("general_knowledge", [(prompt, embedding)])
         self.save_state()
 
     def add_learned_response(self, prompt, response, embedding=None, save=True):
@@ -45,17 +85,143 @@ class KnowledgeManager:
         :param save: Si es True, guarda el estado inmediatamente.
         """
         self.learned_responses[prompt] = response
+        self.lexical_index.add("learned_responses", prompt)
         if embedding is not None:
-            self.learned_responses_embeddings[prompt] = embedding
+            self.vector_store.append("learned_responses", [(prompt, embedding)])
+        if prompt not in self.learned_policy:
+            self.learned_policy.add(prompt)
+        self.evict_learned_responses()
+        if save:
+            self.save_state()
+
+    def add_knowledge_batch(self, target, entries, save=False):
+        """
+        Añade un lote de pares a 'general_knowledge' o 'learned_responses' con una sola escritura
+        en el almacén de vectores (usado por la importación masiva).
+        :param entries: Lista de tuplas (pregunta, respuesta, embedding o None).
+        :param save: Si es True, guarda el estado al terminar.
+        """
+        texts = self.general_knowledge if target == "general_knowledge" else self.learned_responses
+        vectors = []
+        for prompt, response, embedding in entries:
+            texts[prompt] = response
+            self.lexical_index.add(target, prompt)
+            if embedding is not None:
+                vectors.append((prompt, embedding))
+            if target == "learned_responses" and prompt not in self.learned_policy:
+                self.learned_policy.add(prompt)
+        if vectors:
+            self.vector_store.append(target, vectors)
+        if target == "learned_responses":
+            self.evict_learned_responses()
         if save:
             self.save_state()
 
+    def evict_learned_responses(self):
+        """
+        Expulsa las respuestas aprendidas menos usadas que superen la capacidad, con su entrada
+        en el índice léxico y su vector (marca de borrado en el almacén).
+        :return: Lista de preguntas expulsadas.
+        """
+        evicted = self.learned_policy.evict()
+        for prompt in evicted:
+            self.learned_responses.pop(prompt, None)
+            self.lexical_index.remove("learned_responses", prompt)
+        if evicted:
+            self.vector_store.remove("learned_responses", evicted)
+            print(f"INFO: {len(evicted)} respuestas aprendidas poco usadas expulsadas (capacidad {self.learned_policy.capacity}).")
+        return evicted
+
+    def pin_learned_response(self, prompt, pinned=True):
+        """
+        Fija (o libera) una respuesta aprendida: las fijadas nunca se expulsan.
+        :return: False si la pregunta no está entre las respuestas aprendidas.
+        """
+        if not self.learned_policy.set_pinned(prompt, bool(pinned)):
+            return False
+        if not pinned:
+            self.evict_learned_responses()
+        self.save_state()
+        return True
+
+    def _record_hit(self, collection, key):
+        if collection == "learned_responses":
+            self.learned_policy.hit(key)
+
     def add_self_description_embedding(self, keyword, embedding):
         """
         Añade un embedding para una palabra clave de auto-descripción.
+        Sólo se escribe la fila nueva en el almacén de vectores; el JSON no cambia.
         """
-        self.self_description_embeddings[keyword] = embedding
-        self.save_state() # Guardar el estado después de añadir un embedding de palabra clave
+        self.vector_store.append("self_description", [(keyword, embedding)])
+
+    def find_missing_embeddings(self):
+        """
+        Devuelve {coleccion: [textos]} con las preguntas y palabras clave que aún no tienen embedding.
+        """
+        sources = {
+            "general_knowledge": self.general_knowledge,
+            "learned_responses": self.learned_responses,
+            "self_description": self.self_description_keywords
+        }
+        missing = {}
+        for collection, texts in sources.items():
+            embedded = self.vector_store.get_collection(collection)
+            pending = [text for text in texts if text not in embedded]
+            if pending:
+                missing[collection] = pending
+        return missing
+
+    def apply_embedding_artifact(self, artifact_path, model_name):
+        """
+        Completa los embeddings que faltan con un artefacto precalculado en tiempo de construcción.
+        Sólo se usan vectores del mismo modelo y cuyo hash de contenido coincide con el texto actual.
+        :return: Número de embeddings tomados del artefacto.
+        """
+        if not os.path.exists(artifact_path):
+            return 0
+        try:
+            with np.load(artifact_path, allow_pickle=False) as artifact:
+                if str(artifact["model"]) != model_name:
+                    print(f"WARNING: El artefacto '{artifact_path}' es del modelo '{artifact['model']}', no de '{model_name}'. Se ignora.")
+                    return 0
+                row_by_hash = {h: i for i, h in enumerate(artifact["hashes"].tolist())}
+                vectors = artifact["vectors"]
+                applied = 0
+                for collection, texts in self.find_missing_embeddings().items():
+                    items = [(text, vectors[row_by_hash[content_hash(text)]]) for text in texts if content_hash(text) in row_by_hash]
+                    self.vector_store.append(collection, items)
+                    applied += len(items)
+            print(f"INFO: {applied} embeddings cargados desde el artefacto '{artifact_path}'.")
+            return applied
+        except Exception as e:
+            print(f"ERROR: No se pudo cargar el artefacto de embeddings '{artifact_path}': {e}")
+            return 0
+
+    async def precompute_embeddings(self, embed_batch, batch_size=64):
+        """
+        Calcula en lotes los embeddings que faltan y los persiste una sola vez por colección.
+        :param embed_batch: Corrutina que recibe una lista de textos y devuelve la lista de embeddings.
+        :return: Número de embeddings calculados.
+        """
+        missing = self.find_missing_embeddings()
+        pending = [(collection, text) for collection, texts in missing.items() for text in texts]
+        if not pending:
+            return 0
+
+        computed = {} # {coleccion: [(texto, embedding)]}
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            embeddings = await embed_batch([text for _, text in chunk])
+            for (collection, text), embedding in zip(chunk, embeddings):
+                if embedding is not None:
+                    computed.setdefault(collection, []).append((text, embedding))
+
+        for collection, items in computed.items():
+            self.vector_store.append(collection, items)
+        total = sum(len(items) for items in computed.values())
+        print(f"INFO: {total} embeddings precalculados en {(len(pending) + batch_size - 1) // batch_size} lotes.")
+        return total
 
     def get_response_from_memory(self, prompt):
         """
@@ -64,6 +230,7 @@ class KnowledgeManager:
         if prompt in self.general_knowledge:
             return self.general_knowledge[prompt]
         if prompt in self.learned_responses:
+            self.learned_policy.hit(prompt)
             return self.learned_responses[prompt]
         return None
 
@@ -81,6 +248,9 @@ class KnowledgeManager:
     def get_user_name(self):
         return self.user_name
 
+    def get_learned_stats(self, top=10):
+        return self.learned_policy.stats(top)
+
     def load_default_knowledge(self):
         """
         Carga el conocimiento por defecto desde un archivo JSON.
@@ -144,25 +314,88 @@ class KnowledgeManager:
             self.out_of_scope_keywords = [
                 "cámara ip", "camara ip", "red de computadoras", "revisar red", "tomar imagen", "proporcionar datos", "autentiques", "red local", "computadoras", "escanear", "acceder", "conectar a internet"
             ]
+        self._keywords_signature = self._keywords_file_signature()
+        self.build_keyword_matcher()
+
+
+    def _keywords_file_signature(self):
+        try:
+            stat = os.stat(self.keywords_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def build_keyword_matcher(self):
+        """
+        Compila todas las palabras clave en un único autómata (una sola pasada por comando).
+        Si una frase aparece en varias listas, prevalece la de fuera de alcance. Las de
+        'auto_description_keywords' no tienen respuesta fija y no se incluyen: esas preguntas
+        siguen al conocimiento local y a Gemini ('conectar enchufe' no es una pregunta sobre la IA).
+        """
+        phrases = {keyword: ("self_description", keyword) for keyword in self.self_description_keywords}
+        phrases.update({keyword: ("out_of_scope", None) for keyword in self.out_of_scope_keywords})
+        self.keyword_matcher = KeywordAutomaton(phrases)
+
+    def refresh_keywords_if_changed(self):
+        """
+        Recarga las palabras clave y reconstruye el autómata sólo si el archivo cambió
+        (como mucho una comprobación cada keywords_check_interval segundos).
+        """
+        now = time.monotonic()
+        if now - self._keywords_checked_at < self.keywords_check_interval:
+            return False
+        self._keywords_checked_at = now
+        if self._keywords_file_signature() == self._keywords_signature:
+            return False
+        self.load_keywords_from_file()
+        self.lexical_index.clear("self_description")
+        self.lexical_index.add_many("self_description", self.self_description_keywords)
+        return True
+
+    def match_keywords(self, command, min_coverage=0.5):
+        """
+        Prefiltro de palabras clave, previo a cualquier embedding o llamada al LLM.
+          - Fuera de alcance: cualquier coincidencia rechaza la petición.
+          - Auto-descripción: se responde con la respuesta fija (self_description_keywords) de la palabra
+            clave más larga, pero sólo si las palabras clave cubren al menos min_coverage de las palabras
+            del comando (así 'hola, enciende la luz' no se queda en el saludo).
+        :return: Tupla (tipo, respuesta) con tipo 'out_of_scope' o 'self_description', o None.
+        """
+        self.refresh_keywords_if_changed()
+        matches = self.keyword_matcher.find_all(command)
+        if not matches:
+            return None
+        if any(kind == "out_of_scope" for _, (kind, _) in matches):
+            return "out_of_scope", "Lo siento, eso está fuera de mis capacidades. Puedo ayudarte a controlar los dispositivos de tu hogar y a responder preguntas generales."
 
+        command_words = len(normalize_phrase(command).split())
+        matched_words = len(set(word for phrase, _ in matches for word in phrase.split()))
+        if not command_words or matched_words / command_words < min_coverage:
+            return None
+        phrase, (kind, keyword) = max(matches, key=lambda match: len(match[0]))
+        response = self.self_description_keywords.get(keyword, "").replace("{ai_name}", self.ai_name)
+        return ("self_description", response) if response else None
 
     def save_state(self):
         """
-        Guarda el estado actual de la red y el conocimiento en un archivo JSON.
-        Los embeddings se guardan como listas de Python.
+        Guarda el texto y los metadatos en un archivo JSON compacto, de forma atómica.
+        Los embeddings no se escriben aquí: se añaden al almacén de vectores al crearse.
         """
         state_data = {
             "general_knowledge": self.general_knowledge,
-            "general_knowledge_embeddings": {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in self.general_knowledge_embeddings.items()},
             "learned_responses": self.learned_responses,
-            "learned_responses_embeddings": {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in self.learned_responses_embeddings.items()},
-            "self_description_embeddings": {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in self.self_description_embeddings.items()}, # NUEVO
+            # Uso de cada respuesta aprendida (aciertos y peso envejecido) para la política de expulsión
+            "learned_stats": {prompt: self.learned_policy.export(prompt) for prompt in self.learned_responses if prompt in self.learned_policy},
             "ai_name": self.ai_name,
             "user_name": self.user_name
         }
+        tmp_file = f"{self.network_state_file}.tmp"
         try:
-            with open(self.network_state_file, 'w', encoding='utf-8') as f:
-                json.dump(state_data, f, indent=4)
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(state_data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.network_state_file)
+            if self.vector_store.needs_compaction():
+                self.vector_store.compact()
             print(f"INFO: Estado de la memoria guardado en '{self.network_state_file}'.")
         except Exception as e:
             print(f"ERROR: No se pudo guardar el estado de la memoria en '{self.network_state_file}': {e}")
@@ -170,8 +403,10 @@ class KnowledgeManager:
     def load_state(self):
         """
         Carga el estado de la red y el conocimiento desde un archivo JSON.
-        Los embeddings se cargan y se convierten de nuevo a arrays de NumPy.
+        Los embeddings se mapean en memoria desde el almacén de vectores (sin parseo).
+        Si el JSON aún contiene embeddings en formato antiguo, se migran al almacén.
         """
+        self.vector_store.load()
         if os.path.exists(self.network_state_file):
             try:
                 with open(self.network_state_file, 'r', encoding='utf-8') as f:
@@ -180,17 +415,28 @@ class KnowledgeManager:
                     self.learned_responses = state_data.get("learned_responses", {})
                     self.ai_name = state_data.get("ai_name", "Neo") 
                     self.user_name = state_data.get("user_name")
+                    learned_stats = state_data.get("learned_stats", {})
 
-                    # Cargar embeddings y convertirlos a NumPy arrays
-                    self.general_knowledge_embeddings = {
-                        k: np.array(v) for k, v in state_data.get("general_knowledge_embeddings", {}).items()
-                    }
-                    self.learned_responses_embeddings = {
-                        k: np.array(v) for k, v in state_data.get("learned_responses_embeddings", {}).items()
-                    }
-                    self.self_description_embeddings = { # NUEVO
-                        k: np.array(v) for k, v in state_data.get("self_description_embeddings", {}).items()
-                    }
+                # Migrar embeddings del formato antiguo (listas dentro del JSON) al almacén binario
+                legacy_keys = {
+                    "general_knowledge_embeddings": "general_knowledge",
+                    "learned_responses_embeddings": "learned_responses",
+                    "self_description_embeddings": "self_description"
+                }
+                migrated = False
+                for legacy_key, collection in legacy_keys.items():
+                    legacy_embeddings = state_data.get(legacy_key)
+                    if legacy_embeddings:
+                        self.vector_store.append(collection, list(legacy_embeddings.items()))
+                        migrated = True
+                if migrated:
+                    print("INFO: Embeddings migrados del JSON al almacén de vectores binario.")
+                self.learned_policy.clear()
+                for prompt in self.learned_responses:
+                    self.learned_policy.add(prompt, **(learned_stats.get(prompt) or {}))
+                evicted = self.evict_learned_responses() # La capacidad configurada puede ser menor que lo guardado
+                if migrated or evicted:
+                    self.save_state()
                 print(f"INFO: Estado de la memoria cargado desde '{self.network_state_file}'.")
                 print(f"INFO:   Conocimiento general: {len(self.general_knowledge)} entradas ({len(self.general_knowledge_embeddings)} con embeddings).")
                 print(f"INFO:   Respuestas aprendidas: {len(self.learned_responses)} entradas ({len(self.learned_responses_embeddings)} con embeddings).")
@@ -209,6 +455,69 @@ class KnowledgeManager:
             print(f"INFO: No se encontró el archivo de estado de red '{self.network_state_file}'. Se creará uno nuevo al guardar.")
             return False
 
+    def rebuild_lexical_index(self):
+        """
+        Reconstruye el índice léxico completo (tras cargar o limpiar); después se mantiene de forma incremental.
+        """
+        self.lexical_index.clear()
+        self.lexical_index.add_many("general_knowledge", self.general_knowledge)
+        self.lexical_index.add_many("learned_responses", self.learned_responses)
+        self.lexical_index.add_many("self_description", self.self_description_keywords)
+
+    def _response_for(self, collection, key):
+        if collection == "self_description":
+            return self.self_description_keywords.get(key, "").replace("{ai_name}", self.ai_name)
+        texts = self.general_knowledge if collection == "general_knowledge" else self.learned_responses
+        return texts.get(key)
+
+    async def find_response(self, query, get_embedding, strong_coverage=0.8, min_coverage=0.3, rerank_k=10, threshold=0.75):
+        """
+        Busca una respuesta primero en el índice léxico y sólo pide el embedding si hace falta.
+          - Coincidencia léxica clara (cobertura >= strong_coverage sin otro candidato igual de bueno):
+            se responde sin embedding.
+          - Candidatos ambiguos (cobertura >= min_coverage): se reordenan por similitud del coseno.
+          - Sin candidatos léxicos: no se pide embedding.
+        :param get_embedding: Corrutina texto -> embedding.
+        :return: Tupla (respuesta, origen, puntuación) con origen 'lexical' o 'embedding', o None.
+        """
+        candidates = self.lexical_index.search(query, top_k=rerank_k)
+        candidates = [candidate for candidate in candidates if candidate[3] >= min_coverage]
+        if not candidates:
+            return None
+
+        best = max(candidates, key=lambda candidate: (candidate[3], candidate[2]))
+        rivals = [candidate for candidate in candidates if candidate is not best and candidate[3] >= strong_coverage]
+        if best[3] >= strong_coverage and (not rivals or best[3] == 1.0):
+            response = self._response_for(best[0], best[1])
+            if response:
+                self._record_hit(best[0], best[1])
+                return response, "lexical", best[3]
+
+        keys, vectors = [], []
+        for collection, key, _, _ in candidates:
+            vector = self.vector_store.get_collection(collection).get(key)
+            if vector is not None:
+                keys.append((collection, key))
+                vectors.append(vector)
+        if not vectors:
+            return None
+        query_embedding = await get_embedding(query)
+        if query_embedding is None:
+            return None
+
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_embedding)
+        similarities = np.divide(matrix @ query_embedding, norms, out=np.zeros(len(vectors), dtype=np.float32), where=norms > 0)
+        index = int(np.argmax(similarities))
+        if similarities[index] < threshold:
+            return None
+        response = self._response_for(*keys[index])
+        if not response:
+            return None
+        self._record_hit(*keys[index])
+        return response, "embedding", float(similarities[index])
+
     def find_similar_response_by_embedding(self, query_embedding, target_embeddings_dict, target_text_dict, top_k=1, threshold=0.7):
         """
         Busca las respuestas más similares en una colección de embeddings dada.
@@ -260,12 +569,12 @@ class KnowledgeManager:
         También restablece el nombre de la IA y del usuario.
         """
         self.general_knowledge = {}
-        self.general_knowledge_embeddings = {}
         self.learned_responses = {}
-        self.learned_responses_embeddings = {}
-        self.self_description_embeddings = {} # NUEVO: Limpiar embeddings de auto-descripción
+        self.learned_policy.clear()
+        self.vector_store.clear() # Limpiar todos los embeddings (incluidos los de auto-descripción)
         self.ai_name = "Neo" # Restablecer a "Neo" al limpiar
         self.user_name = None
         self.load_keywords_from_file() # Recargar las palabras clave desde el archivo (texto)
+        self.rebuild_lexical_index()
         self.save_state() # Guardar el estado después de limpiar
 
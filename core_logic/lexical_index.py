@@ -0,0 +1,110 @@
+import heapq
+import math
+import threading
+
+from core_logic.utils import normalize_text
+
+def tokenize(text):
+    """
+    Tokens de búsqueda: palabras del texto normalizado con normalize_text.
+    """
+    return normalize_text(text).split()
+
+class LexicalIndex:
+    """
+    Índice invertido con puntuación BM25, actualizado de forma incremental.
+
+    Cada documento se identifica por (coleccion, clave) — p. ej. ('general_knowledge', pregunta) —
+    y sólo se indexa el texto de la clave. Las listas de apariciones guardan la frecuencia del
+    término por documento; el IDF y la longitud media se calculan al consultar, así que añadir o
+    quitar un documento no obliga a reconstruir nada.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {} # {token: {doc_id: frecuencia}}
+        self._doc_tokens = {} # {doc_id: [tokens]}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def add(self, collection, key):
+        doc_id = (collection, key)
+        tokens = tokenize(key)
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._doc_tokens[doc_id] = tokens
+            self._total_length += len(tokens)
+            for token in tokens:
+                postings = self._postings.setdefault(token, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def add_many(self, collection, keys):
+        for key in keys:
+            self.add(collection, key)
+
+    def remove(self, collection, key):
+        with self._lock:
+            self._remove_locked((collection, key))
+
+    def _remove_locked(self, doc_id):
+        tokens = self._doc_tokens.pop(doc_id, None)
+        if tokens is None:
+            return
+        self._total_length -= len(tokens)
+        for token in set(tokens):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+
+    def clear(self, collection=None):
+        with self._lock:
+            if collection is None:
+                self._postings = {}
+                self._doc_tokens = {}
+                self._total_length = 0
+                return
+            for doc_id in [d for d in self._doc_tokens if d[0] == collection]:
+                self._remove_locked(doc_id)
+
+    def search(self, query, top_k=10, collections=None):
+        """
+        Devuelve hasta top_k tuplas (coleccion, clave, puntuación_bm25, cobertura), ordenadas por puntuación.
+        La cobertura es la similitud de Jaccard ponderada por IDF entre los términos de la consulta y
+        los del documento: 1.0 cuando ambos tienen exactamente las mismas palabras.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+        with self._lock:
+            doc_count = len(self._doc_tokens)
+            if not doc_count:
+                return []
+            avg_length = self._total_length / doc_count
+            idf = {token: self._idf_locked(token, doc_count) for token in query_tokens}
+            scores = {}
+            matched_idf = {}
+            for token in query_tokens:
+                for doc_id, tf in self._postings.get(token, {}).items():
+                    if collections is not None and doc_id[0] not in collections:
+                        continue
+                    length_norm = self.k1 * (1 - self.b + self.b * len(self._doc_tokens[doc_id]) / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf[token] * tf * (self.k1 + 1) / (tf + length_norm)
+                    matched_idf[doc_id] = matched_idf.get(doc_id, 0.0) + idf[token]
+            query_idf = sum(idf.values())
+            ranked = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            results = []
+            for doc_id, score in ranked:
+                doc_idf = sum(self._idf_locked(token, doc_count) for token in set(self._doc_tokens[doc_id]))
+                union_idf = query_idf + doc_idf - matched_idf[doc_id]
+                results.append((doc_id[0], doc_id[1], score, matched_idf[doc_id] / union_idf if union_idf else 0.0))
+            return results
+
+    def _idf_locked(self, token, doc_count):
+        df = len(self._postings.get(token, ()))
+        return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
@@ -2,6 +2,7 @@ import httpx
 import json
 import os
 import logging
+from core_logic.resilience import remaining_budget
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -36,7 +37,7 @@ HA_COMMAND_SCHEMA = {
 
 
 class LLMService:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http_client: httpx.AsyncClient = None):
         self.api_key = api_key
         if not self.api_key:
             logging.error("La clave de API de Gemini no fue proporcionada al LLMService.")
@@ -44,6 +45,18 @@ class LLMService:
         
         self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={self.api_key}"
         self.headers = {'Content-Type': 'application/json'}
+        # Cliente compartido: se reutilizan las conexiones mientras viva el bucle de eventos
+        self.http_client = http_client
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient()
+        return self.http_client
+
+    async def aclose(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
 
     async def generate_text(self, prompt: str) -> str:
         """
@@ -61,21 +74,20 @@ class LLMService:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(self.api_url, headers=self.headers, json=payload, timeout=30.0)
-                response.raise_for_status()
-                
-                result = response.json()
-                
-                if result.get("candidates") and len(result["candidates"]) > 0 and \
-                   result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
-                   len(result["candidates"][0]["content"]["parts"]) > 0:
-                    text = result["candidates"][0]["content"]["parts"][0].get("text", "")
-                    logging.info(f"Respuesta de Gemini recibida: '{text[:100]}...'")
-                    return text
-                else:
-                    logging.warning(f"Respuesta inesperada de Gemini: {result}")
-                    return "No pude generar una respuesta. La estructura de la respuesta de Gemini es inesperada."
+            response = await self._get_client().post(self.api_url, headers=self.headers, json=payload, timeout=remaining_budget(30.0))
+            response.raise_for_status()
+
+            result = response.json()
+
+            if result.get("candidates") and len(result["candidates"]) > 0 and \
+               result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
+               len(result["candidates"][0]["content"]["parts"]) > 0:
+                text = result["candidates"][0]["content"]["parts"][0].get("text", "")
+                logging.info(f"Respuesta de Gemini recibida: '{text[:100]}...'")
+                return text
+            else:
+                logging.warning(f"Respuesta inesperada de Gemini: {result}")
+                return "No pude generar una respuesta. La estructura de la respuesta de Gemini es inesperada."
         except httpx.RequestError as e:
             logging.error(f"Error de red o de solicitud al llamar a la API de Gemini: {e}")
             return f"Error de conexión con la IA: {e}"
@@ -106,22 +118,21 @@ class LLMService:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(self.api_url, headers=self.headers, json=payload, timeout=30.0)
-                response.raise_for_status()
-                
-                result = response.json()
-                
-                if result.get("candidates") and len(result["candidates"]) > 0 and \
-                   result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
-                   len(result["candidates"][0]["content"].get("parts", [])) > 0:
-                    json_text = result["candidates"][0]["content"]["parts"][0].get("text", "")
-                    parsed_json = json.loads(json_text)
-                    logging.info(f"Respuesta estructurada de Gemini recibida: {parsed_json}")
-                    return parsed_json
-                else:
-                    logging.warning(f"Respuesta estructurada inesperada de Gemini: {result}")
-                    return {"error": "No pude generar una respuesta estructurada. La estructura de la respuesta de Gemini es inesperada."}
+            response = await self._get_client().post(self.api_url, headers=self.headers, json=payload, timeout=remaining_budget(30.0))
+            response.raise_for_status()
+
+            result = response.json()
+
+            if result.get("candidates") and len(result["candidates"]) > 0 and \
+               result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts") and \
+               len(result["candidates"][0]["content"].get("parts", [])) > 0:
+                json_text = result["candidates"][0]["content"]["parts"][0].get("text", "")
+                parsed_json = json.loads(json_text)
+                logging.info(f"Respuesta estructurada de Gemini recibida: {parsed_json}")
+                return parsed_json
+            else:
+                logging.warning(f"Respuesta estructurada inesperada de Gemini: {result}")
+                return {"error": "No pude generar una respuesta estructurada. La estructura de la respuesta de Gemini es inesperada."}
         except httpx.RequestError as e:
             logging.error(f"Error de red o de solicitud al llamar a la API de Gemini para respuesta estructurada: {e}")
             return {"error": f"Error de conexión con la IA para respuesta estructurada: {e}"}
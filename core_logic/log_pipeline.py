@@ -0,0 +1,259 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+
+from core_logic.metrics import REGISTRY, current_trace_id
+
+# Nombres de clave cuyos valores nunca deben llegar a los logs
+SECRET_KEY_PATTERN = re.compile(r"(password|passwd|token|secret|api_key|apikey|authorization)$", re.IGNORECASE)
+REDACTED = "***"
+
+# Secretos dentro de texto libre: "clave: valor"/"clave=valor" con nombre sensible, la clave de
+# Gemini en la URL (?key=...), cabeceras Bearer y claves de API de Google sueltas
+SECRET_TEXT_PATTERNS = (
+    (re.compile(r"""(?i)(["']?[\w-]*(?:password|passwd|token|secret|api_key|apikey)["']?\s*[:=]\s*["']?)[^\s"',}&]+"""), r"\1" + REDACTED),
+    (re.compile(r"(?i)([?&]key=)[^&\s'\"]+"), r"\1" + REDACTED),
+    (re.compile(r"(?i)(bearer\s+)[\w.~+/-]+=*"), r"\1" + REDACTED),
+    (re.compile(r"AIza[0-9A-Za-z_-]{35}"), REDACTED),
+)
+# Filtro previo: la mayoría de las líneas no contiene nada de lo anterior y se salta las sustituciones
+_SECRET_HINT = re.compile(r"(?i)pass|token|secret|api_?key|key=|bearer|AIza")
+
+# Atributos propios de LogRecord (el resto son campos estructurados pasados con extra={...})
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id", "suppressed"}
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+class SecretRedactor:
+    """
+    Sustituye secretos por '***' en mensajes y campos estructurados: patrones conocidos
+    (ver SECRET_TEXT_PATTERNS) y los valores exactos registrados con add_secret().
+    """
+
+    def __init__(self):
+        self._secrets = ()
+
+    def add_secret(self, value):
+        if isinstance(value, str) and len(value) >= 4: # Valores muy cortos darían falsos positivos
+            self._secrets = tuple(sorted(set(self._secrets) | {value}, key=len, reverse=True))
+
+    def redact(self, text):
+        for secret in self._secrets:
+            if secret in text:
+                text = text.replace(secret, REDACTED)
+        if _SECRET_HINT.search(text):
+            for pattern, replacement in SECRET_TEXT_PATTERNS:
+                text = pattern.sub(replacement, text)
+        return text
+
+    def redact_value(self, key, value):
+        if SECRET_KEY_PATTERN.search(str(key)) and value:
+            return REDACTED
+        if isinstance(value, str):
+            return self.redact(value)
+        if isinstance(value, dict):
+            return redact_mapping(value, self)
+        return value
+
+def redact_mapping(mapping, redactor=None):
+    """
+    Copia de un diccionario con los valores de las claves sensibles sustituidos por '***'.
+    """
+    redactor = redactor or REDACTOR
+    return {key: redactor.redact_value(key, value) for key, value in mapping.items()}
+
+REDACTOR = SecretRedactor()
+
+class SourceRateLimiter(logging.Filter):
+    """
+    Limitación por origen (cada llamada a logging, identificada por archivo y línea): un cubo de
+    'burst' fichas que se rellena a 'rate_per_s'. Sin fichas, sólo pasa 1 de cada 'sample_one_in'
+    registros (muestreo), de modo que una avalancha sigue siendo visible sin inundar la salida.
+    El siguiente registro que pasa lleva en 'suppressed' cuántos se descartaron antes que él.
+    """
+
+    def __init__(self, rate_per_s=20.0, burst=100, sample_one_in=100, on_drop=None, clock=time.monotonic):
+        super().__init__()
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.sample_one_in = sample_one_in
+        self.on_drop = on_drop
+        self.clock = clock
+        self._buckets = {} # {(archivo, línea): [fichas, último_relleno, descartados]}
+
+    def filter(self, record):
+        if not self.rate_per_s:
+            return True
+        key = (record.pathname, record.lineno)
+        now = self.clock()
+        # Sin cerrojo: con varios hilos en el mismo origen el recuento puede desviarse en alguna
+        # ficha, que no importa para un límite de frecuencia y ahorra un cerrojo por llamada
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_per_s)
+        bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+        elif self.sample_one_in and (bucket[2] + 1) % self.sample_one_in == 0:
+            pass # Muestra de la avalancha
+        else:
+            bucket[2] += 1
+            if self.on_drop:
+                self.on_drop("rate_limited")
+            return False
+        record.suppressed, bucket[2] = bucket[2], 0
+        return True
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Lado del llamador: fija el mensaje, captura el identificador de traza y encola sin bloquear
+    nunca. Con la cola llena el registro se descarta (y se cuenta). Es el único manejador del
+    logger, así que el registro se modifica en su sitio en vez de copiarlo como hace QueueHandler.
+    """
+
+    def __init__(self, log_queue, max_size, on_drop):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.on_drop = on_drop
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.msg = f"{record.msg}\n{_EXCEPTION_FORMATTER.formatException(record.exc_info)}"
+            record.exc_info = None
+        if getattr(record, "trace_id", None) is None: # Puede venir en extra={...} (ml_server)
+            record.trace_id = current_trace_id.get()
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue no tiene límite ni bloqueo: el límite es aproximado entre hilos, pero no cuesta un cerrojo
+        if self.queue.qsize() >= self.max_size:
+            self.on_drop("queue_full")
+        else:
+            self.queue.put(record)
+
+class RedactingTextFormatter(logging.Formatter):
+    """
+    Formato de texto habitual, con el identificador de traza, los descartados y sin secretos.
+    """
+
+    def __init__(self, redactor=REDACTOR):
+        super().__init__(TEXT_FORMAT)
+        self.redactor = redactor
+
+    def format(self, record):
+        text = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id and trace_id not in text:
+            text = f"{text} [traza {trace_id}]"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text = f"{text} (+{suppressed} similares suprimidos)"
+        return self.redactor.redact(text)
+
+class JSONFormatter(logging.Formatter):
+    """
+    Un objeto JSON por línea: ts, level, service, logger, msg, trace_id, location (archivo:línea),
+    suppressed y los campos pasados con extra={...}. Los secretos se sustituyen por '***'.
+    """
+
+    def __init__(self, service, redactor=REDACTOR):
+        super().__init__()
+        self.service = service
+        self.redactor = redactor
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": self.redactor.redact(record.getMessage()),
+            "location": f"{os.path.basename(record.pathname)}:{record.lineno}",
+            "thread": record.threadName
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = self.redactor.redact_value(key, value)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogPipeline:
+    """
+    Registro asíncrono del proceso: el hilo que llama a logging sólo filtra por origen, formatea
+    el mensaje y lo encola (cola acotada, sin bloqueo); un hilo de fondo (QueueListener) aplica
+    el formato (texto o JSON), redacta los secretos y escribe en la salida.
+    """
+
+    def __init__(self, service, metric_prefix, level=logging.INFO, fmt="text", queue_size=10000,
+                 rate_per_s=20.0, burst=100, sample_one_in=100, stream=None):
+        self.service = service
+        self.queue = queue.SimpleQueue()
+        self.dropped = REGISTRY.counter(f"{metric_prefix}_log_records_dropped_total",
+                                        "Registros de log descartados por limitación por origen o por cola llena.", ("reason",))
+        REGISTRY.gauge(f"{metric_prefix}_log_queue_depth", "Registros de log pendientes de escribir.", self.queue.qsize)
+        self.rate_limiter = SourceRateLimiter(rate_per_s, burst, sample_one_in, on_drop=self._count_drop)
+        self.handler = _NonBlockingQueueHandler(self.queue, queue_size, self._count_drop)
+        self.handler.addFilter(self.rate_limiter)
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JSONFormatter(service) if fmt == "json" else RedactingTextFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, output, respect_handler_level=True)
+        self.level = level
+        self._running = False
+
+    def _count_drop(self, reason):
+        self.dropped.inc(reason=reason)
+
+    def install(self, logger=None):
+        """
+        Sustituye los manejadores del logger (por defecto el raíz, con los de logging.basicConfig) por la cola.
+        """
+        self.logger = logger or logging.getLogger()
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(self.level)
+        self.listener.start()
+        self._running = True
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """
+        Escribe lo pendiente y detiene el hilo de fondo (los registros posteriores ya no se encolan).
+        """
+        if not self._running:
+            return
+        self._running = False
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+
+def setup_logging(service, metric_prefix, **overrides):
+    """
+    Instala el registro asíncrono en el logger raíz. Por defecto se configura con variables de
+    entorno (el registro arranca antes de leer config.json): LOG_LEVEL, LOG_FORMAT ('text' o
+    'json'), LOG_QUEUE_SIZE, LOG_RATE_PER_S (por origen; 0 = sin límite), LOG_BURST y LOG_SAMPLE_ONE_IN.
+    """
+    settings = {
+        "level": os.environ.get('LOG_LEVEL', 'INFO').upper(),
+        "fmt": os.environ.get('LOG_FORMAT', 'text'),
+        "queue_size": int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+        "rate_per_s": float(os.environ.get('LOG_RATE_PER_S', 20)),
+        "burst": int(os.environ.get('LOG_BURST', 100)),
+        "sample_one_in": int(os.environ.get('LOG_SAMPLE_ONE_IN', 100)),
+        **overrides
+    }
+    return LogPipeline(service, metric_prefix, **settings).install()
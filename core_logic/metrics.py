@@ -0,0 +1,164 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+
+# Límites de los histogramas de latencia (segundos)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Identificador de traza de la petición en curso; se propaga al ML Server en la cabecera X-Request-ID
+TRACE_HEADER = "X-Request-ID"
+current_trace_id = contextvars.ContextVar("current_trace_id", default=None)
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {} # {valores_de_etiquetas: total}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {} # {valores_de_etiquetas: [conteos_por_bucket..., suma, total]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1 # El índice len(buckets) corresponde a +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+class MetricsRegistry:
+    """
+    Registro de métricas con salida en formato de texto de Prometheus.
+    Además de contadores e histogramas admite 'gauges' calculados al renderizar.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._gauges = [] # [(nombre, ayuda, función -> {valores_de_etiquetas: valor} o número, nombres_de_etiquetas)]
+
+    def _existing(self, name, kind, label_names):
+        """
+        Métrica ya registrada con ese nombre (o None). Reutilizar un nombre con otro tipo u otras
+        etiquetas mezclaría series distintas en silencio, así que se rechaza.
+        """
+        metric = self._metrics.get(name)
+        if metric is not None and (type(metric) is not kind or metric.label_names != tuple(label_names)):
+            raise ValueError(f"La métrica '{name}' ya está registrada como {type(metric).__name__.lower()} "
+                             f"con etiquetas {metric.label_names}, no como {kind.__name__.lower()} con {tuple(label_names)}.")
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        if self._existing(name, Counter, label_names) is None:
+            self._metrics[name] = Counter(name, help_text, label_names)
+        return self._metrics[name]
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        if self._existing(name, Histogram, label_names) is None:
+            self._metrics[name] = Histogram(name, help_text, label_names, buckets)
+        return self._metrics[name]
+
+    def gauge(self, name, help_text, callback, label_names=()):
+        self._gauges = [g for g in self._gauges if g[0] != name]
+        self._gauges.append((name, help_text, callback, tuple(label_names)))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for name, help_text, callback, label_names in self._gauges:
+            try:
+                values = callback()
+            except Exception:
+                continue # Un gauge que falla no debe romper /metrics
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if not isinstance(values, dict):
+                values = {(): values}
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(label_names, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+# Registro global del proceso
+REGISTRY = MetricsRegistry()
+
+# Content-Type del formato de texto de Prometheus
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Duración de cada etapa del procesamiento de un comando (memory_scan, embedding, prompt_build,
+# llm_call, response_parse, mqtt_publish, ...)
+STAGE_SECONDS = REGISTRY.histogram("smart_home_stage_seconds", "Duración de cada etapa del procesamiento de comandos.", ("stage",))
+
+def timed(stage):
+    """
+    Context manager que mide la duración de una etapa en STAGE_SECONDS.
+    """
+    return STAGE_SECONDS.time(stage=stage)
@@ -1,5 +1,10 @@
 import paho.mqtt.client as mqtt
 import logging
+import time
+from core_logic.metrics import REGISTRY
+
+MQTT_MESSAGES_TOTAL = REGISTRY.counter("smart_home_mqtt_messages_total", "Mensajes MQTT recibidos.")
+MQTT_CALLBACK_SECONDS = REGISTRY.histogram("smart_home_mqtt_callback_seconds", "Duración del callback de procesamiento de mensajes MQTT.")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -38,8 +43,11 @@ class MQTTClient:
 
     def _on_message(self, client, userdata, msg):
         # logging.info(f"Mensaje recibido: Tópico='{msg.topic}', Payload='{msg.payload.decode()}'")
+        MQTT_MESSAGES_TOTAL.inc()
         if self.message_callback:
+            started = time.perf_counter()
             self.message_callback(msg.topic, msg.payload.decode())
+            MQTT_CALLBACK_SECONDS.observe(time.perf_counter() - started)
 
     def connect(self):
         try:
@@ -1,26 +1,92 @@
 import json
 import logging
-import requests
 import asyncio
-from sentence_transformers import SentenceTransformer
+import functools
+import time
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from core_logic.device_retriever import DeviceRetriever
+from core_logic.eviction import DEFAULT_HALF_LIFE_S, FrequencyEviction
+from core_logic.journal import MemoryJournal
+from core_logic.metrics import REGISTRY, TRACE_HEADER, current_trace_id, timed
+from core_logic.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, deadline_after, deadline_at, deadline_scope, remaining_budget
+from core_logic.singleflight import SingleFlight
+from core_logic.state_backend import InMemoryStateBackend
+from core_logic.stream_parser import StreamingFieldExtractor, find_string_field
+from core_logic.utils import normalize_text
 # NO IMPORTAR HomeAssistantAPI aquí para evitar importaciones circulares.
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash"
+
+COMMANDS_TOTAL = REGISTRY.counter("smart_home_commands_total", "Comandos procesados por camino de resolución.", ("path",))
+LLM_TTFT_SECONDS = REGISTRY.histogram("smart_home_llm_ttft_seconds", "Tiempo hasta el primer token de texto en streaming.")
+COMMAND_SECONDS = REGISTRY.histogram("smart_home_command_seconds", "Duración total de process_command por camino de resolución.", ("path",))
+SPECULATIVE_TOTAL = REGISTRY.counter("smart_home_speculative_resolutions_total",
+                                     "Resoluciones con conocimiento local y LLM en paralelo: ganador y si el LLM se lanzó antes de que terminara la búsqueda local.",
+                                     ("winner", "hedged"))
+
+# Errores que indican que Gemini no está disponible ahora mismo: se responde con el camino local
+LLM_UNAVAILABLE_ERRORS = (CircuitOpenError, DeadlineExceeded, asyncio.TimeoutError)
+
+DEFAULT_SESSION = "default" # Sesión de los clientes que no envían identificador
+PENDING_INTERACTION_TTL_S = 3600 # Una interacción no confirmada en este tiempo se descarta
+MEMORY_STAT_FIELDS = ("priority", "hits", "last_hit") # Estadísticas de uso guardadas sólo en las instantáneas
+MEMORY_LOG_COMPACT_MIN = 1000 # Registros de memoria compartida aplicados antes de resumirlos en una instantánea
+
+async def _no_embedding(text):
+    return None
+
 class RedNeuronal:
-    def __init__(self, ml_server_ip: str, gemini_api_key: str, home_assistant_api): 
+    def __init__(self, ml_server_ip: str, gemini_api_key: str, home_assistant_api, gemini_api_base: str = GEMINI_API_BASE, ml_server_port: int = 5001, knowledge_manager=None, request_deadline_s: float = 20.0, device_top_k: int = 25, state_backend=None, embedding_engine=None, memory_capacity=None, memory_half_life_s=DEFAULT_HALF_LIFE_S, llm_hedge_delay_s=0.1): 
         self.ml_server_ip = ml_server_ip
+        self.ml_server_port = ml_server_port
         self.gemini_api_key = gemini_api_key
+        self.gemini_api_base = gemini_api_base or GEMINI_API_BASE
         self.home_assistant_api = home_assistant_api 
+        self.knowledge_manager = knowledge_manager # Conocimiento general/aprendido con embeddings (opcional)
+        self.embedding_engine = embedding_engine # Motor de embeddings en proceso; None = ML Server remoto
+        self.request_deadline_s = request_deadline_s # Plazo total de cada comando, repartido entre sus etapas
+        # Si la búsqueda en el conocimiento local no termina en este tiempo, se lanza también la llamada
+        # al LLM y gana el primero con una respuesta válida (None = en serie, el LLM sólo tras la búsqueda local)
+        self.llm_hedge_delay_s = llm_hedge_delay_s
+        # Interacciones pendientes de confirmar (por sesión) y memoria; compartidas entre réplicas si el backend lo es
+        self.state_backend = state_backend or InMemoryStateBackend()
+        self.memory_sync_interval = 1.0 # Segundos entre consultas de memoria nueva de otras réplicas
+        self._memory_seq = 0 # Último registro de memoria compartida aplicado
+        self._memory_synced_at = 0.0
+        self._memory_log_length = 0 # Registros aplicados desde la última instantánea del registro compartido
+        # Un backend compartido (SQLite) puede esperar hasta busy_timeout al cerrojo de otra réplica:
+        # sus llamadas desde el bucle de eventos se hacen en este hilo (ver _off_loop)
+        self._state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-backend") if self.state_backend.shared else None
+
+        # Cortacircuitos: con el servicio caído las llamadas fallan al instante en lugar de agotar el timeout
+        self.ml_breaker = CircuitBreaker("ml_server")
+        self.gemini_breaker = CircuitBreaker("gemini")
+        # Sólo las entidades relevantes para cada comando van al prompt (device_top_k = 0: todas)
+        self.device_retriever = DeviceRetriever(home_assistant_api, self.get_embeddings, top_k=device_top_k)
+
+        self.http_client = None # Cliente HTTP compartido; vive en el bucle de eventos de la aplicación
+        self.embedding_flight = SingleFlight("embedding") # Coalescencia de peticiones al ML Server
+        self.llm_flight = SingleFlight("llm") # Coalescencia de peticiones a Gemini
+        REGISTRY.gauge("smart_home_coalesced_requests", "Peticiones duplicadas que reutilizaron una llamada en curso.",
+                       lambda: {(name,): stats["coalesced"] for name, stats in self.get_coalescing_stats().items()}, ("upstream",))
+        REGISTRY.gauge("smart_home_memory_entries", "Entradas en la memoria conversacional.", lambda: len(self.memory))
 
         self.memory = []
+        # Capacidad de la memoria: al superarla se expulsan las entradas menos usadas (LFU con envejecimiento)
+        self.memory_policy = FrequencyEviction("memory", memory_capacity, memory_half_life_s)
+        self.memory_journal = MemoryJournal('./knowledge/network_state.json', snapshot_provider=self._memory_snapshot)
         self.load_memory()
-        self.last_interaction = None 
 
     def load_memory(self):
+        if self.state_backend.shared:
+            self._load_shared_memory()
+            return
         try:
-            with open('./knowledge/network_state.json', 'r') as f:
-                self.memory = json.load(f)
+            self.memory = self.memory_journal.load()
+            self.memory_journal.open()
             logging.info(f"Memoria cargada desde './knowledge/network_state.json'. {len(self.memory)} entradas.")
         except FileNotFoundError:
             logging.warning("Archivo 'network_state.json' no encontrado. La memoria de la IA está vacía.")
@@ -28,56 +94,630 @@ class RedNeuronal:
         except json.JSONDecodeError:
             logging.error("Error al decodificar 'network_state.json'. La memoria de la IA está vacía.")
             self.memory = []
+        self.memory_policy.clear()
+        for entry in self.memory:
+            self._track_memory_entry(entry)
+        self._evict_memory() # La capacidad configurada puede ser menor que la memoria guardada
+
+    def _load_shared_memory(self):
+        """
+        Memoria en el backend compartido: un registro de solo-anexado con las mismas operaciones
+        que el diario local. La primera réplica que arranca importa la memoria del diario local.
+        """
+        if self.state_backend.set_if_absent("meta", "memory_imported", True):
+            try:
+                local_memory = self.memory_journal.load()
+            except (FileNotFoundError, json.JSONDecodeError):
+                local_memory = []
+            for entry in local_memory:
+                self.state_backend.append_log("memory", {"op": "append", "entry": entry})
+            logging.info(f"Memoria local importada al estado compartido: {len(local_memory)} entradas.")
+        self.memory = []
+        self.memory_policy.clear()
+        self.sync_memory(force=True)
+        self._evict_memory()
+        self.sync_memory(force=True)
+        logging.info(f"Memoria cargada desde el estado compartido. {len(self.memory)} entradas.")
+
+    async def _off_loop(self, function, *args, **kwargs):
+        """
+        Llama al backend de estado sin bloquear el bucle de eventos si es compartido; el de memoria es inmediato.
+        """
+        if self._state_executor is None:
+            return function(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._state_executor, functools.partial(function, *args, **kwargs))
+
+    def _memory_sync_due(self, force):
+        if not self.state_backend.shared:
+            return False
+        now = time.monotonic()
+        if not force and now - self._memory_synced_at < self.memory_sync_interval:
+            return False
+        self._memory_synced_at = now
+        return True
+
+    def sync_memory(self, force=False):
+        """
+        Aplica los cambios de memoria guardados por otras réplicas (como mucho una consulta cada memory_sync_interval).
+        Versión bloqueante, para el arranque y los hilos de Flask; desde el bucle, sync_memory_async.
+        """
+        if not self._memory_sync_due(force):
+            return
+        self._apply_memory_changes(*self.state_backend.read_log_snapshot("memory", self._memory_seq))
+        compaction = self._memory_compaction()
+        if compaction is not None:
+            self.state_backend.compact_log("memory", *compaction)
+
+    async def sync_memory_async(self, force=False):
+        if not self._memory_sync_due(force):
+            return
+        self._apply_memory_changes(*await self._off_loop(self.state_backend.read_log_snapshot, "memory", self._memory_seq))
+        compaction = self._memory_compaction()
+        if compaction is not None:
+            await self._off_loop(self.state_backend.compact_log, "memory", *compaction)
+
+    def _apply_memory_changes(self, snapshot, records):
+        """
+        Aplica la instantánea (si otra réplica compactó registros que ésta no había leído) y los registros nuevos.
+        """
+        if snapshot is not None and snapshot[0] > self._memory_seq:
+            self.memory = []
+            self.memory_policy.clear()
+            for entry in snapshot[1]:
+                entry = dict(entry)
+                self.memory.append(entry)
+                self._track_memory_entry(entry)
+            self._memory_seq = snapshot[0]
+            self._memory_log_length = 0
+        for seq, record in records:
+            if seq <= self._memory_seq:
+                continue # Ya aplicado por una sincronización concurrente
+            self._apply_memory_record(record)
+            self._memory_seq = seq
+            self._memory_log_length += 1
+
+    def _memory_compaction(self):
+        """
+        (secuencia, instantánea) si el registro compartido ya es bastante más largo que la memoria, o None.
+        Sin compactar, cada arranque repetiría todas las altas y expulsiones desde el principio.
+        """
+        if self._memory_log_length < max(MEMORY_LOG_COMPACT_MIN, 2 * len(self.memory)):
+            return None
+        self._memory_log_length = 0
+        return self._memory_seq, self._memory_snapshot()
+
+    def _track_memory_entry(self, entry):
+        # Las estadísticas de uso de la instantánea pasan a la política y se quitan de la entrada
+        stats = {field: entry.pop(field) for field in MEMORY_STAT_FIELDS if field in entry}
+        self.memory_policy.add(entry["command"].lower(), pinned=bool(entry.get("pinned")), added_at=entry.get("saved_at"), **stats)
+
+    def _apply_memory_record(self, record):
+        """
+        Aplica un registro de memoria (diario local o registro compartido) a la lista y a la política de expulsión.
+        """
+        MemoryJournal._apply(self.memory, record)
+        op = record.get("op")
+        if op == "append":
+            self._track_memory_entry(record["entry"])
+        elif op == "remove":
+            self.memory_policy.remove(record["command"])
+        elif op == "pin":
+            self.memory_policy.set_pinned(record["command"], record["pinned"])
+        elif op == "clear":
+            self.memory_policy.clear()
+
+    def _record_memory_change(self, op, **data):
+        """
+        Anexa un cambio de memoria: al registro compartido (se aplica en el siguiente sync_memory) o al diario local.
+        """
+        if self.state_backend.shared:
+            self.state_backend.append_log("memory", {"op": op, **data})
+            return
+        self._apply_memory_record({"op": op, **data})
+        try:
+            self.memory_journal.append(op, **data)
+        except Exception as e:
+            logging.error(f"Error al guardar el cambio '{op}' en el diario de memoria: {e}")
+
+    async def _record_memory_change_async(self, op, **data):
+        if self.state_backend.shared:
+            await self._off_loop(self.state_backend.append_log, "memory", {"op": op, **data})
+        else:
+            self._record_memory_change(op, **data)
+
+    def _evict_memory(self):
+        evicted = self.memory_policy.evict()
+        for key in evicted:
+            self._record_memory_change("remove", command=key)
+        if evicted:
+            logging.info(f"Memoria llena: {len(evicted)} entradas poco usadas expulsadas.")
+        return evicted
+
+    async def _evict_memory_async(self):
+        evicted = self.memory_policy.evict()
+        for key in evicted:
+            await self._record_memory_change_async("remove", command=key)
+        if evicted:
+            logging.info(f"Memoria llena: {len(evicted)} entradas poco usadas expulsadas.")
+        return evicted
+
+    def _memory_snapshot(self):
+        # Los aciertos no se anotan en el diario (uno por consulta); se guardan con cada instantánea
+        snapshot = []
+        for entry in list(self.memory):
+            stats = self.memory_policy.export(entry["command"].lower()) or {}
+            snapshot.append({**entry, **{field: stats[field] for field in MEMORY_STAT_FIELDS if field in stats}})
+        return snapshot
+
+    def pin_memory(self, command, pinned=True):
+        """
+        Fija (o libera) una entrada de memoria: las fijadas nunca se expulsan.
+        :return: False si el comando no está en la memoria.
+        """
+        self.sync_memory(force=True)
+        key = command.lower()
+        if key not in self.memory_policy:
+            return False
+        self._record_memory_change("pin", command=key, pinned=bool(pinned))
+        self.sync_memory(force=True)
+        return True
+
+    def get_memory_stats(self, top=10):
+        return self.memory_policy.stats(top)
 
     def save_memory(self):
+        """
+        Compacta la memoria completa en la instantánea. Guardar una interacción no lo
+        necesita: basta con anexarla al diario (ver save_last_interaction).
+        """
+        if self.state_backend.shared:
+            return # El backend compartido ya persiste cada cambio
         try:
-            with open('./knowledge/network_state.json', 'w') as f:
-                json.dump(self.memory, f, indent=4)
+            self.memory_journal.compact(wait=True)
             logging.info("Memoria guardada en 'network_state.json'.")
         except Exception as e:
             logging.error(f"Error al guardar la memoria: {e}")
 
+    async def start(self):
+        """
+        Crea el cliente HTTP compartido (ML Server y Gemini) en el bucle de eventos actual.
+        Debe llamarse desde el bucle de la aplicación, que lo mantiene durante toda la vida del proceso.
+        """
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+
+    async def aclose(self):
+        if self.embedding_engine is not None:
+            self.embedding_engine.close()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+        self.memory_journal.close()
+        if self._state_executor is not None:
+            self._state_executor.shutdown(wait=True)
+
     async def get_embedding(self, text: str):
-        url = f"http://{self.ml_server_ip}:5001/get_embedding"
+        """
+        Obtiene el embedding de un texto desde el ML Server.
+        Las peticiones concurrentes con el mismo texto normalizado comparten una sola llamada.
+        """
+        key = " ".join(normalize_text(text).split())
+        return await self.embedding_flight.do(key, lambda: self._fetch_embedding(text))
+
+    async def _post_json(self, url, payload, timeout, headers=None):
+        """
+        POST con un límite de tiempo total (no sólo por operación de red); los errores HTTP se lanzan.
+        """
+        await self.start()
+        response = await asyncio.wait_for(self.http_client.post(url, json=payload, headers=headers, timeout=timeout), timeout)
+        response.raise_for_status()
+        return response
+
+    async def _fetch_embedding(self, text: str):
+        if self.embedding_engine is not None:
+            return await self._local_embedding(text)
+        url = f"http://{self.ml_server_ip}:{self.ml_server_port}/get_embedding"
+        headers = {TRACE_HEADER: current_trace_id.get()} if current_trace_id.get() else None
         try:
-            response = requests.post(url, json={"text": text}, timeout=10)
-            response.raise_for_status() 
+            budget = remaining_budget(10)
+            with timed("embedding"):
+                response = await self.ml_breaker.call(lambda: self._post_json(url, {"text": text}, budget, headers))
             embedding = response.json().get("embedding")
             if embedding:
                 return embedding
             else:
                 logging.error("ML Server no devolvió un embedding válido.")
                 return None
-        except requests.exceptions.ConnectionError as e:
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logging.warning(f"Embedding no solicitado: {e}")
+            raise
+        except httpx.ConnectError as e:
             logging.error(f"Error de conexión con ML Server: {e}")
             raise 
-        except requests.exceptions.Timeout:
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             logging.error("Tiempo de espera agotado al conectar con ML Server.")
             raise
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logging.error(f"Error al solicitar embedding al ML Server: {e}")
             raise
         except Exception as e:
             logging.error(f"Error inesperado en get_embedding: {e}")
             raise
 
-    async def process_command(self, command: str):
-        for entry in self.memory:
-            if entry["command"].lower() == command.lower():
-                self.last_interaction = {"command": command, "response": entry["response"]}
-                return {"action_type": "text_response", "response_text": entry["response"]}
+    async def _local_embedding(self, text):
+        """
+        Embedding con el motor en proceso, sin salto HTTP; respeta el plazo de la petición.
+        """
+        try:
+            with timed("embedding"):
+                return await asyncio.wait_for(self.embedding_engine.embed(text), remaining_budget(10))
+        except DeadlineExceeded as e:
+            logging.warning(f"Embedding no solicitado: {e}")
+            raise
+        except asyncio.TimeoutError:
+            logging.error("Tiempo de espera agotado al calcular el embedding en proceso.")
+            raise
+        except Exception as e:
+            logging.error(f"Error al calcular el embedding en proceso: {e}")
+            raise
 
-        logging.info("No se encontró respuesta en memoria local. Consultando LLM...")
-        
-        discovered_devices = self.home_assistant_api.ha_entity_info 
+    async def get_embeddings(self, texts):
+        """
+        Obtiene los embeddings de varios textos en una sola llamada al ML Server (/get_embeddings)
+        o en un único 'encode' del motor en proceso.
+        """
+        if self.embedding_engine is not None:
+            with timed("embedding_batch"):
+                return await self.embedding_engine.embed_batch(texts)
+        url = f"http://{self.ml_server_ip}:{self.ml_server_port}/get_embeddings"
+        headers = {TRACE_HEADER: current_trace_id.get()} if current_trace_id.get() else None
+        try:
+            with timed("embedding_batch"):
+                response = await self.ml_breaker.call(lambda: self._post_json(url, {"texts": list(texts)}, 60, headers))
+            return response.json().get("embeddings") or []
+        except httpx.HTTPError as e:
+            logging.error(f"Error al solicitar embeddings en lote al ML Server: {e}")
+            raise
+
+    def get_breaker_stats(self):
+        return {"ml_server": self.ml_breaker.stats(), "gemini": self.gemini_breaker.stats()}
+
+    def get_coalescing_stats(self):
+        return {"embedding": self.embedding_flight.stats(), "llm": self.llm_flight.stats()}
+
+    def _text_response(self, command, response_text):
+        return {"action_type": "text_response", "response_text": response_text}
+
+    async def _set_pending_interaction(self, session_id, command, response):
+        """
+        Guarda la última interacción de la sesión hasta que el usuario la confirme o la descarte.
+        """
+        if response.get("action_type") == "text_response":
+            await self._off_loop(self.state_backend.set, "pending_interactions", session_id or DEFAULT_SESSION,
+                                 {"command": command, "response": response["response_text"]}, ttl=PENDING_INTERACTION_TTL_S)
+
+    def has_pending_interaction(self, session_id=DEFAULT_SESSION):
+        return self.state_backend.get("pending_interactions", session_id or DEFAULT_SESSION) is not None
+
+    def _find_in_memory(self, command):
+        with timed("memory_scan"):
+            command_lower = command.lower()
+            for entry in self.memory:
+                if entry["command"].lower() == command_lower:
+                    self.memory_policy.hit(command_lower)
+                    return entry["response"]
+        return None
+
+    def _match_keywords(self, command):
+        """
+        Prefiltro de palabras clave (fuera de alcance / auto-descripción) sin embeddings ni LLM.
+        :return: Tupla (tipo, respuesta) o None.
+        """
+        if self.knowledge_manager is None:
+            return None
+        with timed("keyword_match"):
+            return self.knowledge_manager.match_keywords(command)
+
+    async def _find_in_knowledge(self, command):
+        """
+        Consulta el conocimiento general/aprendido (índice léxico + re-ranking por embeddings).
+        :return: Tupla (respuesta, origen, puntuación) o None.
+        """
+        if self.knowledge_manager is None:
+            return None
+        try:
+            with timed("knowledge_lookup"):
+                return await self.knowledge_manager.find_response(command, self.get_embedding)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logging.warning(f"Conocimiento local sin re-ranking por embeddings: {e}")
+            return None
+        except Exception as e:
+            logging.error(f"Error al consultar el conocimiento local: {e}")
+            return None
+
+    async def _local_fallback(self, command, reason):
+        """
+        Respuesta cuando Gemini no está disponible (circuito abierto o plazo agotado): el mejor
+        candidato del conocimiento local aunque no sea una coincidencia clara, sin pedir embeddings.
+        """
+        logging.warning(f"Gemini no disponible ({reason}). Usando el camino local.")
+        if self.knowledge_manager is not None:
+            match = await self.knowledge_manager.find_response(command, _no_embedding, strong_coverage=0.5)
+            if match is not None:
+                return self._text_response(command, match[0])
+        return self._text_response(command, "La IA externa no está disponible en este momento. Inténtalo de nuevo en unos segundos.")
+
+    async def _resolve_speculative(self, command, llm_factory, discard_llm=None):
+        """
+        Coordina la búsqueda en el conocimiento local (léxica + similitud de embeddings) y el LLM.
+
+        La búsqueda local empieza ya; el LLM empieza cuando la búsqueda local termina sin respuesta
+        o, si tarda más de llm_hedge_delay_s, en paralelo con ella. Gana la primera respuesta válida:
+        una coincidencia local (find_response ya aplica los umbrales de confianza) o un resultado del
+        LLM sin error; la otra tarea se cancela. Un error del LLM sólo cuenta si tampoco hay respuesta local.
+        La tarea del LLM no tiene efectos: los comandos se ejecutan después, sólo si el LLM gana.
+        :param llm_factory: Función comando -> corrutina de la llamada al LLM.
+        :param discard_llm: Función que libera el resultado del LLM si terminó pero ganó el conocimiento local.
+        :return: ("knowledge", (respuesta, origen, puntuación)) o ("llm", tarea terminada del LLM).
+        """
+        loop = asyncio.get_running_loop()
+        hedge_at = None if self.llm_hedge_delay_s is None else loop.time() + self.llm_hedge_delay_s
+        knowledge = asyncio.ensure_future(self._find_in_knowledge(command))
+        llm = None
+        hedged = "false"
+        winner = None
+        try:
+            await asyncio.sleep(0) # La parte léxica es síncrona: una coincidencia clara termina en el primer paso
+            while True:
+                if knowledge.done() and knowledge.result() is not None:
+                    winner = "knowledge"
+                    SPECULATIVE_TOTAL.inc(winner=winner, hedged=hedged)
+                    return winner, knowledge.result()
+                if llm is None and (knowledge.done() or (hedge_at is not None and loop.time() >= hedge_at)):
+                    if not knowledge.done():
+                        hedged = "true"
+                        logging.info("Búsqueda local lenta: consultando también el LLM en paralelo.")
+                    llm = asyncio.ensure_future(llm_factory(command))
+                if llm is not None and llm.done() and (knowledge.done() or llm.exception() is None):
+                    winner = "llm"
+                    SPECULATIVE_TOTAL.inc(winner=winner, hedged=hedged)
+                    return winner, llm
+                waiting = [task for task in (knowledge, llm) if task is not None and not task.done()]
+                timeout = max(0.0, hedge_at - loop.time()) if llm is None and hedge_at is not None else None
+                await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (knowledge, llm):
+                if task is not None and not task.done():
+                    task.cancel()
+            if winner != "llm" and llm is not None and llm.done() and not llm.cancelled():
+                # Resultado (o error) del LLM que perdió la carrera
+                if llm.exception() is None and discard_llm is not None:
+                    discard_llm(llm.result())
+
+    async def _build_llm_request(self, command):
+        """
+        Selecciona los dispositivos relevantes y construye el cuerpo de la petición a Gemini.
+        :return: Tupla (payload, lista de dispositivos en texto).
+        """
+        devices = await self.device_retriever.select(command, self.get_embedding)
+        with timed("prompt_build"):
+            device_list_str = self._build_device_list(devices)
+            return self._build_llm_payload(command, device_list_str), device_list_str
+
+    async def _request_llm(self, command):
+        logging.info("Consultando LLM...")
+        payload, device_list_str = await self._build_llm_request(command)
+        # Los comandos idénticos en curso (misma lista de dispositivos) comparten la llamada a Gemini
+        flight_key = (" ".join(normalize_text(command).split()), hash(device_list_str))
+        return await self.llm_flight.do(flight_key, lambda: self._call_gemini(payload))
+
+    async def _open_llm_stream(self, command):
+        """
+        Lanza el streaming de Gemini en una tarea propia y espera al primer fragmento, de modo que
+        la coordinación especulativa pueda cancelarlo si gana el conocimiento local.
+        :return: Tupla (primer fragmento, cola con los siguientes, tarea); la cola termina con None
+                 y un error del streaming llega por la cola como excepción.
+        """
+        logging.info("Consultando LLM en streaming...")
+        payload, _ = await self._build_llm_request(command)
+        queue = asyncio.Queue()
+        pump = asyncio.ensure_future(self._pump_llm_stream(payload, queue))
+        try:
+            first = await queue.get()
+        except BaseException:
+            pump.cancel()
+            raise
+        if isinstance(first, Exception):
+            raise first
+        return first, queue, pump
+
+    async def _pump_llm_stream(self, payload, queue):
+        try:
+            async for chunk in self._stream_gemini(payload):
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        queue.put_nowait(None)
+
+    async def process_command(self, command: str, session_id: str = DEFAULT_SESSION):
+        """
+        Procesa un comando dentro del plazo total de la petición (request_deadline_s).
+        La respuesta queda pendiente de confirmación en la sesión 'session_id'.
+        """
+        with deadline_scope(self.request_deadline_s):
+            response = await self._process_command(command)
+        await self._set_pending_interaction(session_id, command, response)
+        return response
+
+    async def _process_command(self, command: str):
+        started = time.perf_counter()
+        path = "memory"
+        try:
+            await self.sync_memory_async()
+            memory_response = self._find_in_memory(command)
+            if memory_response is not None:
+                return self._text_response(command, memory_response)
+
+            keyword_match = self._match_keywords(command)
+            if keyword_match is not None:
+                path = f"keyword_{keyword_match[0]}"
+                return self._text_response(command, keyword_match[1])
+
+            winner, outcome = await self._resolve_speculative(command, self._request_llm)
+            if winner == "knowledge":
+                path = f"knowledge_{outcome[1]}"
+                return self._text_response(command, outcome[0])
+
+            path = "llm"
+            try:
+                return self._handle_llm_result(command, outcome.result())
+            except LLM_UNAVAILABLE_ERRORS as e:
+                path = "llm_unavailable"
+                return await self._local_fallback(command, str(e) or "tiempo de espera agotado")
+            except httpx.HTTPError as e:
+                path = "llm_error"
+                logging.error(f"Error al conectar con la API de Gemini: {e}")
+                return self._text_response(command, "No se pudo establecer conexión con la IA. Por favor, verifica tu conexión a internet o la clave de API.")
+            except Exception as e:
+                path = "llm_error"
+                logging.error(f"Error inesperado al procesar comando con Gemini: {e}")
+                return self._text_response(command, "Ocurrió un error inesperado al procesar tu comando.")
+        finally:
+            COMMANDS_TOTAL.inc(path=path)
+            COMMAND_SECONDS.observe(time.perf_counter() - started, path=path)
+
+    async def process_command_stream(self, command: str, session_id: str = DEFAULT_SESSION):
+        """
+        Variante en streaming de process_command. Genera eventos:
+          {"type": "delta", "text": "..."} con texto parcial de las respuestas 'text_response', y
+          {"type": "final", "action_type": ..., "response_text": ..., "ttft_ms": ...} al terminar.
+        Los 'ha_command' sólo se ejecutan cuando el JSON estructurado está completo.
+        """
+        # Cada paso del generador puede correr en otra tarea (iterate_on_app_loop): el plazo absoluto
+        # se calcula una vez y se vuelve a fijar alrededor de cada paso del generador interno
+        deadline = deadline_after(self.request_deadline_s)
+        events = self._process_command_stream(command)
+        try:
+            while True:
+                with deadline_at(deadline):
+                    try:
+                        event = await events.__anext__()
+                    except StopAsyncIteration:
+                        return
+                if event["type"] == "final":
+                    await self._set_pending_interaction(session_id, command, event)
+                yield event
+        finally:
+            with deadline_at(deadline):
+                await events.aclose()
+
+    async def _process_command_stream(self, command: str):
+        started = time.perf_counter()
+        await self.sync_memory_async()
+        memory_response = self._find_in_memory(command)
+        if memory_response is not None:
+            COMMANDS_TOTAL.inc(path="memory")
+            yield {"type": "final", **self._text_response(command, memory_response), "ttft_ms": 0.0}
+            return
+        keyword_match = self._match_keywords(command)
+        if keyword_match is not None:
+            COMMANDS_TOTAL.inc(path=f"keyword_{keyword_match[0]}")
+            total_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield {"type": "final", **self._text_response(command, keyword_match[1]), "ttft_ms": total_ms, "total_ms": total_ms}
+            return
+        winner, outcome = await self._resolve_speculative(command, self._open_llm_stream, discard_llm=lambda opened: opened[2].cancel())
+        if winner == "knowledge":
+            COMMANDS_TOTAL.inc(path=f"knowledge_{outcome[1]}")
+            total_ms = round((time.perf_counter() - started) * 1000, 1)
+            yield {"type": "final", **self._text_response(command, outcome[0]), "ttft_ms": total_ms, "total_ms": total_ms}
+            return
+
+        COMMANDS_TOTAL.inc(path="llm_stream")
+        extractor = StreamingFieldExtractor("response_text")
+        ttft_ms = None
+        pump = None
+
+        try:
+            chunk, queue, pump = outcome.result()
+            while chunk is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                delta = extractor.feed(chunk)
+                # El texto parcial sólo se reenvía cuando se sabe que es una respuesta de texto
+                if delta and find_string_field(extractor.buffer, "action_type") == "text_response":
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        logging.info(f"Tiempo hasta el primer token (TTFT): {ttft_ms:.1f} ms")
+                        LLM_TTFT_SECONDS.observe(ttft_ms / 1000)
+                    yield {"type": "delta", "text": delta}
+                chunk = await queue.get()
+            result = {"candidates": [{"content": {"parts": [{"text": extractor.buffer}]}}]} if extractor.buffer else {}
+            response = self._handle_llm_result(command, result)
+        except LLM_UNAVAILABLE_ERRORS as e:
+            response = await self._local_fallback(command, str(e) or "tiempo de espera agotado")
+        except httpx.HTTPError as e:
+            logging.error(f"Error al conectar con la API de Gemini (streaming): {e}")
+            response = self._text_response(command, "No se pudo establecer conexión con la IA. Por favor, verifica tu conexión a internet o la clave de API.")
+        except Exception as e:
+            logging.error(f"Error inesperado al procesar comando con Gemini (streaming): {e}")
+            response = self._text_response(command, "Ocurrió un error inesperado al procesar tu comando.")
+        finally:
+            if pump is not None:
+                pump.cancel() # El cliente dejó de leer antes del final
+
+        total_ms = (time.perf_counter() - started) * 1000
+        yield {"type": "final", **response, "ttft_ms": round(ttft_ms if ttft_ms is not None else total_ms, 1), "total_ms": round(total_ms, 1)}
+
+    async def _stream_gemini(self, payload):
+        """
+        Llama al endpoint de streaming de Gemini (Server-Sent Events) y genera los fragmentos de texto.
+        """
+        api_url = f"{self.gemini_api_base}:streamGenerateContent?alt=sse&key={self.gemini_api_key}"
+        await self.start()
+        budget = remaining_budget(30)
+        if not self.gemini_breaker.allow():
+            raise CircuitOpenError("Circuito 'gemini' abierto.")
+        try:
+            async with self.http_client.stream('POST', api_url, headers={'Content-Type': 'application/json'}, json=payload, timeout=budget) as response:
+                response.raise_for_status()
+                lines = response.aiter_lines()
+                while True:
+                    try:
+                        # Cada fragmento debe llegar dentro de lo que queda del plazo
+                        line = await asyncio.wait_for(lines.__anext__(), remaining_budget(30))
+                    except StopAsyncIteration:
+                        break
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[5:])
+                    for candidate in event.get("candidates", [])[:1]:
+                        for part in candidate.get("content", {}).get("parts", []):
+                            if part.get("text"):
+                                yield part["text"]
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            self.gemini_breaker.record_failure()
+            raise
+        except BaseException: # Plazo agotado, cancelación o consumidor que deja de leer
+            self.gemini_breaker.release()
+            raise
+        self.gemini_breaker.record_success()
+
+    def _build_device_list(self, discovered_devices=None):
+        if discovered_devices is None:
+            discovered_devices = self.home_assistant_api.ha_entity_info 
         device_list_str = ""
         if discovered_devices:
             device_list_str = "Dispositivos disponibles:\n"
             for entity_id, info in discovered_devices.items():
-                device_list_str += f"- {info['name']} (ID: {entity_id}, Dominio: {info['domain']})\n"
+                device_list_str += f"- {info['name']} (ID: {entity_id}, Dominio: {info['domain']})"
+                telemetry = self.home_assistant_api.telemetry_summary(entity_id, info)
+                device_list_str += f" [Telemetría: {telemetry}]\n" if telemetry else "\n"
         else:
             device_list_str = "No se han descubierto dispositivos MQTT."
+        return device_list_str
 
+    def _build_llm_payload(self, command, device_list_str):
         ha_command_example_on = json.dumps({"action_type": "ha_command", "command": {"domain": "light", "service": "turn_on", "entity_id": "light.sala_de_estar", "payload": "{}"}})
         ha_command_example_off = json.dumps({"action_type": "ha_command", "command": {"domain": "fan", "service": "turn_off", "entity_id": "fan.dormitorio", "payload": "{}"}})
         text_response_example = json.dumps({"action_type": "text_response", "response_text": "La hora actual es..."})
@@ -111,6 +751,7 @@ class RedNeuronal:
         - Para preguntar la hora: {text_response_example}
 
         Considera los nombres amigables de los dispositivos para mapearlos a sus entity_id.
+        Algunos dispositivos incluyen su telemetría reciente (p. ej. POWER, LoadAvg, Wifi.RSSI); úsala para responder preguntas sobre su estado.
         Si el usuario pide algo que no puedes hacer o no entiendes, responde con un mensaje de texto indicando que no puedes realizar esa acción.
 
         Comando del usuario: {command}
@@ -147,103 +788,102 @@ class RedNeuronal:
         }
 
         logging.info(f"Enviando prompt estructurado a Gemini: '{prompt[:100]}...' con esquema: {response_schema}")
+        return payload
 
-        try:
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={self.gemini_api_key}"
-            response = await asyncio.to_thread(
-                requests.post, api_url, headers={'Content-Type': 'application/json'}, json=payload, timeout=30
+    async def _call_gemini(self, payload):
+        api_url = f"{self.gemini_api_base}:generateContent?key={self.gemini_api_key}"
+        budget = remaining_budget(30)
+        with timed("llm_call"):
+            response = await self.gemini_breaker.call(
+                lambda: self._post_json(api_url, payload, budget, headers={'Content-Type': 'application/json'})
             )
-            response.raise_for_status()
-            result = response.json()
-            logging.info(f"HTTP Request: POST {api_url} \"HTTP/1.1 {response.status_code} {response.reason}\"")
-
-            if result.get("candidates") and result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts"):
-                json_response_str = result["candidates"][0]["content"]["parts"][0]["text"]
-                logging.info(f"Respuesta estructurada de Gemini recibida: {json_response_str}")
-                
-                try:
-                    parsed_response = json.loads(json_response_str)
-                    
-                    if parsed_response.get("action_type") == "ha_command":
-                        cmd = parsed_response.get("command")
-                        if cmd and all(k in cmd for k in ["domain", "service", "entity_id"]):
-                            domain = cmd["domain"]
-                            service = cmd["service"]
-                            entity_id = cmd["entity_id"]
-                            payload_str = cmd.get("payload", "{}")
-                            try:
-                                payload = json.loads(payload_str if payload_str.strip() else "{}")
-                            except json.JSONDecodeError:
-                                logging.warning(f"Payload de Gemini no es un JSON válido: '{payload_str}'. Usando payload vacío.")
-                                payload = {}
-                            
-                            # --- Lógica de enrutamiento de comandos ---
-                            success, message = False, "Comando no ejecutado."
-                            
-                            # Verificar si la entidad es un dispositivo Tasmota nativo descubierto por nuestra app
-                            # y si el servicio es turn_on o turn_off
-                            if entity_id in self.home_assistant_api.ha_entity_info and \
-                                self.home_assistant_api.ha_entity_info[entity_id].get('command_topic') and \
-                                (service == "turn_on" or service == "turn_off"):
-                                
-                                tasmota_state = "ON" if service == "turn_on" else "OFF"
-                                success, message = self.home_assistant_api.send_tasmota_command(entity_id, tasmota_state)
-                            
-                            # Si no es Tasmota o el comando Tasmota falló/no aplica, intentar como comando HA de servicio
-                            if not success:
-                                success, message = self.home_assistant_api.send_ha_command(domain, service, entity_id, payload)
-                            # --- Fin de lógica de enrutamiento ---
-
-                            if success:
-                                self.last_interaction = {"command": command, "response": message}
-                                return {"action_type": "text_response", "response_text": message}
-                            else:
-                                self.last_interaction = {"command": command, "response": f"Error al ejecutar comando: {message}"}
-                                return {"action_type": "text_response", "response_text": f"Error al ejecutar comando: {message}"}
-                        else:
-                            logging.error(f"Comando HA incompleto o inválido de Gemini: {parsed_response}")
-                            response_text = "La IA generó un comando incompleto o inválido."
-                            self.last_interaction = {"command": command, "response": response_text}
-                            return {"action_type": "text_response", "response_text": response_text}
-                    
-                    elif parsed_response.get("action_type") == "text_response":
-                        response_text = parsed_response.get("response_text", "No pude generar una respuesta de texto.")
-                        self.last_interaction = {"command": command, "response": response_text}
-                        return {"action_type": "text_response", "response_text": response_text}
-                    
-                    else:
-                        logging.error(f"Tipo de acción desconocido de Gemini: {parsed_response}")
-                        response_text = "La IA generó un tipo de acción desconocido."
-                        self.last_interaction = {"command": command, "response": response_text}
-                        return {"action_type": "text_response", "response_text": response_text}
-
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error al parsear la respuesta JSON de Gemini: {e} - Respuesta: {json_response_str}")
-                    response_text = "La IA generó una respuesta que no pude entender. Por favor, intenta de nuevo."
-                    self.last_interaction = {"command": command, "response": response_text}
-                    return {"action_type": "text_response", "response_text": response_text}
-            else:
-                logging.error(f"Respuesta de Gemini vacía o inesperada: {result}")
-                response_text = "No pude obtener una respuesta de la IA. Intenta de nuevo."
-                self.last_interaction = {"command": command, "response": response_text}
-                return {"action_type": "text_response", "response_text": response_text}
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error al conectar con la API de Gemini: {e}")
-            response_text = "No se pudo establecer conexión con la IA. Por favor, verifica tu conexión a internet o la clave de API."
-            self.last_interaction = {"command": command, "response": response_text}
-            return {"action_type": "text_response", "response_text": response_text}
-        except Exception as e:
-            logging.error(f"Error inesperado al procesar comando con Gemini: {e}")
-            response_text = "Ocurrió un error inesperado al procesar tu comando."
-            self.last_interaction = {"command": command, "response": response_text}
-            return {"action_type": "text_response", "response": response_text}
-
-    async def save_last_interaction(self):
-        if self.last_interaction:
-            self.memory.append(self.last_interaction)
-            self.save_memory()
-            self.last_interaction = None
-
-    def discard_last_interaction(self):
-        self.last_interaction = None
+        return response.json()
+
+    def _handle_llm_result(self, command, result):
+        if not (result.get("candidates") and result["candidates"][0].get("content") and result["candidates"][0]["content"].get("parts")):
+            logging.error(f"Respuesta de Gemini vacía o inesperada: {result}")
+            return self._text_response(command, "No pude obtener una respuesta de la IA. Intenta de nuevo.")
+
+        json_response_str = result["candidates"][0]["content"]["parts"][0]["text"]
+        logging.info(f"Respuesta estructurada de Gemini recibida: {json_response_str}")
+
+        try:
+            with timed("response_parse"):
+                parsed_response = json.loads(json_response_str)
+        except json.JSONDecodeError as e:
+            logging.error(f"Error al parsear la respuesta JSON de Gemini: {e} - Respuesta: {json_response_str}")
+            return self._text_response(command, "La IA generó una respuesta que no pude entender. Por favor, intenta de nuevo.")
+
+        if parsed_response.get("action_type") == "ha_command":
+            return self._execute_ha_command(command, parsed_response)
+
+        elif parsed_response.get("action_type") == "text_response":
+            return self._text_response(command, parsed_response.get("response_text", "No pude generar una respuesta de texto."))
+
+        else:
+            logging.error(f"Tipo de acción desconocido de Gemini: {parsed_response}")
+            return self._text_response(command, "La IA generó un tipo de acción desconocido.")
+
+    def _execute_ha_command(self, command, parsed_response):
+        cmd = parsed_response.get("command")
+        if not (cmd and all(k in cmd for k in ["domain", "service", "entity_id"])):
+            logging.error(f"Comando HA incompleto o inválido de Gemini: {parsed_response}")
+            return self._text_response(command, "La IA generó un comando incompleto o inválido.")
+
+        domain = cmd["domain"]
+        service = cmd["service"]
+        entity_id = self.home_assistant_api.resolve_entity_id(cmd["entity_id"], domain)
+        if entity_id is None:
+            logging.warning(f"Gemini devolvió una entidad inexistente: '{cmd['entity_id']}'.")
+            return self._text_response(command, f"No encontré ningún dispositivo que corresponda a '{cmd['entity_id']}'.")
+        if entity_id != cmd["entity_id"]:
+            logging.info(f"entity_id corregido: '{cmd['entity_id']}' -> '{entity_id}'.")
+        payload_str = cmd.get("payload", "{}")
+        try:
+            payload = json.loads(payload_str if payload_str.strip() else "{}")
+        except json.JSONDecodeError:
+            logging.warning(f"Payload de Gemini no es un JSON válido: '{payload_str}'. Usando payload vacío.")
+            payload = {}
+
+        # --- Lógica de enrutamiento de comandos ---
+        success, message = False, "Comando no ejecutado."
+
+        # Verificar si la entidad es un dispositivo Tasmota nativo descubierto por nuestra app
+        # y si el servicio es turn_on o turn_off
+        if entity_id in self.home_assistant_api.ha_entity_info and \
+            self.home_assistant_api.ha_entity_info[entity_id].get('command_topic') and \
+            (service == "turn_on" or service == "turn_off"):
+
+            tasmota_state = "ON" if service == "turn_on" else "OFF"
+            success, message = self.home_assistant_api.send_tasmota_command(entity_id, tasmota_state)
+
+        # Si no es Tasmota o el comando Tasmota falló/no aplica, intentar como comando HA de servicio
+        if not success:
+            success, message = self.home_assistant_api.send_ha_command(domain, service, entity_id, payload)
+        # --- Fin de lógica de enrutamiento ---
+
+        if success:
+            return self._text_response(command, message)
+        else:
+            return self._text_response(command, f"Error al ejecutar comando: {message}")
+
+    async def save_last_interaction(self, session_id=DEFAULT_SESSION):
+        interaction = await self._off_loop(self.state_backend.pop, "pending_interactions", session_id or DEFAULT_SESSION)
+        if not interaction:
+            return
+        # Con un backend compartido, las demás réplicas (y ésta) aplican los cambios desde el registro compartido
+        await self.sync_memory_async(force=True)
+        key = interaction["command"].lower()
+        interaction["saved_at"] = time.time()
+        previous = self.memory_policy.export(key)
+        if previous is not None:
+            # Misma pregunta con otra respuesta: se sustituye conservando si estaba fijada
+            interaction["pinned"] = previous["pinned"]
+            await self._record_memory_change_async("remove", command=key)
+        await self._record_memory_change_async("append", entry=interaction)
+        await self.sync_memory_async(force=True) # Con backend compartido, la entrada cuenta para la capacidad al leerla del registro
+        await self._evict_memory_async()
+        await self.sync_memory_async(force=True)
+
+    def discard_last_interaction(self, session_id=DEFAULT_SESSION):
+        self.state_backend.delete("pending_interactions", session_id or DEFAULT_SESSION)
@@ -0,0 +1,172 @@
+import collections
+import itertools
+import os
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo que se activa bajo demanda, sin reiniciar el servicio.
+
+    Un hilo muestreador lee periódicamente las pilas de los hilos de interés
+    (sys._current_frames) y las acumula en formato "collapsed stacks", listo para
+    flamegraph.pl o speedscope. Dos modos:
+      - ventana: muestrea todos los hilos durante N segundos;
+      - peticiones: muestrea sólo los hilos que atienden 1 de cada N peticiones.
+    Con el perfilador desactivado el coste por petición es una comparación con cero.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.sample_one_in = 0 # 0 = muestreo por petición desactivado
+        self.samples = 0
+
+        self._lock = threading.Lock()
+        self._stacks = collections.Counter()
+        self._window_until = 0.0
+        self._tracked = collections.Counter() # {id_de_hilo: peticiones muestreadas en curso}
+        self._request_counter = itertools.count()
+        self._thread = None
+
+    def start_window(self, seconds):
+        with self._lock:
+            self._window_until = time.monotonic() + seconds
+        self._ensure_sampler()
+
+    def enable_request_sampling(self, one_in):
+        self.sample_one_in = max(0, int(one_in))
+
+    def stop(self):
+        with self._lock:
+            self._window_until = 0.0
+        self.sample_one_in = 0
+
+    def control(self, data, max_window_s=600):
+        """
+        Aplica el cuerpo de POST /admin/profiler (main_app y ml_server): {"mode": "window", "seconds": N},
+        {"mode": "requests", "one_in": N} o {"mode": "off"}. Devuelve el modo aplicado.
+        Lanza ValueError con un mensaje para el cliente si el cuerpo o sus valores no son válidos.
+        """
+        data = data if isinstance(data, dict) else {}
+        mode = data.get("mode")
+        if mode == "window":
+            try:
+                seconds = float(data.get("seconds", 30))
+            except (TypeError, ValueError):
+                seconds = -1
+            if not 0 < seconds < float("inf"):
+                raise ValueError("'seconds' debe ser un número positivo.")
+            self.start_window(min(seconds, max_window_s))
+        elif mode == "requests":
+            try:
+                one_in = int(data.get("one_in", 100))
+            except (TypeError, ValueError, OverflowError):
+                one_in = -1
+            if one_in < 0:
+                raise ValueError("'one_in' debe ser un entero mayor o igual que 0.")
+            self.enable_request_sampling(one_in)
+        elif mode == "off":
+            self.stop()
+        else:
+            raise ValueError("Modo desconocido. Usa 'window', 'requests' u 'off'.")
+        return mode
+
+    def should_profile_request(self):
+        if not self.sample_one_in:
+            return False
+        return next(self._request_counter) % self.sample_one_in == 0
+
+    def track(self, thread_ids):
+        """
+        Context manager que muestrea los hilos indicados mientras dura la petición.
+        """
+        return _TrackedThreads(self, thread_ids)
+
+    def _add_tracked(self, thread_ids):
+        with self._lock:
+            self._tracked.update(thread_ids)
+        self._ensure_sampler()
+
+    def _remove_tracked(self, thread_ids):
+        with self._lock:
+            self._tracked.subtract(thread_ids)
+            self._tracked += collections.Counter() # Elimina los contadores a cero
+
+    def _ensure_sampler(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while True:
+            with self._lock:
+                window_active = time.monotonic() < self._window_until
+                tracked = set(self._tracked)
+                if not window_active and not tracked:
+                    self._thread = None
+                    return
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or not (window_active or thread_id in tracked):
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                self._record(names.get(thread_id, str(thread_id)), frame)
+            time.sleep(self.interval)
+
+    def _record(self, thread_name, frame):
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        parts.append(thread_name)
+        stack = ";".join(reversed(parts))
+        with self._lock:
+            self._stacks[stack] += 1
+            self.samples += 1
+
+    def collapsed(self, reset=False):
+        """
+        Devuelve las pilas agregadas en formato "collapsed": 'marco1;marco2;... conteo' por línea.
+        """
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def status(self):
+        with self._lock:
+            remaining = max(0.0, self._window_until - time.monotonic())
+            return {
+                "window_remaining_s": round(remaining, 1),
+                "sample_one_in": self.sample_one_in,
+                "tracked_threads": len(self._tracked),
+                "samples": self.samples,
+                "distinct_stacks": len(self._stacks)
+            }
+
+class _TrackedThreads:
+    __slots__ = ("profiler", "thread_ids")
+
+    def __init__(self, profiler, thread_ids):
+        self.profiler = profiler
+        self.thread_ids = [t for t in thread_ids if t is not None]
+
+    def __enter__(self):
+        self.profiler._add_tracked(self.thread_ids)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._remove_tracked(self.thread_ids)
+        return False
+
+# Perfilador global del proceso
+PROFILER = SamplingProfiler()
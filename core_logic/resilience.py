@@ -0,0 +1,173 @@
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Instante (time.monotonic) en que vence la petición en curso; None = sin plazo
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """
+    El plazo de la petición se agotó antes de empezar (o terminar) una etapa.
+    """
+
+class CircuitOpenError(Exception):
+    """
+    El circuito del servicio está abierto: la llamada se rechaza sin intentarla.
+    """
+
+def deadline_after(seconds):
+    """
+    Instante en que vence un plazo de 'seconds' abierto ahora (un plazo exterior más corto prevalece).
+    """
+    deadline = time.monotonic() + seconds
+    outer = current_deadline.get()
+    return deadline if outer is None else min(outer, deadline)
+
+@contextlib.contextmanager
+def deadline_at(deadline):
+    """
+    Fija el instante en que vence la petición en curso. Un ContextVar sólo se restaura en el contexto
+    donde se fijó: los generadores asíncronos cuyos pasos corren en tareas distintas lo fijan en cada paso.
+    """
+    token = current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+def deadline_scope(seconds):
+    """
+    Fija el plazo de la petición en curso si aún no tiene uno (un plazo exterior más corto prevalece).
+    """
+    return deadline_at(deadline_after(seconds))
+
+def remaining_budget(default):
+    """
+    Tiempo disponible para la siguiente etapa: el mínimo entre su timeout propio y lo que queda del plazo.
+    Lanza DeadlineExceeded si el plazo ya venció.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Plazo de la petición agotado.")
+    return min(default, remaining)
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+CIRCUIT_REJECTIONS_TOTAL = REGISTRY.counter("smart_home_circuit_rejections_total", "Llamadas rechazadas por un circuito abierto.", ("breaker",))
+CIRCUIT_TRANSITIONS_TOTAL = REGISTRY.counter("smart_home_circuit_transitions_total", "Cambios de estado de los circuitos.", ("breaker", "state"))
+
+class CircuitBreaker:
+    """
+    Cortacircuitos para un servicio remoto (ML Server, Gemini).
+
+    closed: las llamadas pasan; tras 'failure_threshold' fallos seguidos se abre.
+    open: las llamadas se rechazan al instante con CircuitOpenError durante 'reset_timeout' segundos.
+    half_open: pasa una única llamada de prueba; si funciona se cierra, si falla se vuelve a abrir.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejections = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        with CircuitBreaker._instances_lock:
+            CircuitBreaker._instances[name] = self
+
+    def allow(self):
+        """
+        Indica si se puede intentar la llamada (y reserva la llamada de prueba en half_open).
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejections += 1
+        CIRCUIT_REJECTIONS_TOTAL.inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+            if self.state != "closed":
+                self._transition("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._transition("open")
+
+    def release(self):
+        """
+        Libera la llamada de prueba sin contarla como éxito ni como fallo (p. ej. plazo agotado antes de llamar).
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _transition(self, state):
+        logging.warning(f"Circuito '{self.name}': {self.state} -> {state}.")
+        self.state = state
+        CIRCUIT_TRANSITIONS_TOTAL.inc(breaker=self.name, state=state)
+
+    async def call(self, coro_factory, failure_exceptions=(Exception,)):
+        """
+        Ejecuta la corrutina protegida por el circuito. DeadlineExceeded no cuenta como fallo del servicio.
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"Circuito '{self.name}' abierto.")
+        try:
+            result = await coro_factory()
+        except DeadlineExceeded:
+            self.release()
+            raise
+        except failure_exceptions:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release() # Cancelaciones u otros errores que no indican un fallo del servicio
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejections": self.rejections,
+                "retry_in_s": round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1) if self.state == "open" else 0.0
+            }
+
+    @classmethod
+    def all_stats(cls):
+        with cls._instances_lock:
+            return {name: breaker.stats() for name, breaker in cls._instances.items()}
+
+REGISTRY.gauge(
+    "smart_home_circuit_state", "Estado de cada circuito (0 = cerrado, 1 = semiabierto, 2 = abierto).",
+    lambda: {(name,): CIRCUIT_STATES[stats["state"]] for name, stats in CircuitBreaker.all_stats().items()},
+    ("breaker",)
+)
@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RULE_EVALUATIONS_TOTAL = REGISTRY.counter("smart_home_rule_evaluations_total", "Reglas evaluadas (sólo las indexadas para el mensaje).")
+RULE_FIRINGS_TOTAL = REGISTRY.counter("smart_home_rule_firings_total", "Reglas cuyas condiciones se cumplieron.")
+RULE_ACTIONS_TOTAL = REGISTRY.counter("smart_home_rule_actions_total", "Acciones de reglas ejecutadas por resultado.", ("result",))
+RULE_MESSAGE_SECONDS = REGISTRY.histogram("smart_home_rule_message_seconds", "Duración de la evaluación de reglas por mensaje MQTT.")
+
+COMPARATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b
+}
+
+class RuleError(ValueError):
+    """
+    Regla mal formada (se informa al cargar, no al evaluar).
+    """
+
+def _minutes(value):
+    """
+    'HH:MM' -> minutos desde la medianoche. Lanza ValueError si la hora no está entre 00:00 y 23:59.
+    """
+    hours, minutes = value.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Hora fuera de rango: {value}")
+    return hours * 60 + minutes
+
+def _field(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+class CompiledRule:
+    """
+    Regla compilada: disparador (tópico o entidad), condición sobre el mensaje, ventana horaria y acciones.
+
+    Formato (knowledge/rules.json):
+        {"id": "apagar_pasillo_noche",
+         "trigger": {"topic": "stat/salon/POWER", "payload": "ON", "transition": true},
+         "conditions": {"after": "22:00", "before": "06:00", "weekdays": [0, 1, 2, 3, 4]},
+         "actions": [{"entity_id": "light.pasillo", "service": "turn_off"}],
+         "cooldown_s": 5}
+    El disparador admite "topic" (con comodines MQTT '+' y '#') o "entity_id" (su state_topic), y
+    como condición "payload" (texto, sin distinguir mayúsculas) o "field" + "op" + "value" sobre el
+    JSON del mensaje ('Wifi.RSSI' < 40). Con "transition" sólo se dispara cuando la condición pasa
+    de no cumplirse a cumplirse.
+    """
+
+    __slots__ = ("rule_id", "topic", "entity_id", "payload", "field", "op", "value", "transition",
+                 "after", "before", "weekdays", "actions", "cooldown_s", "last_fired", "matched_topics")
+
+    def __init__(self, definition):
+        if not isinstance(definition, dict):
+            raise RuleError("La regla debe ser un objeto JSON.")
+        self.rule_id = str(definition.get("id") or "")
+        trigger = definition.get("trigger") or {}
+        if not isinstance(trigger, dict):
+            raise RuleError(f"Regla '{self.rule_id}': 'trigger' debe ser un objeto JSON.")
+        self.topic = trigger.get("topic")
+        self.entity_id = trigger.get("entity_id")
+        if not self.rule_id or bool(self.topic) == bool(self.entity_id) or not isinstance(self.topic or self.entity_id, str):
+            raise RuleError(f"Regla '{self.rule_id}': se necesita 'id' y un disparador con 'topic' o 'entity_id'.")
+        payload = trigger.get("payload", trigger.get("state"))
+        self.payload = str(payload).strip().upper() if payload is not None else None
+        self.field = trigger.get("field")
+        self.op = COMPARATORS.get(trigger.get("op", "==")) if isinstance(trigger.get("op", "=="), str) else None
+        self.value = trigger.get("value")
+        if self.field is not None and self.op is None:
+            raise RuleError(f"Regla '{self.rule_id}': operador desconocido '{trigger.get('op')}'.")
+        self.transition = bool(trigger.get("transition", False))
+
+        conditions = definition.get("conditions") or {}
+        if not isinstance(conditions, dict):
+            raise RuleError(f"Regla '{self.rule_id}': 'conditions' debe ser un objeto JSON.")
+        try:
+            self.after = _minutes(conditions["after"]) if conditions.get("after") else None
+            self.before = _minutes(conditions["before"]) if conditions.get("before") else None
+        except (ValueError, AttributeError):
+            raise RuleError(f"Regla '{self.rule_id}': 'after'/'before' deben tener el formato HH:MM (00:00-23:59).")
+        weekdays = conditions.get("weekdays")
+        if weekdays and (not isinstance(weekdays, list) or
+                         not all(isinstance(day, int) and not isinstance(day, bool) and 0 <= day <= 6 for day in weekdays)):
+            raise RuleError(f"Regla '{self.rule_id}': 'weekdays' debe ser una lista de días de 0 (lunes) a 6 (domingo).")
+        self.weekdays = frozenset(weekdays) if weekdays else None
+
+        self.actions = []
+        for action in definition.get("actions") or []:
+            if not isinstance(action, dict) or not all(isinstance(action.get(key), str) and action[key] for key in ("entity_id", "service")):
+                raise RuleError(f"Regla '{self.rule_id}': cada acción necesita 'entity_id' y 'service'.")
+            self.actions.append((action["entity_id"], action["service"], action.get("payload") or {}))
+        if not self.actions:
+            raise RuleError(f"Regla '{self.rule_id}': no tiene acciones.")
+        try:
+            self.cooldown_s = float(definition.get("cooldown_s", 1.0)) # Evita bucles entre reglas que se disparan mutuamente
+        except (TypeError, ValueError):
+            self.cooldown_s = -1.0
+        if not 0 <= self.cooldown_s < float("inf"):
+            raise RuleError(f"Regla '{self.rule_id}': 'cooldown_s' debe ser un número de segundos mayor o igual que 0.")
+        self.last_fired = 0.0
+        self.matched_topics = set() # Tópicos cuya última condición se cumplió (para 'transition', por tópico)
+
+    def message_matches(self, payload, parsed):
+        """
+        :param parsed: Función sin argumentos que devuelve el JSON del mensaje (se parsea una vez por mensaje).
+        """
+        if self.payload is not None and payload.strip().upper() != self.payload:
+            return False
+        if self.field is not None:
+            value = _field(parsed(), self.field)
+            if value is None:
+                return False
+            try:
+                return self.op(value, self.value)
+            except TypeError:
+                return False
+        return True
+
+    def time_matches(self, now):
+        if self.weekdays is not None and now.tm_wday not in self.weekdays:
+            return False
+        if self.after is None and self.before is None:
+            return True
+        minute = now.tm_hour * 60 + now.tm_min
+        if self.after is not None and self.before is not None:
+            if self.after <= self.before:
+                return self.after <= minute < self.before
+            return minute >= self.after or minute < self.before # Ventana que cruza la medianoche
+        return minute >= self.after if self.after is not None else minute < self.before
+
+class TopicTrie:
+    """
+    Índice de filtros de tópico MQTT ('stat/+/POWER', 'tele/#'): cada tópico recorre un único
+    camino por nivel, así que el coste depende de la profundidad, no del número de filtros.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, topic_filter, value):
+        node = self._root
+        for level in topic_filter.split("/"):
+            node = node.setdefault(level, {})
+        node.setdefault(None, []).append(value) # Clave None: valores que terminan en este nodo
+
+    def match(self, topic):
+        matches = []
+        nodes = [self._root]
+        for level in topic.split("/"):
+            next_nodes = []
+            for node in nodes:
+                if "#" in node:
+                    matches.extend(node["#"].get(None, ()))
+                for key in (level, "+"):
+                    child = node.get(key)
+                    if child is not None:
+                        next_nodes.append(child)
+            if not next_nodes:
+                return matches
+            nodes = next_nodes
+        for node in nodes:
+            matches.extend(node.get(None, ()))
+            if "#" in node: # 'a/#' también coincide con 'a'
+                matches.extend(node["#"].get(None, ()))
+        return matches
+
+class RulesEngine:
+    """
+    Automatizaciones locales sobre el flujo MQTT, sin pasar por el LLM.
+
+    Las reglas se compilan al cargar y se indexan por filtro de tópico (TopicTrie) o por entidad;
+    cada mensaje sólo evalúa las reglas de su tópico y de las entidades cuyo state_topic es ese
+    tópico. Las acciones se envían con send_tasmota_command / send_ha_command.
+    """
+
+    def __init__(self, home_assistant_api, rules_file=None, check_interval=1.0):
+        self.home_assistant_api = home_assistant_api
+        self.rules_file = rules_file
+        self.check_interval = check_interval # Segundos entre comprobaciones de cambios en rules_file
+        self.rules = []
+        self._by_topic = TopicTrie()
+        self._by_entity = {}
+        self._file_signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.evaluations = 0
+        self.firings = 0
+        self._mqtt_client = None
+        self._covered = TopicTrie() # Filtros ya suscritos (los de subscribe_to_all_ha_topics y los de reglas)
+        REGISTRY.gauge("smart_home_rules_loaded", "Reglas de automatización cargadas.", lambda: len(self.rules))
+        if rules_file:
+            self.load_file()
+
+    def set_rules(self, definitions):
+        """
+        Compila e indexa las reglas. Las mal formadas se descartan con un aviso.
+        :return: Lista de errores.
+        """
+        rules, errors = [], []
+        by_topic, by_entity = TopicTrie(), {}
+        for definition in definitions:
+            try:
+                rule = CompiledRule(definition)
+            except RuleError as e:
+                errors.append(str(e))
+                continue
+            rules.append(rule)
+            if rule.topic:
+                by_topic.add(rule.topic, rule)
+            else:
+                by_entity.setdefault(rule.entity_id, []).append(rule)
+        with self._lock:
+            self.rules, self._by_topic, self._by_entity = rules, by_topic, by_entity
+        self._subscribe_missing()
+        for error in errors:
+            logging.warning(f"Regla descartada: {error}")
+        logging.info(f"Reglas de automatización cargadas: {len(rules)} ({len(errors)} descartadas).")
+        return errors
+
+    def subscribe_topics(self, mqtt_client, subscribed_filters):
+        """
+        Suscribe al broker los filtros de las reglas que no cubren las suscripciones existentes
+        (también tras recargar las reglas). Un filtro de regla con comodines que sólo se solape en
+        parte con los existentes se suscribe igualmente.
+        """
+        self._mqtt_client = mqtt_client
+        for topic_filter in subscribed_filters:
+            self._covered.add(topic_filter, topic_filter)
+        self._subscribe_missing()
+
+    def _subscribe_missing(self):
+        if self._mqtt_client is None:
+            return
+        for topic_filter in sorted({rule.topic for rule in self.rules if rule.topic}):
+            if not self._covered.match(topic_filter):
+                self._mqtt_client.subscribe(topic_filter)
+                self._covered.add(topic_filter, topic_filter)
+                logging.info(f"Suscrito al tópico de reglas: {topic_filter}")
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.rules_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def load_file(self):
+        self._file_signature = self._signature()
+        if self._file_signature is None:
+            logging.info(f"Archivo de reglas '{self.rules_file}' no encontrado. Sin automatizaciones locales.")
+            self.set_rules([])
+            return
+        try:
+            with open(self.rules_file, 'r', encoding='utf-8') as f:
+                self.set_rules(json.load(f).get("rules", []))
+        except (json.JSONDecodeError, AttributeError) as e:
+            logging.error(f"Error al leer el archivo de reglas '{self.rules_file}': {e}")
+
+    def refresh_if_changed(self):
+        """
+        Recarga las reglas si el archivo cambió (como mucho una comprobación cada check_interval segundos).
+        """
+        if not self.rules_file:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        if self._signature() == self._file_signature:
+            return False
+        self.load_file()
+        return True
+
+    def candidates(self, topic):
+        """
+        Reglas indexadas para un tópico: las de su filtro y las de las entidades que publican su estado en él.
+        """
+        with self._lock:
+            by_topic, by_entity = self._by_topic, self._by_entity
+        matches = by_topic.match(topic)
+        if by_entity:
+            for entity_id in self.home_assistant_api.entities_for_state_topic(topic):
+                matches.extend(by_entity.get(entity_id, ()))
+        return matches
+
+    def process_message(self, topic, payload):
+        """
+        Evalúa las reglas indexadas para el mensaje y ejecuta las acciones de las que se cumplan.
+        :return: Número de reglas disparadas.
+        """
+        self.refresh_if_changed()
+        candidates = self.candidates(topic)
+        if not candidates:
+            return 0
+        started = time.perf_counter()
+        parsed_cache = []
+
+        def parsed():
+            if not parsed_cache:
+                try:
+                    parsed_cache.append(json.loads(payload))
+                except (json.JSONDecodeError, TypeError):
+                    parsed_cache.append(None)
+            return parsed_cache[0]
+
+        now = time.localtime()
+        monotonic_now = time.monotonic()
+        fired = 0
+        for rule in candidates:
+            matched = rule.message_matches(payload, parsed)
+            if rule.transition:
+                previously_matched = topic in rule.matched_topics
+                if matched:
+                    rule.matched_topics.add(topic)
+                else:
+                    rule.matched_topics.discard(topic)
+                if previously_matched:
+                    continue
+            if not matched:
+                continue
+            if not rule.time_matches(now) or monotonic_now - rule.last_fired < rule.cooldown_s:
+                continue
+            rule.last_fired = monotonic_now
+            fired += 1
+            self._run_actions(rule)
+        self.evaluations += len(candidates)
+        self.firings += fired
+        RULE_EVALUATIONS_TOTAL.inc(len(candidates))
+        if fired:
+            RULE_FIRINGS_TOTAL.inc(fired)
+        RULE_MESSAGE_SECONDS.observe(time.perf_counter() - started)
+        return fired
+
+    def _run_actions(self, rule):
+        api = self.home_assistant_api
+        for entity_id, service, payload in rule.actions:
+            info = api.ha_entity_info.get(entity_id)
+            success = False
+            # Mismo enrutamiento que los comandos del LLM: Tasmota directo para on/off, si no servicio HA
+            if info and info.get('command_topic') and service in ("turn_on", "turn_off"):
+                success, message = api.send_tasmota_command(entity_id, "ON" if service == "turn_on" else "OFF")
+            if not success:
+                success, message = api.send_ha_command(entity_id.split('.', 1)[0], service, entity_id, payload)
+            RULE_ACTIONS_TOTAL.inc(result="ok" if success else "error")
+            if success:
+                logging.info(f"Regla '{rule.rule_id}': {message}")
+            else:
+                logging.error(f"Regla '{rule.rule_id}': error al ejecutar '{service}' en '{entity_id}': {message}")
+
+    def stats(self):
+        return {"rules": len(self.rules), "evaluations": self.evaluations, "firings": self.firings}
@@ -0,0 +1,58 @@
+import asyncio
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones idénticas en curso ("singleflight").
+
+    El primer llamador con una clave lanza la llamada real; los duplicados concurrentes
+    esperan el mismo resultado (o la misma excepción). La llamada se ejecuta en su propia
+    tarea, así que cancelar a un llamador no cancela la respuesta de los demás; cuando se
+    cancela el último que la esperaba, la llamada real también se cancela.
+    El resultado es compartido: los llamadores deben tratarlo como de solo lectura.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0 # Llamadas reales lanzadas
+        self.coalesced = 0 # Llamadores que reutilizaron una llamada en curso
+        self.abandoned = 0 # Llamadas reales canceladas porque ya nadie las esperaba
+        self._in_flight = {} # {clave: asyncio.Task}
+        self._waiters = {} # {asyncio.Task: llamadores esperando}
+
+    async def do(self, key, coro_factory):
+        """
+        :param key: Clave normalizada de la petición.
+        :param coro_factory: Función sin argumentos que devuelve la corrutina a ejecutar.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(coro_factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # Era el último llamador: nadie usará el resultado
+                self.abandoned += 1
+                if self._in_flight.get(key) is task:
+                    del self._in_flight[key] # Los llamadores nuevos lanzan otra llamada
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _finish(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception() # Evita el aviso de excepción no recuperada si nadie quedó esperando
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "abandoned": self.abandoned, "in_flight": len(self._in_flight)}
@@ -0,0 +1,274 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class InMemoryStateBackend:
+    """
+    Estado de ejecución en memoria del proceso (modo por defecto, una sola réplica).
+
+    Todos los backends exponen la misma interfaz:
+      - claves/valores JSON por espacio de nombres, con caducidad opcional (get/set/pop/delete/items/incr);
+      - registros de solo-anexado con número de secuencia (append_log/read_log), que cada réplica
+        consume de forma incremental, y que se compactan en una instantánea (compact_log/read_log_snapshot);
+      - concesiones con caducidad (try_acquire_lease) para designar una única réplica para una tarea.
+    """
+
+    shared = False # El estado no es visible para otras réplicas
+
+    def __init__(self):
+        self._values = {} # {(espacio, clave): (valor, caduca_en o None)}
+        self._logs = {} # {registro: [(secuencia, valor)]}
+        self._log_seq = {} # {registro: última secuencia} (la compactación vacía la lista, no reinicia la secuencia)
+        self._snapshots = {} # {registro: (secuencia, valor)}
+        self._lock = threading.Lock()
+
+    def _alive(self, item, now):
+        return item is not None and (item[1] is None or item[1] > now)
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            item = self._values.get((namespace, key))
+            return item[0] if self._alive(item, time.time()) else default
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            self._values[(namespace, key)] = (value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, namespace, key, value, ttl=None):
+        """
+        Guarda el valor sólo si la clave no existe (o caducó). :return: True si se guardó.
+        """
+        now = time.time()
+        with self._lock:
+            if self._alive(self._values.get((namespace, key)), now):
+                return False
+            self._values[(namespace, key)] = (value, now + ttl if ttl else None)
+            return True
+
+    def pop(self, namespace, key, default=None):
+        with self._lock:
+            item = self._values.pop((namespace, key), None)
+            return item[0] if self._alive(item, time.time()) else default
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._values.pop((namespace, key), None)
+
+    def items(self, namespace):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, item in self._values.items() if not self._alive(item, now)]
+            for k in expired:
+                del self._values[k]
+            return {key: item[0] for (ns, key), item in self._values.items() if ns == namespace}
+
+    def incr(self, namespace, key, amount=1):
+        with self._lock:
+            item = self._values.get((namespace, key))
+            value = (item[0] if self._alive(item, time.time()) else 0) + amount
+            self._values[(namespace, key)] = (value, None)
+            return value
+
+    def append_log(self, log_name, value):
+        with self._lock:
+            seq = self._log_seq[log_name] = self._log_seq.get(log_name, 0) + 1
+            self._logs.setdefault(log_name, []).append((seq, value))
+            return seq
+
+    def read_log(self, log_name, after_seq=0):
+        """
+        :return: Lista de tuplas (secuencia, valor) posteriores a 'after_seq', en orden.
+        """
+        with self._lock:
+            return [record for record in self._logs.get(log_name, []) if record[0] > after_seq]
+
+    def read_log_snapshot(self, log_name, after_seq=0):
+        """
+        Cambios de un registro desde 'after_seq', teniendo en cuenta la compactación.
+        :return: Tupla (instantánea, registros). La instantánea (secuencia, valor) sólo se devuelve si
+                 es posterior a 'after_seq' (los registros que resume ya no existen); los registros son
+                 los posteriores a 'after_seq' y a la instantánea.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(log_name)
+            if snapshot is None or snapshot[0] <= after_seq:
+                snapshot = None
+            else:
+                after_seq = snapshot[0]
+            return snapshot, [record for record in self._logs.get(log_name, []) if record[0] > after_seq]
+
+    def compact_log(self, log_name, upto_seq, snapshot):
+        """
+        Guarda 'snapshot' como el estado del registro hasta 'upto_seq' y borra esos registros.
+        :return: False si ya había una instantánea igual o más reciente.
+        """
+        with self._lock:
+            current = self._snapshots.get(log_name)
+            if current is not None and current[0] >= upto_seq:
+                return False
+            self._snapshots[log_name] = (upto_seq, snapshot)
+            self._logs[log_name] = [record for record in self._logs.get(log_name, []) if record[0] > upto_seq]
+            return True
+
+    def try_acquire_lease(self, name, owner, ttl):
+        """
+        Adquiere o renueva la concesión 'name' para 'owner' durante 'ttl' segundos.
+        :return: True si 'owner' es el titular.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._values.get(("leases", name))
+            if self._alive(item, now) and item[0] != owner:
+                return False
+            self._values[("leases", name)] = (owner, now + ttl)
+            return True
+
+    def close(self):
+        pass
+
+class SQLiteStateBackend:
+    """
+    Estado compartido en un archivo SQLite (modo WAL). Varias réplicas de main_app que monten el
+    mismo volumen (p. ej. ./knowledge) comparten así las interacciones pendientes, la memoria y el
+    registro de entidades. Sustituto local de un almacén clave-valor en red con la misma interfaz.
+    """
+
+    shared = True
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout_ms / 1000)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS logs (seq INTEGER PRIMARY KEY AUTOINCREMENT, log_name TEXT NOT NULL, value TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS logs_by_name ON logs (log_name, seq)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS log_snapshots (log_name TEXT PRIMARY KEY, seq INTEGER NOT NULL, value TEXT NOT NULL)")
+        logging.info(f"Estado compartido en SQLite: '{path}'.")
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def _transaction(self, statements, immediate=True):
+        """
+        Ejecuta una función sobre la conexión dentro de una transacción con bloqueo de escritura inmediato
+        (o, con immediate=False, una transacción de lectura: una vista coherente sin bloquear a los escritores).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                     (namespace, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                               (namespace, key, json.dumps(value, ensure_ascii=False), self._expiry(ttl)))
+
+    def set_if_absent(self, namespace, key, value, ttl=None):
+        def statements(conn):
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ? AND expires_at <= ?", (namespace, key, time.time()))
+            cursor = conn.execute("INSERT OR IGNORE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                                  (namespace, key, json.dumps(value, ensure_ascii=False), self._expiry(ttl)))
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def pop(self, namespace, key, default=None):
+        def statements(conn):
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            if row is None:
+                return default
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+            return json.loads(row[0]) if row[1] is None or row[1] > time.time() else default
+        return self._transaction(statements)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+            rows = self._conn.execute("SELECT key, value FROM kv WHERE namespace = ?", (namespace,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def incr(self, namespace, key, amount=1):
+        def statements(conn):
+            row = conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                               (namespace, key, time.time())).fetchone()
+            value = (json.loads(row[0]) if row else 0) + amount
+            conn.execute("INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, NULL)", (namespace, key, json.dumps(value)))
+            return value
+        return self._transaction(statements)
+
+    def append_log(self, log_name, value):
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO logs (log_name, value) VALUES (?, ?)", (log_name, json.dumps(value, ensure_ascii=False)))
+            return cursor.lastrowid
+
+    def read_log(self, log_name, after_seq=0):
+        # La secuencia es global a todos los registros: crece, pero no es consecutiva dentro de uno
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, value FROM logs WHERE log_name = ? AND seq > ? ORDER BY seq", (log_name, after_seq)).fetchall()
+        return [(seq, json.loads(value)) for seq, value in rows]
+
+    def read_log_snapshot(self, log_name, after_seq=0):
+        def statements(conn):
+            row = conn.execute("SELECT seq, value FROM log_snapshots WHERE log_name = ? AND seq > ?", (log_name, after_seq)).fetchone()
+            snapshot = (row[0], json.loads(row[1])) if row else None
+            rows = conn.execute("SELECT seq, value FROM logs WHERE log_name = ? AND seq > ? ORDER BY seq",
+                                (log_name, snapshot[0] if snapshot else after_seq)).fetchall()
+            return snapshot, [(seq, json.loads(value)) for seq, value in rows]
+        return self._transaction(statements, immediate=False) # Instantánea y registros de la misma versión
+
+    def compact_log(self, log_name, upto_seq, snapshot):
+        def statements(conn):
+            row = conn.execute("SELECT seq FROM log_snapshots WHERE log_name = ?", (log_name,)).fetchone()
+            if row is not None and row[0] >= upto_seq:
+                return False
+            conn.execute("INSERT OR REPLACE INTO log_snapshots (log_name, seq, value) VALUES (?, ?, ?)",
+                         (log_name, upto_seq, json.dumps(snapshot, ensure_ascii=False)))
+            conn.execute("DELETE FROM logs WHERE log_name = ? AND seq <= ?", (log_name, upto_seq))
+            return True
+        return self._transaction(statements)
+
+    def try_acquire_lease(self, name, owner, ttl):
+        def statements(conn):
+            now = time.time()
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE namespace = 'leases' AND key = ?", (name,)).fetchone()
+            if row is not None and json.loads(row[0]) != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES ('leases', ?, ?, ?)", (name, json.dumps(owner), now + ttl))
+            return True
+        return self._transaction(statements)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_state_backend(kind="memory", path="./knowledge/shared_state.sqlite3"):
+    """
+    Crea el backend de estado indicado en la configuración ('memory' o 'sqlite').
+    """
+    if kind == "sqlite":
+        return SQLiteStateBackend(path)
+    if kind != "memory":
+        logging.warning(f"Backend de estado desconocido '{kind}'. Usando 'memory'.")
+    return InMemoryStateBackend()
@@ -0,0 +1,70 @@
+import json
+import re
+
+# Secuencias de escape simples de JSON
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class StreamingFieldExtractor:
+    """
+    Extrae de forma incremental el valor de texto de un campo de un objeto JSON que llega
+    por fragmentos (ej. 'response_text' de una respuesta estructurada de Gemini en streaming).
+    Cada llamada a feed() devuelve sólo los caracteres nuevos ya decodificados del valor.
+    """
+
+    def __init__(self, field_name):
+        self._key_pattern = re.compile(r'"' + re.escape(field_name) + r'"\s*:\s*"')
+        self._buffer = ""
+        self._pos = None # Posición del siguiente carácter del valor por decodificar
+        self.done = False # True cuando se ha leído la comilla de cierre del valor
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        buf = self._buffer
+        out = []
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if c == '\\':
+                if i + 1 >= len(buf):
+                    break # Escape incompleto: esperar al siguiente fragmento
+                escape = buf[i + 1]
+                if escape == 'u':
+                    length = 6
+                    # Par sustituto (ej. emojis): necesita dos secuencias \uXXXX seguidas
+                    if i + 6 <= len(buf) and 0xD800 <= int(buf[i + 2:i + 6], 16) <= 0xDBFF:
+                        length = 12
+                    if i + length > len(buf):
+                        break
+                    out.append(json.loads('"' + buf[i:i + length] + '"'))
+                    i += length
+                    continue
+                out.append(_JSON_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            out.append(c)
+            i += 1
+        self._pos = i
+        return "".join(out)
+
+def find_string_field(buffer, field_name):
+    """
+    Devuelve el valor de un campo de texto corto (ej. 'action_type') si ya está completo en el buffer.
+    """
+    match = re.search(r'"' + re.escape(field_name) + r'"\s*:\s*"([^"\\]*)"', buffer)
+    return match.group(1) if match else None
@@ -0,0 +1,317 @@
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+
+from core_logic.metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TELEMETRY_SAMPLES_TOTAL = REGISTRY.counter("smart_home_telemetry_samples_total", "Muestras de telemetría almacenadas.")
+TELEMETRY_DROPPED_TOTAL = REGISTRY.counter("smart_home_telemetry_dropped_total", "Muestras descartadas por falta de series libres.")
+
+# Niveles de resolución: nombre -> anchura del intervalo en segundos
+TIERS = {"1m": 60, "1h": 3600}
+POWER_VALUES = {"ON": 1.0, "OFF": 0.0}
+# Los números de intervalo se guardan desplazados en uint32: 0 es el hueco sin datos, así que las
+# matrices de los niveles se crean con np.zeros y no comprometen memoria hasta que llegan muestras
+BUCKET_OFFSET = 2 ** 31
+EMPTY_BUCKET = 0
+# Métricas que se guardan (prefijos de nombre plano); el resto del mensaje no ocupa series
+DEFAULT_METRICS = ("UptimeSec", "LoadAvg", "Heap", "Wifi.RSSI", "Wifi.Signal", "POWER", "ENERGY.")
+CUMULATIVE_METRICS = ("UptimeSec", "ENERGY.Total", "ENERGY.Yesterday", "ENERGY.Today") # Su media no aporta nada en el prompt
+
+def extract_metrics(state, prefixes=DEFAULT_METRICS, max_metrics=16):
+    """
+    Métricas numéricas de un mensaje tele/<dispositivo>/STATE (o SENSOR) de Tasmota, con nombres
+    planos ('UptimeSec', 'Wifi.RSSI', 'POWER1', 'ENERGY.Power'...). POWER ON/OFF se guarda como 1/0.
+    :param prefixes: Prefijos de las métricas a conservar (None = todas las numéricas).
+    :return: Lista de tuplas (métrica, valor).
+    """
+    metrics = []
+    for key, value in state.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                name = f"{key}.{sub_key}"
+                if isinstance(sub_value, (int, float)) and not isinstance(sub_value, bool) and (prefixes is None or name.startswith(prefixes)):
+                    metrics.append((name, float(sub_value)))
+        elif prefixes is not None and not key.startswith(prefixes):
+            continue
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics.append((key, float(value)))
+        elif key.startswith("POWER") and value in POWER_VALUES:
+            metrics.append((key, POWER_VALUES[value]))
+        if len(metrics) >= max_metrics:
+            break
+    return metrics[:max_metrics]
+
+class TelemetryStore:
+    """
+    Series temporales de telemetría en anillos de tamaño fijo, con submuestreo automático.
+
+    Cada serie (dispositivo, métrica) ocupa una fila de matrices numpy reservadas al crear el
+    almacén, así que la memoria máxima es fija: max_series * bytes_per_series (np.zeros sólo
+    compromete las páginas que se usan). Por serie hay tres niveles:
+      - raw: las últimas 'raw_capacity' muestras (instante y valor);
+      - 1m y 1h: mínimo, máximo, suma y número de muestras por intervalo, en un anillo indexado
+        por número de intervalo (intervalo % capacidad); un hueco con otro número está caducado.
+    Guardar una muestra escribe en posiciones ya reservadas: no crea objetos salvo los del parseo.
+    """
+
+    def __init__(self, max_series=20000, raw_capacity=120, minute_capacity=180, hour_capacity=168, max_metrics_per_device=16, metrics=DEFAULT_METRICS):
+        """
+        :param raw_capacity: Muestras brutas por serie (120 ~ 10 minutos a una muestra cada 5 s).
+        :param minute_capacity: Intervalos de 1 minuto por serie (180 = 3 horas).
+        :param hour_capacity: Intervalos de 1 hora por serie (168 = 7 días).
+        :param metrics: Prefijos de las métricas que se guardan (None = todas las numéricas).
+        """
+        self.max_series = max_series
+        self.raw_capacity = raw_capacity
+        self.max_metrics_per_device = max_metrics_per_device
+        self.metrics = metrics
+        self.epoch = int(time.time()) # Los instantes se guardan como segundos int32 desde aquí
+
+        self._series = {} # {(dispositivo, métrica): fila}
+        self._device_metrics = {} # {dispositivo: [métrica]}
+        self._lock = threading.Lock()
+
+        self._raw_ts = np.zeros((max_series, raw_capacity), dtype=np.int32)
+        self._raw_value = np.zeros((max_series, raw_capacity), dtype=np.float32)
+        self._raw_head = np.zeros(max_series, dtype=np.int32) # Próxima posición de escritura
+        self._raw_count = np.zeros(max_series, dtype=np.int32)
+        self._tiers = {}
+        for name, capacity in (("1m", minute_capacity), ("1h", hour_capacity)):
+            self._tiers[name] = {
+                "capacity": capacity,
+                "bucket": np.zeros((max_series, capacity), dtype=np.uint32), # Número de intervalo del hueco + BUCKET_OFFSET
+                "min": np.zeros((max_series, capacity), dtype=np.float32),
+                "max": np.zeros((max_series, capacity), dtype=np.float32),
+                "sum": np.zeros((max_series, capacity), dtype=np.float32),
+                "count": np.zeros((max_series, capacity), dtype=np.uint16)
+            }
+        # Vistas planas (memoryview) de las mismas matrices para la ingesta: leer y escribir un
+        # elemento suelto es varias veces más rápido que indexar numpy y no crea escalares numpy
+        self._raw_views = (self._raw_ts.reshape(-1).data, self._raw_value.reshape(-1).data, self._raw_head.data, self._raw_count.data)
+        self._tier_views = [
+            (TIERS[name], tier["capacity"], tier["bucket"].reshape(-1).data, tier["min"].reshape(-1).data,
+             tier["max"].reshape(-1).data, tier["sum"].reshape(-1).data, tier["count"].reshape(-1).data)
+            for name, tier in self._tiers.items()
+        ]
+        REGISTRY.gauge("smart_home_telemetry_series", "Series de telemetría en uso.", lambda: len(self._series))
+
+    @property
+    def bytes_per_series(self):
+        raw = self.raw_capacity * (self._raw_ts.itemsize + self._raw_value.itemsize) + 8
+        tiers = sum(tier["capacity"] * (4 + 4 + 4 + 4 + 2) for tier in self._tiers.values())
+        return raw + tiers
+
+    def _row_for(self, device, metric):
+        key = (device, metric)
+        row = self._series.get(key)
+        if row is not None:
+            return row
+        metrics = self._device_metrics.setdefault(device, [])
+        if len(self._series) >= self.max_series or len(metrics) >= self.max_metrics_per_device:
+            return None
+        row = self._series[key] = len(self._series)
+        metrics.append(metric)
+        return row
+
+    def add_sample(self, device, metric, value, timestamp=None):
+        """
+        Guarda una muestra en la serie (dispositivo, métrica) y en sus intervalos de 1 minuto y 1 hora.
+        :return: False si no quedan series libres.
+        """
+        return self.add_samples(device, ((metric, value),), timestamp) == 1
+
+    def add_samples(self, device, samples, timestamp=None):
+        """
+        Guarda varias muestras (métrica, valor) del mismo dispositivo e instante.
+        :return: Número de muestras guardadas (las de series nuevas sin hueco libre se descartan).
+        """
+        ts = int((time.time() if timestamp is None else timestamp) - self.epoch)
+        raw_ts, raw_value, raw_head, raw_count = self._raw_views
+        raw_capacity = self.raw_capacity
+        stored = 0
+        with self._lock:
+            for metric, value in samples:
+                row = self._row_for(device, metric)
+                if row is None:
+                    continue
+                value = float(value)
+                head = raw_head[row]
+                raw_ts[row * raw_capacity + head] = ts
+                raw_value[row * raw_capacity + head] = value
+                raw_head[row] = (head + 1) % raw_capacity
+                if raw_count[row] < raw_capacity:
+                    raw_count[row] += 1
+                for width, capacity, buckets, minimums, maximums, sums, counts in self._tier_views:
+                    bucket = ts // width
+                    index = row * capacity + bucket % capacity
+                    bucket += BUCKET_OFFSET
+                    if buckets[index] != bucket:
+                        # Hueco vacío o de una vuelta anterior del anillo: empieza un intervalo nuevo
+                        buckets[index] = bucket
+                        minimums[index] = maximums[index] = sums[index] = value
+                        counts[index] = 1
+                    else:
+                        if value < minimums[index]:
+                            minimums[index] = value
+                        if value > maximums[index]:
+                            maximums[index] = value
+                        sums[index] += value
+                        if counts[index] < 65535:
+                            counts[index] += 1
+                stored += 1
+        if stored:
+            TELEMETRY_SAMPLES_TOTAL.inc(stored)
+        if stored < len(samples):
+            TELEMETRY_DROPPED_TOTAL.inc(len(samples) - stored)
+        return stored
+
+    def ingest_state(self, device, payload, timestamp=None):
+        """
+        Guarda las métricas de un mensaje tele/<dispositivo>/STATE. :return: Número de métricas guardadas.
+        """
+        try:
+            state = json.loads(payload)
+        except (json.JSONDecodeError, TypeError):
+            return 0
+        if not isinstance(state, dict):
+            return 0
+        return self.add_samples(device, extract_metrics(state, self.metrics, self.max_metrics_per_device), timestamp)
+
+    def devices(self):
+        with self._lock:
+            return {device: list(metrics) for device, metrics in self._device_metrics.items()}
+
+    def _choose_resolution(self, row, start):
+        """
+        El nivel más fino que aún conserva datos desde 'start' (None = desde la primera muestra).
+        """
+        count = self._raw_count[row]
+        oldest = self._raw_ts[row, (self._raw_head[row] - count) % self.raw_capacity] if count else None
+        if oldest is not None and (count < self.raw_capacity or (start is not None and oldest <= start)):
+            return "raw" # El anillo aún no ha dado la vuelta o su muestra más antigua es anterior a 'start'
+        for name, width in TIERS.items():
+            buckets = self._tiers[name]["bucket"][row]
+            valid = buckets[buckets != EMPTY_BUCKET].astype(np.int64) - BUCKET_OFFSET
+            if valid.size and (valid.size < self._tiers[name]["capacity"] or (start is not None and valid.min() * width <= start)):
+                return name
+        return "1h"
+
+    def _select(self, row, start, end, resolution):
+        """
+        Datos de la fila en el rango [start, end] (instantes Unix), como vistas numpy ordenadas en el tiempo.
+        :return: (resolución, instantes relativos, columnas): en 'raw' columnas = (valores,);
+                 en '1m'/'1h' columnas = (mínimos, máximos, sumas, muestras) e instantes = inicio de cada intervalo.
+        """
+        rel_start = None if start is None else start - self.epoch
+        rel_end = None if end is None else end - self.epoch
+        if resolution == "auto":
+            resolution = self._choose_resolution(row, rel_start)
+
+        if resolution == "raw":
+            count = self._raw_count[row]
+            timestamps, values = self._raw_ts[row, :count], self._raw_value[row, :count]
+            mask = np.ones(timestamps.shape, dtype=bool)
+            if rel_start is not None:
+                mask &= timestamps >= rel_start
+            if rel_end is not None:
+                mask &= timestamps <= rel_end
+            timestamps, values = timestamps[mask], values[mask]
+            order = np.argsort(timestamps, kind="stable")
+            return resolution, timestamps[order], (values[order],)
+
+        tier = self._tiers[resolution]
+        width = TIERS[resolution]
+        mask = tier["bucket"][row] != EMPTY_BUCKET
+        buckets = tier["bucket"][row].astype(np.int64) - BUCKET_OFFSET
+        if rel_start is not None:
+            mask &= buckets >= rel_start // width
+        if rel_end is not None:
+            mask &= buckets <= rel_end // width
+        slots = np.nonzero(mask)[0]
+        slots = slots[np.argsort(buckets[slots], kind="stable")]
+        columns = tuple(tier[column][row, slots] for column in ("min", "max", "sum", "count"))
+        return resolution, buckets[slots] * width, columns
+
+    def query(self, device, metric, start=None, end=None, resolution="auto"):
+        """
+        Puntos de una serie entre 'start' y 'end' (instantes Unix; None = sin límite), en orden.
+        :param resolution: 'raw', '1m', '1h' o 'auto' (el nivel más fino que cubre el rango).
+        :return: {"resolution": ..., "points": [...]}. En 'raw' cada punto es [instante, valor];
+                 en '1m'/'1h' es [inicio_del_intervalo, mínimo, máximo, media, muestras]. None si la serie no existe.
+        """
+        with self._lock:
+            row = self._series.get((device, metric))
+            if row is None:
+                return None
+            resolution, timestamps, columns = self._select(row, start, end, resolution)
+            timestamps = (timestamps + self.epoch).tolist()
+            if resolution == "raw":
+                return {"resolution": resolution, "points": [[ts, round(v, 4)] for ts, v in zip(timestamps, columns[0].tolist())]}
+            minimums, maximums, sums, counts = (column.tolist() for column in columns)
+            points = [[ts, round(lo, 4), round(hi, 4), round(total / count, 4), count]
+                      for ts, lo, hi, total, count in zip(timestamps, minimums, maximums, sums, counts)]
+            return {"resolution": resolution, "points": points}
+
+    def aggregate(self, device, metric, start=None, end=None):
+        """
+        Mínimo, máximo, media y número de muestras de una serie en un rango, con el nivel más fino que lo cubre.
+        """
+        with self._lock:
+            row = self._series.get((device, metric))
+            if row is None:
+                return None
+            resolution, timestamps, columns = self._select(row, start, end, "auto")
+            if not timestamps.size:
+                return None
+            if resolution == "raw":
+                values = columns[0]
+                return {"resolution": resolution, "min": round(float(values.min()), 4), "max": round(float(values.max()), 4),
+                        "avg": round(float(values.mean()), 4), "count": int(values.size), "last": round(float(values[-1]), 4)}
+            minimums, maximums, sums, counts = columns
+            count = int(counts.sum())
+            return {"resolution": resolution, "min": round(float(minimums.min()), 4), "max": round(float(maximums.max()), 4),
+                    "avg": round(float(sums.sum(dtype=np.float64)) / count, 4), "count": count, "last": None}
+
+    def latest(self, device):
+        """
+        Último valor de cada métrica del dispositivo: {métrica: (instante, valor)}.
+        """
+        with self._lock:
+            latest = {}
+            for metric in self._device_metrics.get(device, []):
+                row = self._series[(device, metric)]
+                if self._raw_count[row]:
+                    last = (self._raw_head[row] - 1) % self.raw_capacity
+                    latest[metric] = (int(self._raw_ts[row, last]) + self.epoch, round(float(self._raw_value[row, last]), 4))
+            return latest
+
+    def summary(self, device, max_metrics=6, window_s=3600):
+        """
+        Resumen corto para el prompt del LLM: último valor y media de la última hora de cada métrica.
+        """
+        latest = self.latest(device)
+        if not latest:
+            return None
+        since = time.time() - window_s
+        parts = []
+        for metric, (_, value) in list(latest.items())[:max_metrics]:
+            stats = None if metric in CUMULATIVE_METRICS else self.aggregate(device, metric, start=since)
+            if stats and stats["count"] > 1 and stats["min"] != stats["max"]:
+                parts.append(f"{metric}={value:g} (media 1 h {stats['avg']:g})")
+            else:
+                parts.append(f"{metric}={value:g}")
+        return ", ".join(parts)
+
+    def stats(self):
+        return {
+            "series": len(self._series),
+            "devices": len(self._device_metrics),
+            "max_series": self.max_series,
+            "max_memory_mb": round(self.max_series * self.bytes_per_series / (1024 * 1024), 1)
+        }
@@ -0,0 +1,206 @@
+import json
+import os
+import numpy as np # Necesario para la matriz de embeddings
+
+class VectorStore:
+    """
+    Almacén de embeddings en formato binario (float32) con acceso por memoria mapeada.
+
+    Los vectores se guardan como filas contiguas en un archivo '.f32' y el índice
+    (colección, clave y fila) se guarda en un archivo JSONL separado. Añadir vectores
+    sólo escribe las filas nuevas y las líneas de índice nuevas; nunca se reescribe
+    el archivo completo salvo en una compactación explícita.
+
+    La cabecera del índice nombra el archivo de vectores al que apuntan sus filas. Cada
+    compactación escribe un archivo de vectores nuevo ('.f32.<generación>') y el índice que
+    lo nombra, y sólo entonces sustituye el índice: el par cambia con un único os.replace.
+    """
+
+    def __init__(self, base_path):
+        self.base_vectors_file = f"{base_path}.f32" # Formato anterior a las generaciones
+        self.vectors_file = self.base_vectors_file # El que nombra el índice (ver load)
+        self.index_file = f"{base_path}.index.jsonl"
+
+        self.dim = None # Dimensión de los embeddings (se fija con el primer vector)
+        self.row_count = 0 # Número de filas escritas en el archivo de vectores
+        self.dead_rows = 0 # Filas sustituidas o eliminadas (recuperables al compactar)
+        self.collections = {} # {coleccion: {clave: vector}}
+        self._matrix = None # Matriz memmap de solo lectura con las filas ya persistidas
+
+    def load(self):
+        """
+        Carga el índice y mapea en memoria el archivo de vectores.
+        Los vectores devueltos son vistas de la matriz mapeada, no copias.
+        """
+        self.collections = {}
+        self.row_count = 0
+        self.dead_rows = 0
+        self._matrix = None
+        self.vectors_file = self.base_vectors_file
+        if not os.path.exists(self.index_file):
+            return False
+
+        rows = {} # {coleccion: {clave: fila}}
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Una línea truncada (ej. corte de luz durante la escritura) se ignora
+                    print(f"WARNING: Línea de índice inválida ignorada en '{self.index_file}'.")
+                    continue
+                if "dim" in record:
+                    self.dim = record["dim"]
+                    if record.get("vectors"):
+                        self.vectors_file = os.path.join(os.path.dirname(self.index_file), record["vectors"])
+                    continue
+                collection_rows = rows.setdefault(record["c"], {})
+                if record["k"] in collection_rows:
+                    self.dead_rows += 1
+                if record.get("r", -1) < 0:
+                    collection_rows.pop(record["k"], None) # Marca de borrado
+                else:
+                    collection_rows[record["k"]] = record["r"]
+
+        if self.dim and os.path.exists(self.vectors_file):
+            # Sólo se consideran filas completas; una escritura parcial al final se descarta
+            self.row_count = os.path.getsize(self.vectors_file) // (self.dim * 4)
+            if self.row_count > 0:
+                self._matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(self.row_count, self.dim))
+
+        for collection, collection_rows in rows.items():
+            self.collections[collection] = {
+                key: self._matrix[row] for key, row in collection_rows.items()
+                if self._matrix is not None and row < self.row_count
+            }
+        self._remove_stale_vector_files()
+        return True
+
+    def _header(self):
+        return json.dumps({"dim": self.dim, "vectors": os.path.basename(self.vectors_file)})
+
+    def _remove_stale_vector_files(self):
+        """
+        Borra los archivos de vectores que el índice ya no nombra (una compactación interrumpida
+        antes o después de sustituir el índice deja uno).
+        """
+        directory = os.path.dirname(self.index_file) or "."
+        if not os.path.isdir(directory):
+            return
+        prefix = os.path.basename(self.base_vectors_file)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(prefix) and os.path.abspath(path) != os.path.abspath(self.vectors_file):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"WARNING: No se pudo borrar el archivo de vectores obsoleto '{path}': {e}")
+
+    def get_collection(self, collection):
+        """
+        Devuelve el diccionario {clave: vector} de una colección (creándolo si no existe).
+        El diccionario devuelto es el mismo objeto que mantiene el almacén.
+        """
+        return self.collections.setdefault(collection, {})
+
+    def append(self, collection, items):
+        """
+        Añade (o sustituye) vectores en una colección escribiendo sólo las filas nuevas.
+        :param collection: Nombre de la colección (ej. 'general_knowledge').
+        :param items: Lista de tuplas (clave, vector).
+        """
+        items = [(key, np.asarray(vector, dtype=np.float32).reshape(-1)) for key, vector in items]
+        if not items:
+            return
+
+        index_lines = []
+        if self.dim is None:
+            self.dim = int(items[0][1].shape[0])
+            index_lines.append(self._header())
+
+        target = self.get_collection(collection)
+        block = np.empty((len(items), self.dim), dtype=np.float32)
+        for i, (key, vector) in enumerate(items):
+            if vector.shape[0] != self.dim:
+                raise ValueError(f"Dimensión de embedding inválida para '{key}': {vector.shape[0]} (se esperaba {self.dim}).")
+            block[i] = vector
+            if key in target:
+                self.dead_rows += 1
+            index_lines.append(json.dumps({"c": collection, "k": key, "r": self.row_count + i}, ensure_ascii=False))
+
+        # Primero los vectores y después el índice: una fila sin índice es inofensiva,
+        # un índice que apunta a una fila inexistente no lo es.
+        with open(self.vectors_file, 'ab') as f:
+            f.write(block.tobytes())
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            f.write("\n".join(index_lines) + "\n")
+
+        for i, (key, _) in enumerate(items):
+            target[key] = block[i]
+        self.row_count += len(items)
+
+    def remove(self, collection, keys):
+        """
+        Elimina claves de una colección añadiendo marcas de borrado al índice.
+        """
+        target = self.get_collection(collection)
+        removed = [key for key in keys if key in target]
+        if not removed:
+            return
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            for key in removed:
+                f.write(json.dumps({"c": collection, "k": key, "r": -1}, ensure_ascii=False) + "\n")
+                del target[key]
+        self.dead_rows += len(removed)
+
+    def compact(self):
+        """
+        Reescribe ambos archivos con sólo las filas vivas, de forma atómica: el archivo de
+        vectores de la nueva generación no lo usa nadie hasta que el índice que lo nombra
+        sustituye al anterior, y un corte antes deja intacto el par antiguo.
+        Se usa al limpiar la memoria o cuando las filas muertas dominan el archivo.
+        """
+        live = [(collection, key, vector) for collection, vectors in self.collections.items() for key, vector in vectors.items()]
+        suffix = self.vectors_file[len(self.base_vectors_file) + 1:]
+        new_vectors = f"{self.base_vectors_file}.{int(suffix) + 1 if suffix.isdigit() else 1}"
+        tmp_index = f"{self.index_file}.tmp"
+
+        with open(new_vectors, 'wb') as vf, open(tmp_index, 'w', encoding='utf-8') as ixf:
+            if self.dim is not None:
+                ixf.write(json.dumps({"dim": self.dim, "vectors": os.path.basename(new_vectors)}) + "\n")
+            for row, (collection, key, vector) in enumerate(live):
+                vf.write(np.asarray(vector, dtype=np.float32).tobytes())
+                ixf.write(json.dumps({"c": collection, "k": key, "r": row}, ensure_ascii=False) + "\n")
+            vf.flush()
+            os.fsync(vf.fileno())
+            ixf.flush()
+            os.fsync(ixf.fileno())
+
+        # Soltar las vistas del memmap anterior antes de sustituir el archivo
+        self.collections = {collection: {key: np.array(vector, dtype=np.float32) for key, vector in vectors.items()}
+                            for collection, vectors in self.collections.items()}
+        self._matrix = None
+        os.replace(tmp_index, self.index_file) # Punto de cambio: a partir de aquí vale la nueva generación
+        self.load() # Borra también el archivo de vectores anterior
+
+    def clear(self):
+        """
+        Elimina todos los vectores de todas las colecciones.
+        """
+        self.collections = {}
+        self._matrix = None
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+        self.vectors_file = self.base_vectors_file
+        self._remove_stale_vector_files()
+        if os.path.exists(self.vectors_file):
+            os.remove(self.vectors_file)
+        self.dim = None
+        self.row_count = 0
+        self.dead_rows = 0
+
+    def needs_compaction(self):
+        return self.row_count > 1000 and self.dead_rows > self.row_count // 2
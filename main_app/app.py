@@ -1,17 +1,31 @@
 import asyncio
+import hmac
 import os
 import uuid
 import logging
 import time
-import requests
+import threading
+import httpx
 import json
-from flask import Flask, render_template, request, jsonify
+from collections import deque
+from flask import Flask, Response, g, render_template, request, jsonify
 
 from core_logic.mqtt_client import MQTTClient
 from core_logic.home_assistant_api import HomeAssistantAPI
 from core_logic.neuron_network import RedNeuronal 
+from core_logic.embedding_engine import LocalEmbeddingEngine
+from core_logic.telemetry_store import TelemetryStore
+from core_logic.rules_engine import RulesEngine
+from core_logic.command_scheduler import CommandScheduler
+from core_logic.state_backend import create_state_backend
+from core_logic.knowledge_manager import KnowledgeManager, embedding_artifact_path
+from core_logic.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE, TRACE_HEADER, current_trace_id, new_trace_id
+from core_logic.profiler import PROFILER
+from core_logic.log_pipeline import REDACTOR, SECRET_KEY_PATTERN, redact_mapping, setup_logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Registro asíncrono: el hilo de la petición sólo encola; la escritura (y la redacción de secretos) va en segundo plano
+LOG_PIPELINE = setup_logging("main_app", "smart_home")
 
 app = Flask(__name__)
 
@@ -19,10 +33,29 @@ app = Flask(__name__)
 mqtt_client_global = None
 home_assistant_api_global = None
 neuron_network_global = None
+knowledge_manager_global = None
+state_backend_global = None # Interacciones pendientes, memoria y registro de entidades (compartidos entre réplicas con 'sqlite')
+shared_state_task = None
+telemetry_store_global = None # Series de telemetría de Tasmota (tele/+/STATE)
+rules_engine_global = None # Automatizaciones locales sobre el flujo MQTT (knowledge/rules.json)
+command_scheduler_global = None # Fusión y límite de frecuencia de los comandos a dispositivos
 config_global = {}
 
-# Lista para almacenar los logs
-system_logs = []
+# Identificador de esta réplica (titular de la concesión de descubrimiento)
+REPLICA_ID = os.environ.get('REPLICA_ID') or f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+DISCOVERY_LEASE_TTL_S = 15 # Si la réplica que consume el descubrimiento cae, otra la sustituye tras este tiempo
+
+# Cookie (o cabecera) que identifica la conversación de cada usuario para /confirm_save
+SESSION_COOKIE = "smart_home_session"
+SESSION_HEADER = "X-Session-Id"
+
+# Bucle de eventos único de la aplicación. Los clientes asíncronos (ML Server, Gemini)
+# se crean sobre él y viven durante todo el proceso; las rutas de Flask le envían corrutinas.
+app_loop = None
+app_loop_thread_id = None # Hilo que ejecuta app_loop (el perfilador lo muestrea junto al de la petición)
+
+# Últimos mensajes del sistema para la interfaz (/status devuelve los 100 más recientes)
+system_logs = deque(maxlen=1000)
 
 # Función para añadir mensajes al log del sistema
 def add_log_entry(message, level='info', source='System'):
@@ -36,7 +69,8 @@ def add_log_entry(message, level='info', source='System'):
     elif level == 'warning':
         python_log_level = logging.WARNING
 
-    logging.log(python_log_level, message)
+    # stacklevel=2: el origen (y su límite de frecuencia) es quien llama a add_log_entry
+    logging.log(python_log_level, message, extra={"source": source}, stacklevel=2)
 
 def load_config():
     global config_global
@@ -48,7 +82,29 @@ def load_config():
         "mqtt_username": "",
         "mqtt_password": "",
         "ml_server_ip": "ml_server", # <-- ¡CORREGIDO! Valor por defecto para comunicación entre contenedores
-        "gemini_api_key": "" 
+        "ml_server_port": 5001,
+        "gemini_api_key": "",
+        "gemini_api_base": "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash",
+        "embedding_model": "paraphrase-multilingual-MiniLM-L12-v2", # Debe coincidir con el modelo del ML Server
+        "embedding_mode": "remote", # 'remote' (ML Server) o 'embedded' (modelo en este proceso, un solo equipo)
+        "embedding_threads": 1, # Hilos de codificación en modo 'embedded'
+        "request_deadline_s": 20, # Plazo total de un comando (embedding + LLM + ejecución)
+        "device_top_k": 25, # Entidades relevantes incluidas en el prompt de Gemini (0 = todas)
+        "llm_hedge_delay_ms": 100, # Espera a la búsqueda local antes de lanzar también Gemini (-1 = en serie)
+        "state_backend": "memory", # 'memory' (una réplica) o 'sqlite' (varias réplicas con el mismo volumen)
+        "state_backend_path": "./knowledge/shared_state.sqlite3",
+        "discovery_role": "auto", # 'auto' (concesión en el estado compartido), 'leader' o 'follower'
+        "state_sync_interval_s": 2, # Frecuencia de renovación de la concesión y de copia del registro de entidades
+        "telemetry_max_series": 20000, # Series (dispositivo, métrica) de telemetría; fija la memoria máxima del almacén
+        "rules_file": "./knowledge/rules.json", # Automatizaciones locales (se recargan al cambiar el archivo)
+        "command_coalesce_window_ms": 200, # Comandos a una misma entidad dentro de la ventana: sólo sale el último
+        "command_device_rate_per_s": 4, # Comandos por segundo por dispositivo (0 = sin límite)
+        "command_broker_rate_per_s": 100, # Comandos por segundo en total hacia el broker (0 = sin límite)
+        "memory_capacity": 5000, # Entradas máximas de la memoria conversacional (0 = sin límite)
+        "learned_capacity": 10000, # Respuestas aprendidas máximas (0 = sin límite)
+        "memory_half_life_days": 14, # Cada cuánto pierde la mitad de su peso un acierto (expulsión LFU con envejecimiento)
+        "admin_token": "", # Vacío = endpoints /admin deshabilitados
+        "profiler_sample_one_in": 0 # 0 = perfilado por petición desactivado
     }
 
     file_config = {}
@@ -72,15 +128,65 @@ def load_config():
     # Asegurarse de que ML_SERVER_INTERNAL_IP sobrescriba si está presente
     config_global['ml_server_ip'] = os.environ.get('ML_SERVER_INTERNAL_IP', config_global['ml_server_ip'])
     config_global['gemini_api_key'] = os.environ.get('GEMINI_API_KEY', config_global['gemini_api_key'])
-
-    add_log_entry(f"Configuración final: {config_global}", 'info')
-
+    config_global['embedding_mode'] = os.environ.get('EMBEDDING_MODE', config_global['embedding_mode'])
+    config_global['embedding_model'] = os.environ.get('EMBEDDING_MODEL', config_global['embedding_model'])
+    config_global['admin_token'] = os.environ.get('ADMIN_TOKEN', config_global['admin_token'])
+    config_global['state_backend'] = os.environ.get('STATE_BACKEND', config_global['state_backend'])
+    config_global['state_backend_path'] = os.environ.get('STATE_BACKEND_PATH', config_global['state_backend_path'])
+    config_global['discovery_role'] = os.environ.get('DISCOVERY_ROLE', config_global['discovery_role'])
+    config_global['profiler_sample_one_in'] = int(os.environ.get('PROFILER_SAMPLE_ONE_IN', config_global['profiler_sample_one_in']))
+    PROFILER.enable_request_sampling(config_global['profiler_sample_one_in'])
+
+    for key, value in config_global.items():
+        if SECRET_KEY_PATTERN.search(key):
+            REDACTOR.add_secret(value)
+    add_log_entry(f"Configuración final: {redact_mapping(config_global)}", 'info')
+
+
+def start_app_loop():
+    """
+    Crea el bucle de eventos de la aplicación en un hilo dedicado (modo WSGI/desarrollo).
+    En modo ASGI (main_app/asgi.py) se usa directamente el bucle del servidor.
+    """
+    global app_loop, app_loop_thread_id
+    app_loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=app_loop.run_forever, name="app-event-loop", daemon=True)
+    loop_thread.start()
+    app_loop_thread_id = loop_thread.ident
+    return app_loop
+
+async def _run_with_trace_id(coro, trace_id):
+    current_trace_id.set(trace_id) # Sólo afecta al contexto de la tarea que ejecuta la corrutina
+    return await coro
+
+def run_on_app_loop(coro, timeout=None):
+    """
+    Ejecuta una corrutina en el bucle de eventos de la aplicación y espera su resultado
+    desde el hilo de la petición. Las corrutinas de peticiones concurrentes se solapan en el bucle.
+    El identificador de traza de la petición se propaga a la corrutina.
+    """
+    return asyncio.run_coroutine_threadsafe(_run_with_trace_id(coro, current_trace_id.get()), app_loop).result(timeout)
+
+def iterate_on_app_loop(async_gen):
+    """
+    Consume un generador asíncrono que corre en el bucle de la aplicación desde el hilo de la petición.
+    """
+    try:
+        while True:
+            try:
+                yield run_on_app_loop(async_gen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_on_app_loop(async_gen.aclose())
 
 async def initialize_system_async():
-    global mqtt_client_global, home_assistant_api_global, neuron_network_global
+    global mqtt_client_global, home_assistant_api_global, neuron_network_global, knowledge_manager_global, state_backend_global, shared_state_task, telemetry_store_global, rules_engine_global, command_scheduler_global
 
-    add_log_entry("Esperando 30 segundos para asegurar que ML Server se inicie completamente...", 'info')
-    await asyncio.sleep(30) 
+    embedded = config_global.get("embedding_mode") == "embedded"
+    if not embedded:
+        add_log_entry("Esperando 30 segundos para asegurar que ML Server se inicie completamente...", 'info')
+        await asyncio.sleep(30) 
 
     add_log_entry("Initializing MQTT client...", 'info')
     mqtt_client_global = MQTTClient(
@@ -94,43 +200,235 @@ async def initialize_system_async():
     mqtt_client_global.connect()
     mqtt_client_global.loop_start()
 
+    add_log_entry(f"Initializing state backend '{config_global['state_backend']}' (réplica {REPLICA_ID})...", 'info')
+    state_backend_global = create_state_backend(config_global["state_backend"], config_global["state_backend_path"])
+
+    telemetry_store_global = TelemetryStore(max_series=int(config_global.get("telemetry_max_series", 20000)))
+    add_log_entry(f"Almacén de telemetría: {telemetry_store_global.stats()['max_memory_mb']} MB como máximo.", 'info')
+
+    command_scheduler_global = CommandScheduler(
+        mqtt_client_global.publish,
+        coalesce_window_s=float(config_global.get("command_coalesce_window_ms", 200)) / 1000,
+        device_rate_per_s=float(config_global.get("command_device_rate_per_s", 4)),
+        broker_rate_per_s=float(config_global.get("command_broker_rate_per_s", 100))
+    )
+
     add_log_entry("Initializing Home Assistant API...", 'info')
-    home_assistant_api_global = HomeAssistantAPI(mqtt_client=mqtt_client_global)
+    home_assistant_api_global = HomeAssistantAPI(mqtt_client=mqtt_client_global, state_backend=state_backend_global,
+                                                 telemetry_store=telemetry_store_global, command_scheduler=command_scheduler_global)
+    home_assistant_api_global.consume_discovery = acquire_discovery_role()
+    if not home_assistant_api_global.consume_discovery:
+        add_log_entry("Otra réplica consume el descubrimiento; el registro de entidades se copia del estado compartido.", 'info')
+        home_assistant_api_global.sync_from_state()
+    rules_engine_global = RulesEngine(home_assistant_api_global, rules_file=config_global.get("rules_file", "./knowledge/rules.json"))
+    home_assistant_api_global.rules_engine = rules_engine_global
     mqtt_client_global.message_callback = home_assistant_api_global.process_mqtt_message
     
     mqtt_client_global.subscribe_to_all_ha_topics("homeassistant") 
+    rules_engine_global.subscribe_topics(mqtt_client_global, ("homeassistant/#", "tasmota/discovery/+/config", "tele/+/STATE", "stat/+/POWER"))
+    if state_backend_global.shared:
+        shared_state_task = asyncio.ensure_future(shared_state_loop())
+
+    add_log_entry("Initializing Knowledge Manager...", 'info')
+    # Estado propio (knowledge_state.json) para no pisar la memoria de RedNeuronal (network_state.json)
+    memory_half_life_s = float(config_global.get("memory_half_life_days", 14)) * 86400
+    knowledge_manager_global = KnowledgeManager(base_dir='./knowledge', state_file_name='knowledge_state.json',
+                                                learned_capacity=int(config_global.get("learned_capacity", 0)),
+                                                learned_half_life_s=memory_half_life_s)
+    knowledge_manager_global.apply_embedding_artifact(
+        embedding_artifact_path('./knowledge', config_global["embedding_model"]), config_global["embedding_model"]
+    )
+
+    embedding_engine = None
+    if embedded:
+        # El modelo se carga en el primer embedding, en el pool de hilos del motor
+        add_log_entry(f"Embeddings en proceso con el modelo '{config_global['embedding_model']}' (sin ML Server).", 'info')
+        embedding_engine = LocalEmbeddingEngine(config_global["embedding_model"], max_workers=int(config_global.get("embedding_threads", 1)))
 
     add_log_entry("Initializing Neuron Network...", 'info')
+    hedge_delay_ms = float(config_global.get("llm_hedge_delay_ms", 100))
     neuron_network_global = RedNeuronal(
         ml_server_ip=config_global["ml_server_ip"],
         gemini_api_key=config_global["gemini_api_key"],
-        home_assistant_api=home_assistant_api_global
+        home_assistant_api=home_assistant_api_global,
+        gemini_api_base=config_global.get("gemini_api_base"),
+        ml_server_port=int(config_global.get("ml_server_port", 5001)),
+        knowledge_manager=knowledge_manager_global,
+        request_deadline_s=float(config_global.get("request_deadline_s", 20)),
+        device_top_k=int(config_global.get("device_top_k", 25)),
+        state_backend=state_backend_global,
+        embedding_engine=embedding_engine,
+        memory_capacity=int(config_global.get("memory_capacity", 0)),
+        memory_half_life_s=memory_half_life_s,
+        llm_hedge_delay_s=hedge_delay_ms / 1000 if hedge_delay_ms >= 0 else None
     )
-    test_embedding_text = "test..."
-    for i in range(1, 6):
-        add_log_entry(f"Solicitando embedding para '{test_embedding_text}' al ML Server en http://{config_global['ml_server_ip']}:5001/get_embedding (Intento {i}/5)", 'info')
-        try:
-            test_embedding = await neuron_network_global.get_embedding(test_embedding_text)
-            if test_embedding:
-                add_log_entry("Embedding recibido exitosamente del ML Server.", 'info')
-                break
-        except requests.exceptions.ConnectionError as e:
-            add_log_entry(f"Error de conexión con ML Server: {e}", 'error')
-            if i == 5:
-                add_log_entry("Máximo de reintentos alcanzado para ML Server.", 'error')
-                add_log_entry("Fallo al conectar con ML Server. La IA puede no funcionar correctamente.", 'error')
-                add_log_entry("No se pudo establecer conexión con ML Server. La IA no funcionará correctamente.", 'error')
-            await asyncio.sleep(5) 
-        except Exception as e:
-            add_log_entry(f"Error inesperado al conectar con ML Server: {e}", 'error')
-            if i == 5:
-                add_log_entry("Fallo al conectar con ML Server. La IA puede no funcionar correctamente.", 'error')
-            await asyncio.sleep(5) 
+    await neuron_network_global.start()
+    if embedded:
+        await precompute_knowledge_embeddings()
+    else:
+        test_embedding_text = "test..."
+        for i in range(1, 6):
+            add_log_entry(f"Solicitando embedding para '{test_embedding_text}' al ML Server en http://{config_global['ml_server_ip']}:{config_global['ml_server_port']}/get_embedding (Intento {i}/5)", 'info')
+            try:
+                test_embedding = await neuron_network_global.get_embedding(test_embedding_text)
+                if test_embedding:
+                    add_log_entry("Embedding recibido exitosamente del ML Server.", 'info')
+                    await precompute_knowledge_embeddings()
+                    break
+            except httpx.ConnectError as e:
+                add_log_entry(f"Error de conexión con ML Server: {e}", 'error')
+                if i == 5:
+                    add_log_entry("Máximo de reintentos alcanzado para ML Server.", 'error')
+                    add_log_entry("Fallo al conectar con ML Server. La IA puede no funcionar correctamente.", 'error')
+                    add_log_entry("No se pudo establecer conexión con ML Server. La IA no funcionará correctamente.", 'error')
+                await asyncio.sleep(5) 
+            except Exception as e:
+                add_log_entry(f"Error inesperado al conectar con ML Server: {e}", 'error')
+                if i == 5:
+                    add_log_entry("Fallo al conectar con ML Server. La IA puede no funcionar correctamente.", 'error')
+                await asyncio.sleep(5) 
 
     add_log_entry("System initialization complete.", 'info')
 
+async def precompute_knowledge_embeddings():
+    """
+    Calcula en pocos lotes los embeddings que falten (los que no vinieron en el artefacto).
+    """
+    missing = knowledge_manager_global.find_missing_embeddings()
+    if not missing:
+        add_log_entry("Índice de conocimiento completo: no hay embeddings pendientes.", 'info')
+        return
+    try:
+        computed = await knowledge_manager_global.precompute_embeddings(neuron_network_global.get_embeddings)
+        add_log_entry(f"Embeddings de conocimiento precalculados: {computed}.", 'info')
+    except Exception as e:
+        add_log_entry(f"No se pudieron precalcular los embeddings de conocimiento: {e}", 'error')
+
+def acquire_discovery_role():
+    """
+    Indica si esta réplica debe consumir el descubrimiento MQTT. Con estado local siempre; con estado
+    compartido según 'discovery_role' o, en 'auto', si obtiene (o renueva) la concesión 'discovery'.
+    """
+    role = config_global.get("discovery_role", "auto")
+    if not state_backend_global.shared or role == "leader":
+        return True
+    if role == "follower":
+        return False
+    return state_backend_global.try_acquire_lease("discovery", REPLICA_ID, DISCOVERY_LEASE_TTL_S)
+
+async def shared_state_loop():
+    """
+    Renueva la concesión de descubrimiento y, mientras otra réplica la tenga, copia su registro de entidades.
+    """
+    interval = float(config_global.get("state_sync_interval_s", 2))
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # SQLite puede esperar al cerrojo de escritura de otra réplica: fuera del bucle de la aplicación
+            consume = await loop.run_in_executor(None, acquire_discovery_role)
+            if consume and not home_assistant_api_global.consume_discovery:
+                add_log_entry("Esta réplica pasa a consumir el descubrimiento MQTT.", 'warning')
+                home_assistant_api_global.consume_discovery = True
+                # Volver a suscribirse entrega de nuevo los mensajes de configuración retenidos
+                mqtt_client_global.subscribe_to_all_ha_topics("homeassistant")
+            elif not consume and home_assistant_api_global.consume_discovery:
+                add_log_entry("Otra réplica ha tomado el descubrimiento MQTT.", 'warning')
+                home_assistant_api_global.consume_discovery = False
+            if not consume:
+                await loop.run_in_executor(None, home_assistant_api_global.sync_from_state)
+        except Exception as e:
+            add_log_entry(f"Error al sincronizar el estado compartido: {e}", 'error')
+
+async def shutdown_system_async():
+    """
+    Cierra los clientes que viven en el bucle de eventos de la aplicación.
+    """
+    if shared_state_task:
+        shared_state_task.cancel()
+    if neuron_network_global:
+        neuron_network_global.save_memory() # Instantánea con los aciertos de cada entrada (no van al diario)
+        await neuron_network_global.aclose()
+    if knowledge_manager_global:
+        knowledge_manager_global.save_state()
+    if command_scheduler_global:
+        command_scheduler_global.close()
+    if mqtt_client_global:
+        mqtt_client_global.loop_stop()
+    if state_backend_global:
+        state_backend_global.close()
+    add_log_entry("System shutdown complete.", 'info')
+
 load_config()
 
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("smart_home_http_request_seconds", "Duración de las peticiones HTTP de main_app.", ("endpoint",))
+
+# Rutas que admiten perfilado por muestreo de 1 de cada N peticiones
+PROFILED_ENDPOINTS = ("enviar_comando", "enviar_comando_stream")
+
+@app.before_request
+def assign_trace_id():
+    # Reutilizar el identificador del cliente si lo envía, para poder seguir la petición de punta a punta
+    g.trace_id = request.headers.get(TRACE_HEADER) or new_trace_id()
+    g.session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    g.new_session = g.session_id is None
+    if g.new_session:
+        g.session_id = uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    current_trace_id.set(g.trace_id)
+    if request.endpoint in PROFILED_ENDPOINTS and PROFILER.should_profile_request():
+        # El trabajo de la petición corre en el bucle de la aplicación: muestrear ambos hilos
+        g.profile_scope = PROFILER.track([threading.get_ident(), app_loop_thread_id])
+        g.profile_scope.__enter__()
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profile_scope = g.pop('profile_scope', None)
+    if profile_scope is not None:
+        profile_scope.__exit__(None, None, None)
+
+@app.after_request
+def record_request(response):
+    response.headers[TRACE_HEADER] = g.trace_id
+    if g.new_session:
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite='Lax')
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or "desconocido")
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def _admin_authorized():
+    admin_token = config_global.get("admin_token") or ""
+    return bool(admin_token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token)
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """
+    Controla el perfilador por muestreo. POST con {"mode": "window", "seconds": N},
+    {"mode": "requests", "one_in": N} o {"mode": "off"}. GET devuelve el estado.
+    """
+    if not _admin_authorized():
+        return jsonify({"status": "error", "message": "No autorizado."}), 403
+    if request.method == 'POST':
+        try:
+            mode = PROFILER.control(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        add_log_entry(f"Perfilador: modo '{mode}' activado.", 'info', 'Admin')
+    return jsonify({"status": "success", "profiler": PROFILER.status()})
+
+@app.route('/admin/profiler/stacks')
+def admin_profiler_stacks():
+    """
+    Descarga las pilas agregadas en formato "collapsed" (flamegraph.pl / speedscope).
+    """
+    if not _admin_authorized():
+        return jsonify({"status": "error", "message": "No autorizado."}), 403
+    collapsed = PROFILER.collapsed(reset=request.args.get('reset') == '1')
+    return Response(collapsed, mimetype='text/plain', headers={'Content-Disposition': 'attachment; filename=main_app.collapsed.txt'})
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -147,19 +445,74 @@ def obtener_log():
     except ImportError:
         system_stats = [{"tipo": "Sistema: Estadísticas no disponibles", "valor": "psutil no instalado"}]
 
+    if neuron_network_global:
+        coalescing_stats = neuron_network_global.get_coalescing_stats()
+        system_stats.append({"tipo": "Sistema: Peticiones coalescidas (embedding)", "valor": coalescing_stats["embedding"]["coalesced"]})
+        system_stats.append({"tipo": "Sistema: Peticiones coalescidas (LLM)", "valor": coalescing_stats["llm"]["coalesced"]})
+        for name, breaker_stats in neuron_network_global.get_breaker_stats().items():
+            system_stats.append({"tipo": f"Sistema: Circuito {name}", "valor": breaker_stats["state"]})
+    if command_scheduler_global:
+        command_stats = command_scheduler_global.stats()
+        system_stats.append({"tipo": "Sistema: Comandos fusionados", "valor": command_stats["coalesced"]})
+        system_stats.append({"tipo": "Sistema: Comandos retrasados (límite)", "valor": command_stats["throttled"]})
+        system_stats.append({"tipo": "Sistema: Comandos sin cambio (no enviados)", "valor": command_stats["unchanged"]})
+
     return jsonify({
-        "log": system_logs[-100:], 
+        "log": [{**entry, "mensaje": REDACTOR.redact(entry["mensaje"])} for entry in list(system_logs)[-100:]],
         "estado_red": system_stats,
         "discovered_entities": home_assistant_api_global.ha_entity_info,
         "tasmota_map": home_assistant_api_global.tasmota_command_map
     })
 
+@app.route('/telemetria')
+def telemetria():
+    """
+    Sin parámetros: dispositivos con telemetría y su último valor por métrica.
+    Con ?device=X&metric=Y: puntos de la serie (start/end en segundos Unix, resolution raw|1m|1h|auto)
+    y sus agregados en el mismo rango.
+    """
+    if telemetry_store_global is None:
+        return jsonify({"status": "error", "message": "Telemetría no inicializada."}), 503
+    device = request.args.get('device')
+    metric = request.args.get('metric')
+    if not device:
+        return jsonify({"status": "success", "devices": {name: telemetry_store_global.latest(name) for name in telemetry_store_global.devices()},
+                        "stats": telemetry_store_global.stats()})
+    if not metric:
+        return jsonify({"status": "success", "device": device, "latest": telemetry_store_global.latest(device)})
+    try:
+        start = float(request.args['start']) if 'start' in request.args else None
+        end = float(request.args['end']) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "'start' y 'end' deben ser segundos Unix."}), 400
+    resolution = request.args.get('resolution', 'auto')
+    if resolution not in ('auto', 'raw', '1m', '1h'):
+        return jsonify({"status": "error", "message": "Resolución desconocida. Usa 'raw', '1m', '1h' o 'auto'."}), 400
+    series = telemetry_store_global.query(device, metric, start, end, resolution)
+    if series is None:
+        return jsonify({"status": "error", "message": f"No hay telemetría '{metric}' para '{device}'."}), 404
+    return jsonify({"status": "success", "device": device, "metric": metric, **series,
+                    "aggregate": telemetry_store_global.aggregate(device, metric, start, end)})
+
+@app.route('/reglas')
+def reglas():
+    """
+    Reglas de automatización cargadas y contadores de evaluación (las reglas se editan en knowledge/rules.json
+    y se recargan solas al cambiar el archivo).
+    """
+    if rules_engine_global is None:
+        return jsonify({"status": "error", "message": "Motor de reglas no inicializado."}), 503
+    rules_engine_global.refresh_if_changed()
+    return jsonify({"status": "success", "rules": [{"id": rule.rule_id, "trigger": rule.topic or rule.entity_id, "actions": len(rule.actions)}
+                                                   for rule in rules_engine_global.rules],
+                    "stats": rules_engine_global.stats()})
+
 @app.route('/get_config_data')
 def get_config_data():
-    return jsonify(config_global)
+    return jsonify({k: v for k, v in config_global.items() if k != "admin_token"})
 
 @app.route('/enviar_comando', methods=['POST'])
-async def enviar_comando():
+def enviar_comando():
     data = request.json
     comando_usuario = data.get('comando', '').strip()
     
@@ -168,13 +521,14 @@ async def enviar_comando():
 
     add_log_entry(f"Tú: {comando_usuario}", 'comando', 'User') 
 
-    response_from_ia = await neuron_network_global.process_command(comando_usuario)
+    # El comando respeta su propio plazo; el margen extra sólo protege el hilo de la petición
+    response_from_ia = run_on_app_loop(neuron_network_global.process_command(comando_usuario, g.session_id), timeout=neuron_network_global.request_deadline_s + 5)
     add_log_entry(f"IA: {response_from_ia['response_text']}", 'ia', 'AI') 
 
     # Determinar si se debe ofrecer guardar la interacción
     # Solo ofrecer guardar si la IA generó una respuesta de texto y no un comando HA
     should_offer_to_save = response_from_ia.get("action_type") == "text_response" and \
-                           neuron_network_global.last_interaction is not None
+                           neuron_network_global.has_pending_interaction(g.session_id)
 
     return jsonify({
         "status": "success",
@@ -182,20 +536,84 @@ async def enviar_comando():
         "should_offer_to_save": should_offer_to_save
     })
 
+@app.route('/enviar_comando_stream', methods=['POST'])
+def enviar_comando_stream():
+    """
+    Igual que /enviar_comando, pero devuelve NDJSON: líneas 'delta' con texto parcial
+    a medida que Gemini lo genera y una línea 'final' con la respuesta completa.
+    """
+    data = request.json
+    comando_usuario = data.get('comando', '').strip()
+
+    if not comando_usuario:
+        return jsonify({"status": "error", "message": "Comando vacío.", "should_offer_to_save": False})
+
+    add_log_entry(f"Tú: {comando_usuario}", 'comando', 'User')
+
+    session_id = g.session_id # El generador se consume fuera del contexto de la petición
+
+    def generate():
+        for event in iterate_on_app_loop(neuron_network_global.process_command_stream(comando_usuario, session_id)):
+            if event["type"] == "final":
+                add_log_entry(f"IA: {event['response_text']}", 'ia', 'AI')
+                event["status"] = "success"
+                event["should_offer_to_save"] = event.get("action_type") == "text_response" and \
+                                                neuron_network_global.has_pending_interaction(session_id)
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    response = Response(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # El cuerpo se genera después de teardown_request: el perfilado de la petición termina al cerrar la respuesta
+    profile_scope = g.pop('profile_scope', None)
+    if profile_scope is not None:
+        response.call_on_close(lambda: profile_scope.__exit__(None, None, None))
+    return response
+
 @app.route('/confirm_save', methods=['POST'])
-async def confirm_save():
+def confirm_save():
     data = request.json
     choice = data.get('choice')
 
     if choice == 'yes':
-        await neuron_network_global.save_last_interaction()
+        run_on_app_loop(neuron_network_global.save_last_interaction(g.session_id))
         add_log_entry("Interacción guardada en la memoria de la IA.", 'info', 'System')
         return jsonify({"status": "success", "message": "Interacción guardada."})
     else:
-        neuron_network_global.discard_last_interaction()
+        neuron_network_global.discard_last_interaction(g.session_id)
         add_log_entry("Interacción descartada.", 'info', 'System')
         return jsonify({"status": "success", "message": "Interacción descartada."})
 
+@app.route('/memoria')
+def memoria():
+    """
+    Uso de la memoria conversacional y de las respuestas aprendidas: aciertos, expulsiones,
+    las entradas más útiles (?top=N) y cuántas no se han usado nunca.
+    """
+    if neuron_network_global is None or knowledge_manager_global is None:
+        return jsonify({"status": "error", "message": "Sistema no inicializado."}), 503
+    top = request.args.get('top', 10, type=int)
+    return jsonify({"status": "success", "memory": neuron_network_global.get_memory_stats(top),
+                    "learned_responses": knowledge_manager_global.get_learned_stats(top)})
+
+@app.route('/memoria/fijar', methods=['POST'])
+def fijar_memoria():
+    """
+    Fija (o libera con "pinned": false) una entrada para que nunca se expulse.
+    Cuerpo: {"store": "memory" | "learned_responses", "key": comando o pregunta, "pinned": true}
+    """
+    if neuron_network_global is None or knowledge_manager_global is None:
+        return jsonify({"status": "error", "message": "Sistema no inicializado."}), 503
+    data = request.json or {}
+    store, key, pinned = data.get('store', 'memory'), data.get('key'), bool(data.get('pinned', True))
+    if not key or store not in ('memory', 'learned_responses'):
+        return jsonify({"status": "error", "message": "Se necesita 'key' y 'store' ('memory' o 'learned_responses')."}), 400
+    if store == 'memory':
+        found = neuron_network_global.pin_memory(key, pinned)
+    else:
+        found = knowledge_manager_global.pin_learned_response(key, pinned)
+    if not found:
+        return jsonify({"status": "error", "message": f"'{key}' no está en '{store}'."}), 404
+    return jsonify({"status": "success", "store": store, "key": key, "pinned": pinned})
+
 @app.route('/config')
 def config_page():
     # Pasa el objeto de configuración global a la plantilla
@@ -210,7 +628,11 @@ def save_configuration():
     try:
         # Actualizar solo los campos proporcionados, manteniendo los demás
         for key, value in new_config.items():
+            if key == "admin_token":
+                continue # El token de administración sólo se configura en el archivo o en el entorno
             config_global[key] = value
+            if SECRET_KEY_PATTERN.search(key):
+                REDACTOR.add_secret(value) # Una clave nueva tampoco debe aparecer en los logs
         
         with open(config_path, 'w') as f:
             json.dump(config_global, f, indent=4)
@@ -222,5 +644,8 @@ def save_configuration():
 
 
 if __name__ == '__main__':
-    asyncio.run(initialize_system_async())
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Modo de desarrollo (WSGI): el bucle de la aplicación corre en su propio hilo.
+    # Para producción usar el modo ASGI: uvicorn main_app.asgi:asgi_app
+    start_app_loop()
+    run_on_app_loop(initialize_system_async())
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False, threaded=True)
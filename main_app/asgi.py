@@ -0,0 +1,44 @@
+# asgi.py (ubicado en ~/Smart-Home-AI/main_app/asgi.py)
+#
+# Modo de servicio ASGI: uvicorn main_app.asgi:asgi_app --host 0.0.0.0 --port 5000
+# El bucle de eventos del servidor es el bucle único de la aplicación. Las rutas de Flask
+# se ejecutan en un pool de hilos (a2wsgi) y envían sus corrutinas a este bucle, donde viven
+# los clientes de MQTT, ML Server y Gemini durante toda la vida del proceso.
+
+import asyncio
+import os
+import threading
+from a2wsgi import WSGIMiddleware
+
+import main_app.app as smart_home_app
+
+class SmartHomeASGI:
+    def __init__(self, flask_app):
+        # Cada petición en curso ocupa un hilo mientras espera su corrutina en el bucle
+        worker_threads = int(os.environ.get('ASGI_WORKER_THREADS', 64))
+        self.wsgi_app = WSGIMiddleware(flask_app, workers=worker_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    smart_home_app.app_loop = asyncio.get_running_loop()
+                    smart_home_app.app_loop_thread_id = threading.get_ident()
+                    await smart_home_app.initialize_system_async()
+                    await send({"type": "lifespan.startup.complete"})
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+            elif message["type"] == "lifespan.shutdown":
+                await smart_home_app.shutdown_system_async()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+asgi_app = SmartHomeASGI(smart_home_app.app)
@@ -17,6 +17,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const messageBoxCloseButton = document.getElementById('messageBoxCloseButton');
 
     let isSavingConfirmed = false; // Bandera para evitar múltiples envíos de confirmación
+    let isStreamingResponse = false; // Mientras llega una respuesta en streaming no se repinta el log
 
     // Función para mostrar mensajes en un cuadro de diálogo personalizado
     function showMessageBox(message) {
@@ -59,9 +60,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
             // Actualizar Log
             // Limpiar logDisplay antes de añadir nuevos logs para evitar duplicados
-            logDisplay.innerHTML = ''; 
-            data.log.forEach(entry => addLogEntryToUI(entry));
-            logDisplay.scrollTop = logDisplay.scrollHeight; // Auto-scroll al final
+            if (!isStreamingResponse) {
+                logDisplay.innerHTML = ''; 
+                data.log.forEach(entry => addLogEntryToUI(entry));
+                logDisplay.scrollTop = logDisplay.scrollHeight; // Auto-scroll al final
+            }
 
             // Actualizar Información del Sistema
             systemInfoSection.innerHTML = '';
@@ -139,17 +142,48 @@ document.addEventListener('DOMContentLoaded', () => {
         addLogEntryToUI({ tiempo: new Date().toISOString().slice(0, 19).replace('T', ' '), tipo: 'comando', fuente: 'User', mensaje: command });
         commandInput.value = ''; // Limpiar el input
 
+        isStreamingResponse = true;
         try {
-            const response = await fetch('/enviar_comando', {
+            // Respuesta en streaming (NDJSON): el texto de la IA se muestra a medida que llega
+            const response = await fetch('/enviar_comando_stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ comando: command })
             });
-            const data = await response.json();
-            
+            const iaEntry = { tiempo: new Date().toISOString().slice(0, 19).replace('T', ' '), tipo: 'ia', fuente: 'AI', mensaje: '' };
+            addLogEntryToUI(iaEntry);
+            const iaDiv = logDisplay.lastElementChild;
+            const iaText = document.createElement('span');
+            iaDiv.appendChild(iaText);
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffered = '';
+            let data = null;
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffered += decoder.decode(value, { stream: true });
+                const lines = buffered.split('\n');
+                buffered = lines.pop(); // La última línea puede estar incompleta
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const event = JSON.parse(line);
+                    if (event.type === 'delta') {
+                        iaText.textContent += event.text;
+                        logDisplay.scrollTop = logDisplay.scrollHeight;
+                    } else {
+                        data = event;
+                    }
+                }
+            }
+            if (!data && buffered.trim()) {
+                data = JSON.parse(buffered); // Respuesta de error sin streaming
+            }
+
             // La actualización del log la maneja fetchLogAndState() en el intervalo.
             // Solo necesitamos manejar la confirmación de guardado.
-            addLogEntryToUI({ tiempo: new Date().toISOString().slice(0, 19).replace('T', ' '), tipo: 'ia', fuente: 'AI', mensaje: data.response_text });
+            iaText.textContent = data.response_text || data.message || '';
 
 
             if (data.should_offer_to_save) {
@@ -163,6 +197,8 @@ document.addEventListener('DOMContentLoaded', () => {
             console.error('Error al enviar comando:', error);
             showMessageBox('Error de comunicación con el servidor. Revisa la consola.');
             addLogEntryToUI({ tiempo: new Date().toISOString().slice(0, 19).replace('T', ' '), tipo: 'error', fuente: 'System', mensaje: `Error de comunicación: ${error.message}` });
+        } finally {
+            isStreamingResponse = false;
         }
     }
 
@@ -0,0 +1,63 @@
+# build_embedding_artifact.py (ubicado en ~/Smart-Home-AI/ml_server/build_embedding_artifact.py)
+#
+# Precalcula, en tiempo de construcción, los embeddings del conocimiento por defecto y de las
+# palabras clave de auto-descripción, y los guarda en un artefacto .npz versionado por modelo
+# y por hash de contenido. Al arrancar, KnowledgeManager.apply_embedding_artifact los reutiliza
+# y sólo se piden al ML Server los textos nuevos o modificados.
+#
+# Uso: python ml_server/build_embedding_artifact.py --knowledge-dir knowledge [--model paraphrase-multilingual-MiniLM-L12-v2]
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core_logic.knowledge_manager import content_hash, embedding_artifact_path
+
+def collect_texts(knowledge_dir):
+    """
+    Textos que KnowledgeManager necesita con embedding: preguntas por defecto y palabras clave.
+    """
+    texts = []
+    default_file = os.path.join(knowledge_dir, "default_knowledge.json")
+    if os.path.exists(default_file):
+        with open(default_file, 'r', encoding='utf-8') as f:
+            texts.extend(item["prompt"] for item in json.load(f).get("general_knowledge", []) if item.get("prompt"))
+    keywords_file = os.path.join(knowledge_dir, "keywords.json")
+    if os.path.exists(keywords_file):
+        with open(keywords_file, 'r', encoding='utf-8') as f:
+            texts.extend(json.load(f).get("self_description_keywords", {}).keys())
+    return list(dict.fromkeys(texts)) # Sin duplicados, conservando el orden
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera el artefacto de embeddings precalculados.")
+    parser.add_argument('--knowledge-dir', default="knowledge")
+    parser.add_argument('--model', default=os.environ.get('EMBEDDING_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2'))
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+
+    texts = collect_texts(args.knowledge_dir)
+    if not texts:
+        print("INFO: No hay textos para precalcular.")
+        return
+
+    model = SentenceTransformer(args.model)
+    vectors = model.encode(texts, batch_size=args.batch_size, show_progress_bar=True).astype(np.float32)
+
+    output = embedding_artifact_path(args.knowledge_dir, args.model)
+    tmp_output = f"{output}.tmp.npz"
+    np.savez(
+        tmp_output,
+        model=np.array(args.model),
+        hashes=np.array([content_hash(text) for text in texts]),
+        vectors=vectors
+    )
+    os.replace(tmp_output, output)
+    print(f"INFO: {len(texts)} embeddings ({vectors.shape[1]} dimensiones) guardados en '{output}'.")
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,97 @@
 # ml_server.py (ubicado en ~/Smart-Home-AI/ml_server/ml_server.py)
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from sentence_transformers import SentenceTransformer
+import hmac
 import logging
 import os
+import threading
+import time
+
+from core_logic.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE, TRACE_HEADER, new_trace_id
+from core_logic.profiler import PROFILER
+from core_logic.log_pipeline import REDACTOR, setup_logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Registro asíncrono (ver core_logic/log_pipeline.py): las peticiones sólo encolan sus registros
+LOG_PIPELINE = setup_logging("ml_server", "ml_server")
 
 app = Flask(__name__)
 
 model = None
+MODEL_NAME = os.environ.get('EMBEDDING_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')
+MAX_BATCH_SIZE = 256
+
+# Token para /admin (vacío = deshabilitado) y perfilado de 1 de cada N peticiones a /get_embedding
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+REDACTOR.add_secret(ADMIN_TOKEN)
+PROFILER.enable_request_sampling(int(os.environ.get('PROFILER_SAMPLE_ONE_IN', 0)))
+
+ENCODE_SECONDS = REGISTRY.histogram("ml_server_encode_seconds", "Duración de model.encode por petición.")
+REQUESTS_TOTAL = REGISTRY.counter("ml_server_requests_total", "Peticiones HTTP atendidas por endpoint y código de estado.", ("endpoint", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("ml_server_request_seconds", "Duración de las peticiones HTTP por endpoint.", ("endpoint",))
+REGISTRY.gauge("ml_server_model_loaded", "1 si el modelo SentenceTransformer está cargado.", lambda: 1 if model is not None else 0)
 
 @app.before_request
 def log_request_info():
-    logging.info(f"Petición entrante: {request.method} {request.url}")
+    # El identificador de traza llega de main_app en la cabecera X-Request-ID
+    g.trace_id = request.headers.get(TRACE_HEADER) or new_trace_id()
+    g.request_started = time.perf_counter()
+    if request.endpoint == 'get_embedding' and PROFILER.should_profile_request():
+        g.profile_scope = PROFILER.track([threading.get_ident()])
+        g.profile_scope.__enter__()
+
+@app.teardown_request
+def finish_request_profile(exc):
+    profile_scope = g.pop('profile_scope', None)
+    if profile_scope is not None:
+        profile_scope.__exit__(None, None, None)
 
 @app.after_request
 def log_response_info(response):
-    logging.info(f"Petición saliente: {request.method} {request.url} - Status: {response.status_code}")
+    endpoint = request.endpoint or "desconocido"
+    elapsed = time.perf_counter() - g.request_started
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    response.headers[TRACE_HEADER] = g.trace_id
+    # Una sola línea de acceso por petición, con campos estructurados (limitada por origen en el registro)
+    logging.info(f"[{g.trace_id}] {request.method} {request.path} - Status: {response.status_code} ({elapsed * 1000:.1f} ms)",
+                 extra={"trace_id": g.trace_id, "endpoint": endpoint, "status": response.status_code, "duration_ms": round(elapsed * 1000, 1)})
     return response
 
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def _admin_authorized():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    if not _admin_authorized():
+        return jsonify({"error": "No autorizado."}), 403
+    if request.method == 'POST':
+        try:
+            PROFILER.control(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    return jsonify({"profiler": PROFILER.status()})
+
+@app.route('/admin/profiler/stacks')
+def admin_profiler_stacks():
+    if not _admin_authorized():
+        return jsonify({"error": "No autorizado."}), 403
+    collapsed = PROFILER.collapsed(reset=request.args.get('reset') == '1')
+    return Response(collapsed, mimetype='text/plain', headers={'Content-Disposition': 'attachment; filename=ml_server.collapsed.txt'})
+
 def load_model():
     global model
     if model is None:
-        logging.info("Cargando modelo SentenceTransformer: paraphrase-multilingual-MiniLM-L12-v2...")
+        logging.info(f"Cargando modelo SentenceTransformer: {MODEL_NAME}...")
         try:
             # Asegúrate de que el modelo se descarga en un directorio persistente si es necesario
             # Para Docker, se descargará en el contenedor si no está en caché
-            model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+            model = SentenceTransformer(MODEL_NAME)
             logging.info("Modelo SentenceTransformer cargado exitosamente.")
             logging.info(f"Usando dispositivo: {model.device}")
         except Exception as e:
@@ -45,14 +109,39 @@ def get_embedding():
         return jsonify({"error": "No se proporcionó texto."}), 400
 
     try:
-        logging.info(f"Generando embedding para texto: '{text[:50]}...'")
-        embedding = model.encode(text).tolist()
-        logging.info(f"Embedding generado para texto: '{text[:50]}...'")
+        with ENCODE_SECONDS.time():
+            embedding = model.encode(text).tolist()
+        logging.debug(f"Embedding generado para texto: '{text[:50]}...'")
         return jsonify({"embedding": embedding})
     except Exception as e:
         logging.error(f"Error al generar embedding: {e}")
         return jsonify({"error": f"Error al generar embedding: {e}"}), 500
 
+@app.route('/get_embeddings', methods=['POST'])
+def get_embeddings():
+    """
+    Versión por lotes de /get_embedding: {"texts": [...]} -> {"embeddings": [...], "model": ...}.
+    Un único model.encode por lote aprovecha mejor la CPU/GPU que una petición por texto.
+    """
+    if model is None:
+        return jsonify({"error": "Modelo no cargado. Intenta de nuevo más tarde."}), 503
+
+    data = request.json or {}
+    texts = data.get('texts')
+    if not texts or not isinstance(texts, list) or not all(isinstance(t, str) and t for t in texts):
+        return jsonify({"error": "Se esperaba una lista 'texts' de textos no vacíos."}), 400
+    if len(texts) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Máximo {MAX_BATCH_SIZE} textos por lote."}), 400
+
+    try:
+        logging.debug(f"Generando {len(texts)} embeddings en lote.")
+        with ENCODE_SECONDS.time():
+            embeddings = model.encode(texts, batch_size=64).tolist()
+        return jsonify({"embeddings": embeddings, "model": MODEL_NAME})
+    except Exception as e:
+        logging.error(f"Error al generar embeddings en lote: {e}")
+        return jsonify({"error": f"Error al generar embeddings en lote: {e}"}), 500
+
 if __name__ == '__main__':
     # Cargar el modelo cuando la aplicación Flask se inicie
     load_model()